@@ -1,29 +1,31 @@
-from google.cloud import logging as cloud_logging
+import argparse
+import collections
 import datetime
-import time
+import json
 import logging
 import os
 import sys
-import argparse
+import time
 
 logging.basicConfig(level=logging.INFO)
 
+EXECUTION_STARTED = "Function execution started"
+EXECUTION_FINISHED = "Function execution took"
 
-def request_log(cloud_logger, project_id, function_name):
-    # Get timestamp of one minute ago
-    time_stamp = time_format((datetime.datetime.utcnow() - datetime.timedelta(seconds=60)))
-    logging.info("Filtering logs on timestamp: {}".format(time_stamp))
+# Entries can be ingested a while after their timestamp, so every query overlaps the previous one by this many seconds.
+# Entries seen before are recognised by their insert id.
+QUERY_OVERLAP_SECONDS = 5
 
-    log_filter = "severity = INFO " \
-                 "AND resource.labels.function_name = \"{}\" " \
-                 "AND timestamp >= \"{}\" ".format(function_name, time_stamp)
+# Only entries of this severity are checked, the last of them has to contain the logging message.
+LOG_SEVERITY = "INFO"
 
-    # Get all logs with the log filter
-    entries = cloud_logger.list_entries(
-        filter_=log_filter, order_by=cloud_logging.DESCENDING,
-        resource_names=["projects/{}".format(project_id)])
+# Cloud Logging allows 60 entries.list requests per minute per project, which the reads of other checks share.
+CLOUD_POLL_INTERVAL_SECONDS = 10.0
+LOG_FILE_POLL_INTERVAL_SECONDS = 0.1
+# When the quota is exceeded anyway, the wait before the next read doubles up to the maximum.
+MAX_BACKOFF_SECONDS = 120.0
 
-    return entries
+LogEntry = collections.namedtuple("LogEntry", ["insert_id", "timestamp", "execution_id", "payload"])
 
 
 def time_format(dt):
@@ -34,58 +36,155 @@ def time_format(dt):
     )
 
 
-def logging_check(function_name, logging_message, max_execution_time):
-    logging.info("Checking logs for message '{}'".format(logging_message))
-    # First wait on the execution of the function that puts XML files on Azure
-    cloud_client = cloud_logging.Client()
-    log_name = 'cloudfunctions.googleapis.com%2Fcloud-functions'
-    cloud_logger = cloud_client.logger(log_name)
-    # Project id where the function is
-    # If function is not in the same project ID of where this function is executed,
-    # a delegated SA should be added
-    project_id = os.environ.get('PROJECT_ID')
-
-    start_time = time.time()
-    # Could take some time before other function has logged
-    entries_list = []
-    finished = False
-    while True:
-        if time.time() - start_time > max_execution_time:
-            # No logs were found within time limit
-            # Other function has probably not been called
-            logging.info("No logs of function {} were found within the time limit".format(function_name))
-            break
+class CloudLoggingSource(object):
+    # Reads the new log entries of a function from Cloud Logging, with the timestamp of the last seen entry as cursor
+    def __init__(self, function_name, project_id, lookback_seconds=60):
+        from google.api_core.exceptions import ResourceExhausted
+        from google.cloud import logging as cloud_logging
+
+        self.cloud_logging = cloud_logging
+        self.quota_errors = (ResourceExhausted,)
+        # If the function is not in the same project as where this script runs, a delegated SA should be added
+        self.cloud_logger = cloud_logging.Client().logger('cloudfunctions.googleapis.com%2Fcloud-functions')
+        self.function_name = function_name
+        self.project_id = project_id
+        self.cursor = datetime.datetime.utcnow() - datetime.timedelta(seconds=lookback_seconds)
+        # Insert ids of the entries in the overlap of the next query, by timestamp
+        self.seen_insert_ids = {}
+        # Seconds to wait before the next read, after exceeding the read quota
+        self.backoff_seconds = 0.0
+
+    def read(self):
+        since = self.cursor - datetime.timedelta(seconds=QUERY_OVERLAP_SECONDS)
+        log_filter = "severity = {} " \
+                     "AND resource.labels.function_name = \"{}\" " \
+                     "AND timestamp >= \"{}\" ".format(LOG_SEVERITY, self.function_name, time_format(since))
+
+        new_entries = []
+        try:
+            # Entries are requested page by page while iterating
+            for entry in self.cloud_logger.list_entries(
+                    filter_=log_filter, order_by=self.cloud_logging.ASCENDING,
+                    resource_names=["projects/{}".format(self.project_id)]):
+                if entry.insert_id in self.seen_insert_ids:
+                    continue
+                timestamp = entry.timestamp.replace(tzinfo=None)
+                self.seen_insert_ids[entry.insert_id] = timestamp
+                self.cursor = max(self.cursor, timestamp)
+                new_entries.append(LogEntry(
+                    entry.insert_id, timestamp, (entry.labels or {}).get("execution_id"), str(entry.payload)))
+        except self.quota_errors as e:
+            # The entries read so far are kept, the next read continues after them
+            self.backoff_seconds = min(max(self.backoff_seconds * 2, CLOUD_POLL_INTERVAL_SECONDS), MAX_BACKOFF_SECONDS)
+            logging.warning("Log read quota exceeded, waiting {} seconds: {}".format(self.backoff_seconds, e))
         else:
-            logging.info('Refreshing logs of function {}...'.format(function_name))
-            entries = request_log(cloud_logger, project_id, function_name)
-            for entry in entries:
-                entries_list.append(entry.payload)
-
-            for i in range(len(entries_list)):
-                if(i-1 >= 0):
-                    if('Function execution started' in entries_list[i]
-                       and 'Function execution took' not in entries_list[i-1]):
-                        logging.info("The execution of function {} has not yet finished".format(function_name))
-                        finished = False
-                    else:
-                        logging.info("The execution of function {} has finished".format(function_name))
-                        finished = True
-
-            if finished:
-                # Check if the function logged the right message as last
-                if(logging_message in entries_list[0]):
-                    logging.info("Last message in logging was '{}'".format(logging_message))
-                    finished = True
-                else:
-                    logging.info("Last message in logging was not '{}'".format(logging_message))
-                    finished = False
-            # If logs have been found
-            if entries_list and finished:
-                break
-            time.sleep(10)
-    if not entries_list or finished is False:
+            self.backoff_seconds = 0.0
+
+        # Forget the entries that the next query does not return anymore
+        oldest = self.cursor - datetime.timedelta(seconds=QUERY_OVERLAP_SECONDS)
+        self.seen_insert_ids = {
+            insert_id: timestamp for insert_id, timestamp in self.seen_insert_ids.items() if timestamp >= oldest
+        }
+        return new_entries
+
+
+class LogFileSource(object):
+    # Reads the lines appended to a local log file since the previous read, for testing without Cloud Logging.
+    # Lines are JSON log entries (like Cloud Logging exports them), or plain text.
+    def __init__(self, path, function_name=None):
+        self.path = path
+        self.function_name = function_name
+        self.offset = 0
+        self.seen_insert_ids = set()
+        self.backoff_seconds = 0.0
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return []
+
+        with open(self.path, "rb") as log_file:
+            log_file.seek(self.offset)
+            data = log_file.read()
+        # Incomplete lines are read again when they are complete
+        data = data[:data.rfind(b"\n") + 1]
+        self.offset += len(data)
+
+        new_entries = []
+        for line in data.decode("utf-8").splitlines():
+            entry = self.parse_line(line)
+            if entry is None or (entry.insert_id and entry.insert_id in self.seen_insert_ids):
+                continue
+            if entry.insert_id:
+                self.seen_insert_ids.add(entry.insert_id)
+            new_entries.append(entry)
+        return new_entries
+
+    def parse_line(self, line):
+        if not line.strip():
+            return None
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return LogEntry(None, None, None, line)
+        if not isinstance(entry, dict):
+            return LogEntry(None, None, None, line)
+
+        function_name = entry.get("resource", {}).get("labels", {}).get("function_name")
+        if self.function_name and function_name and function_name != self.function_name:
+            return None
+        # Like the Cloud Logging query, entries of another severity are skipped
+        if entry.get("severity", LOG_SEVERITY) != LOG_SEVERITY:
+            return None
+        payload = entry.get("textPayload", entry.get("jsonPayload", entry.get("message", "")))
+        return LogEntry(
+            entry.get("insertId"), entry.get("timestamp"), entry.get("labels", {}).get("execution_id"), str(payload))
+
+
+class ExecutionTracker(object):
+    # Keeps the last message of every running execution, so every new entry is checked in constant time
+    def __init__(self, logging_message):
+        self.logging_message = logging_message
+        self.last_messages = {}
+
+    def add(self, entry):
+        # Returns True when an execution finished with the logging message as its last message
+        if EXECUTION_STARTED in entry.payload:
+            self.last_messages[entry.execution_id] = None
+            return False
+
+        if EXECUTION_FINISHED not in entry.payload:
+            self.last_messages[entry.execution_id] = entry.payload
+            return False
+
+        last_message = self.last_messages.pop(entry.execution_id, None)
+        logging.info("An execution of the function has finished")
+        if last_message is not None and self.logging_message in last_message:
+            logging.info("Last message in logging was '{}'".format(self.logging_message))
+            return True
+        logging.info("Last message in logging was not '{}'".format(self.logging_message))
         return False
-    return True
+
+
+def logging_check(function_name, logging_message, max_execution_time, source=None,
+                  poll_interval=CLOUD_POLL_INTERVAL_SECONDS):
+    logging.info("Checking logs for message '{}'".format(logging_message))
+    if source is None:
+        source = CloudLoggingSource(function_name, os.environ.get('PROJECT_ID'))
+    tracker = ExecutionTracker(logging_message)
+
+    deadline = time.time() + max_execution_time
+    # Could take some time before the function has logged
+    while True:
+        for entry in source.read():
+            if tracker.add(entry):
+                return True
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            # The function has probably not been called
+            logging.info("No finished execution of function {} was found within the time limit".format(function_name))
+            return False
+        time.sleep(min(max(poll_interval, source.backoff_seconds), remaining))
 
 
 if __name__ == '__main__':
@@ -93,11 +192,22 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--function-name', required=True)
     parser.add_argument('-l', '--logging-message', required=True)
     parser.add_argument('-e', '--execution-time', required=True)
+    parser.add_argument('-p', '--poll-interval', type=float, default=None)
+    parser.add_argument('--log-file', default=None)
     args = parser.parse_args()
     function_name = args.function_name
     logging_message = args.logging_message
     max_execution_time = args.execution_time
-    check_logging_bool = logging_check(function_name, logging_message, int(max_execution_time))
+
+    if args.log_file:
+        log_source = LogFileSource(args.log_file, function_name)
+        poll_interval = args.poll_interval or LOG_FILE_POLL_INTERVAL_SECONDS
+    else:
+        log_source = CloudLoggingSource(function_name, os.environ.get('PROJECT_ID'))
+        poll_interval = args.poll_interval or CLOUD_POLL_INTERVAL_SECONDS
+
+    check_logging_bool = logging_check(
+        function_name, logging_message, int(max_execution_time), log_source, poll_interval)
     if check_logging_bool is False:
         logging.error("The logging message '{}' could not be found within {} seconds".format(logging_message, max_execution_time))
         sys.exit(1)
@@ -0,0 +1,482 @@
+"""
+Load test of the consume-email -> msg-to-html-body chain, in a single process.
+
+Both functions are loaded from the functions folder with their own config.py, and called with Pub/Sub push requests
+at a configurable rate and concurrency. Pub/Sub and the Firestore are replaced by in-process fakes: an e-mail published
+by consume-email is pushed to msg-to-html-body, recipients are looked up in fake Firestore documents, made from
+RECIPIENT_MAPPING, and the ids of processed e-mails of a Firestore DEDUPLICATION backend are stored in the fake
+Firestore. Set FIRESTORE_EMULATOR_HOST and pass --firestore-emulator to use a Firestore emulator for both.
+
+All requests share the instances of the functions, like an instance handling concurrent requests. Relative paths in
+the msg-to-html-body config (like templates) are resolved against its directory, as when it is deployed.
+
+Throughput, latency percentiles and error rates are reported per function and for the whole chain:
+    python load_test.py --messages 1000 --rate 100 --concurrency 10
+"""
+import argparse
+import base64
+import concurrent.futures
+import datetime
+import html
+import importlib
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from unittest import mock
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "functions")
+CONSUME_EMAIL_DIR = os.path.join(FUNCTIONS_DIR, "consume-email")
+MSG_TO_HTML_BODY_DIR = os.path.join(FUNCTIONS_DIR, "msg-to-html-body")
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+class FakeRequest(object):
+    # The part of a Flask request the functions use
+    def __init__(self, data):
+        self.data = data
+        self.method = "POST"
+        self.headers = {"Content-Type": "application/json"}
+
+    def get_json(self):
+        return json.loads(self.data)
+
+
+def push_request(data, subscription, message_id):
+    # A Pub/Sub push request of a message with the data
+    envelope = {
+        "message": {"data": base64.b64encode(data).decode("ascii"), "messageId": str(message_id)},
+        "subscription": f"projects/load-test/subscriptions/{subscription}",
+    }
+    return FakeRequest(json.dumps(envelope).encode("utf-8"))
+
+
+class FakePublisherClient(object):
+    # Pub/Sub publisher keeping the messages published by a thread, so they can be pushed to the next function
+    latency = 0.0
+    _local = threading.local()
+    _message_ids = itertools.count(1)
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @staticmethod
+    def topic_path(project, topic):
+        return f"projects/{project}/topics/{topic}"
+
+    def publish(self, topic, data, **attributes):
+        if self.latency:
+            time.sleep(self.latency)
+        self.published().append((topic, data))
+
+        future = concurrent.futures.Future()
+        future.set_result(str(next(self._message_ids)))
+        return future
+
+    @classmethod
+    def published(cls):
+        if not hasattr(cls._local, "published"):
+            cls._local.published = []
+        return cls._local.published
+
+    @classmethod
+    def take_published(cls):
+        # Returns the messages published by the current thread since the previous call
+        published = cls.published()
+        cls._local.published = []
+        return published
+
+
+class FakeDocument(object):
+    def __init__(self, data):
+        self._data = data
+        self.exists = data is not None
+
+    def get(self, field):
+        # Like a Firestore document snapshot, a missing field raises a KeyError
+        return self._data[field]
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeWatch(object):
+    is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+
+
+class FakeQuery(object):
+    def __init__(self, client, collection_name, filters=()):
+        self.client = client
+        self.collection_name = collection_name
+        self.filters = filters
+
+    def where(self, field, op, value):
+        if op != "==":
+            raise ValueError(f"Operator {op} is not supported by the fake Firestore")
+        return FakeQuery(self.client, self.collection_name, self.filters + ((field, value),))
+
+    def documents(self):
+        return [
+            FakeDocument(document)
+            for document in self.client.collections.get(self.collection_name, [])
+            if all(field in document and document[field] == value for field, value in self.filters)
+        ]
+
+    def stream(self):
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        return iter(self.documents())
+
+    def on_snapshot(self, callback):
+        callback(self.documents(), [], datetime.datetime.utcnow())
+        return FakeWatch()
+
+    def document(self, document_id):
+        return FakeDocumentReference(self.client, self.collection_name, document_id)
+
+
+class FakeDocumentReference(object):
+    # Document with an id, like the ids of processed e-mails stored by the deduplication of consume-email
+    def __init__(self, client, collection_name, document_id):
+        self.client = client
+        self.key = (collection_name, document_id)
+
+    def get(self):
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        return FakeDocument(self.client.documents.get(self.key))
+
+    def set(self, data):
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        self.client.documents[self.key] = dict(data)
+
+
+class FakeFirestoreClient(object):
+    # Firestore client with in-memory collections of documents (dictionaries), and documents by collection and id
+    def __init__(self, collections, latency=0.0):
+        self.collections = collections
+        self.documents = {}
+        self.latency = latency
+
+    def collection(self, collection_name):
+        return FakeQuery(self, collection_name)
+
+
+def recipient_documents(recipient_mapping):
+    # A document per recipient mapping, found by its firestore_ids, with a recipient address as firestore_value
+    collections = {}
+    for key, recipient_dict in recipient_mapping.items():
+        document = {
+            fs_id: id_dict[fs_id]
+            for id_dict in recipient_dict.get("firestore_ids") or []
+            for fs_id in id_dict
+        }
+        document[recipient_dict.get("firestore_value")] = f"recipient-{key}@example.com"
+        collections.setdefault(recipient_dict.get("firestore_collection_name"), []).append(document)
+    return collections
+
+
+def fake_deduplication_backends(consume_email, db_client):
+    # Ids of processed e-mails that consume-email stores in the Firestore are stored in the fake Firestore instead
+    from emailprocessor.deduplicator import FirestoreBackend
+
+    for processor in (consume_email.parser, consume_email.batch_parser):
+        deduplicator = processor.deduplicator
+        if deduplicator is not None and isinstance(deduplicator.backend, FirestoreBackend):
+            deduplicator.backend = FirestoreBackend(deduplicator.backend.collection_name, db_client)
+
+
+def load_function(directory, config_directory):
+    # Imports the main module of a function with its config, and removes both from sys.modules again, so the next
+    # function gets its own. The packages of the functions have different names, so they can stay.
+    saved_path = list(sys.path)
+    sys.modules.pop("main", None)
+    sys.modules.pop("config", None)
+    sys.path[:0] = [config_directory, directory]
+    try:
+        main = importlib.import_module("main")
+        config = sys.modules["config"]
+    finally:
+        sys.path[:] = saved_path
+        sys.modules.pop("main", None)
+        sys.modules.pop("config", None)
+    return main, config
+
+
+def datetime_fields(html_template_paths):
+    # Message fields that are formatted as a datetime in a template
+    fields = set()
+    for template_info in (html_template_paths or {}).values():
+        for arg_field_values in (template_info.get("template_args") or {}).values():
+            if arg_field_values.get("arg_field_format") != "DATETIME":
+                continue
+            fields.update(field for field, value in arg_field_values.items() if value == "MESSAGE_FIELD")
+    return fields
+
+
+def generate_payloads(count, size, consume_email_config, msg_to_html_body_config):
+    # E-mails with all FIELDS, valid for both configs. The type, template and recipient mapping fields cycle through
+    # the configured values, and are headers like datetime fields. The other fields are rows of a table.
+    cycled_values = {
+        consume_email_config.TYPE_FIELD: list(consume_email_config.ALLOWED_TYPES),
+        msg_to_html_body_config.TEMPLATE_PATH_FIELD: list(msg_to_html_body_config.HTML_TEMPLATE_PATHS or []),
+        msg_to_html_body_config.RECIPIENT_MAPPING_MESSAGE_FIELD: list(msg_to_html_body_config.RECIPIENT_MAPPING),
+    }
+    formatted_fields = datetime_fields(msg_to_html_body_config.HTML_TEMPLATE_PATHS)
+    fields = list(dict.fromkeys(list(consume_email_config.FIELDS) + [consume_email_config.TYPE_FIELD]))
+    start = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+
+    for i in range(count):
+        sent_on = start + datetime.timedelta(seconds=i)
+        headers = []
+        rows = []
+        for field in fields:
+            if cycled_values.get(field):
+                value = cycled_values[field][i % len(cycled_values[field])]
+                headers.append(f"<p>{field}: &lt;&lt;{html.escape(value)}&gt;&gt;</p>\n")
+            elif field in formatted_fields:
+                value = sent_on.strftime("%Y%m%d%H%M%S")
+                headers.append(f"<p>{field}: &lt;&lt;{html.escape(value)}&gt;&gt;</p>\n")
+            else:
+                rows.append(f"<tr><td>{field}:</td><td>{html.escape(field)} {i}</td></tr>\n")
+
+        body = "<html><body>\n" + "".join(headers) + "<table><tbody>\n" + "".join(rows) + "</tbody></table>\n"
+        filler = f"<blockquote>Quoted history of ticket {i}, to reach the size of a real e-mail.</blockquote>\n"
+        body += filler * max(0, (size - len(body)) // len(filler)) + "</body></html>"
+
+        yield {
+            "email": {
+                "sent_on": sent_on.isoformat(),
+                "received_on": sent_on.isoformat(),
+                "subject": f"[Ticket#{i:010d}] Load test",
+                "sender": consume_email_config.SENDER_WHITELIST[0],
+                "recipient": "load-test@example.com",
+                "body": body,
+                "attachments": [],
+            }
+        }
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    summary = {
+        f"p{int(percentile * 100)}_ms": latencies[min(len(latencies) - 1, int(len(latencies) * percentile))] * 1000
+        for percentile in PERCENTILES
+    }
+    summary["max_ms"] = latencies[-1] * 1000
+    return summary
+
+
+class StageStatistics(object):
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.latencies = []
+
+    def to_dict(self, seconds):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "rejected": self.rejected,
+            "throughput": self.requests / seconds if seconds else 0.0,
+            "latency": percentiles(self.latencies),
+        }
+
+
+class LoadTest(object):
+    def __init__(self, consume_email, msg_to_html_body, root, concurrency):
+        self.consume_email = consume_email
+        self.msg_to_html_body = msg_to_html_body
+        self.root = root
+        self.concurrency = concurrency
+
+        self.statistics = {"consume-email": StageStatistics(), "msg-to-html-body": StageStatistics()}
+        self.chain_latencies = []
+        self._lock = threading.Lock()
+        self._deliveries = None
+
+    def run(self, requests, rate):
+        # With a rate, requests are sent on schedule, whether earlier ones finished or not, and latencies include the
+        # time requests waited for a free worker. Without one, a request is sent as soon as a worker is free.
+        consumers = concurrent.futures.ThreadPoolExecutor(self.concurrency)
+        self._deliveries = concurrent.futures.ThreadPoolExecutor(self.concurrency)
+        free_workers = threading.Semaphore(self.concurrency)
+
+        start = time.perf_counter()
+        for i, request in enumerate(requests):
+            if rate:
+                scheduled = start + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                free_workers.acquire()
+                scheduled = time.perf_counter()
+            consumers.submit(self.consume, request, scheduled, free_workers)
+
+        consumers.shutdown(wait=True)
+        self._deliveries.shutdown(wait=True)
+        return time.perf_counter() - start
+
+    def consume(self, request, scheduled, free_workers):
+        statistics = self.statistics["consume-email"]
+        FakePublisherClient.take_published()
+        error = False
+        try:
+            self.consume_email.email_parser(request)
+        except Exception as e:
+            logging.error(f"consume-email failed: {e}")
+            error = True
+        finished = time.perf_counter()
+        published = FakePublisherClient.take_published()
+        free_workers.release()
+
+        with self._lock:
+            statistics.requests += 1
+            statistics.errors += error
+            statistics.rejected += not error and not published
+            statistics.latencies.append(finished - scheduled)
+
+        for message_id, (topic, data) in enumerate(published):
+            self._deliveries.submit(self.deliver, data, scheduled, message_id)
+
+    def deliver(self, data, scheduled, message_id):
+        statistics = self.statistics["msg-to-html-body"]
+        request = push_request(self.bridge(data), "msg-to-html-body", message_id)
+        FakePublisherClient.take_published()
+        started = time.perf_counter()
+        error = False
+        try:
+            self.msg_to_html_body.msg_to_html_body(request)
+        except Exception as e:
+            logging.error(f"msg-to-html-body failed: {e}")
+            error = True
+        finished = time.perf_counter()
+        published = FakePublisherClient.take_published()
+
+        with self._lock:
+            statistics.requests += 1
+            statistics.errors += error
+            statistics.rejected += not error and not published
+            statistics.latencies.append(finished - started)
+            if published:
+                self.chain_latencies.append(finished - scheduled)
+
+    def bridge(self, data):
+        # consume-email publishes {"gobits": [...], "parsed_email": {...}}, msg-to-html-body reads the fields from a
+        # root in its DATA_SELECTOR field
+        message = json.loads(data)
+        payload = {
+            "gobits": message.get("gobits", []),
+            self.msg_to_html_body.parser.data_selector: {self.root: message["parsed_email"]},
+        }
+        return json.dumps(payload).encode("utf-8")
+
+    def report(self, sent, seconds):
+        delivered = len(self.chain_latencies)
+        return {
+            "sent": sent,
+            "seconds": seconds,
+            "functions": {name: statistics.to_dict(seconds) for name, statistics in self.statistics.items()},
+            "chain": {
+                "delivered": delivered,
+                "delivery_rate": delivered / sent if sent else 0.0,
+                "throughput": delivered / seconds if seconds else 0.0,
+                "latency": percentiles(self.chain_latencies),
+            },
+        }
+
+
+def print_report(report):
+    def latency(summary):
+        return ", ".join(f"{name[:-3]} {value:.2f} ms" for name, value in summary.items()) or "-"
+
+    print(f"Sent {report['sent']} e-mails in {report['seconds']:.2f}s")
+    for name, statistics in report["functions"].items():
+        print(
+            f"{name:>17}: {statistics['requests']} requests ({statistics['throughput']:.1f}/s), "
+            f"{statistics['errors']} errors ({statistics['error_rate']:.2%}), {statistics['rejected']} rejected, "
+            f"latency {latency(statistics['latency'])}"
+        )
+    chain = report["chain"]
+    print(
+        f"{'chain':>17}: {chain['delivered']} delivered ({chain['delivery_rate']:.2%}, {chain['throughput']:.1f}/s), "
+        f"latency {latency(chain['latency'])}"
+    )
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Load test of the consume-email -> msg-to-html-body chain")
+    argparser.add_argument("-m", "--messages", type=int, default=1000, help="Number of e-mails to send")
+    argparser.add_argument("-r", "--rate", type=float, default=0, help="E-mails per second, 0 for as fast as possible")
+    argparser.add_argument("-c", "--concurrency", type=int, default=10, help="Requests handled at the same time")
+    argparser.add_argument("-s", "--size", type=int, default=10240, help="Size of generated e-mail bodies")
+    argparser.add_argument("-i", "--input", help="Send the e-mail payloads of a (gzipped) JSONL file instead")
+    argparser.add_argument("--consume-email-config", default=CONSUME_EMAIL_DIR, help="Directory with a config.py")
+    argparser.add_argument("--msg-to-html-body-config", default=MSG_TO_HTML_BODY_DIR, help="Directory with a config.py")
+    argparser.add_argument("--root", default="email", help="Root of the parsed fields in msg-to-html-body messages")
+    argparser.add_argument("--latency-ms", type=float, default=0, help="Latency of fake Pub/Sub and Firestore calls")
+    argparser.add_argument("--firestore-data", help="JSON file with the fake Firestore collections of documents")
+    argparser.add_argument("--firestore-emulator", action="store_true", help="Use the Firestore (emulator) client")
+    argparser.add_argument("-o", "--output", help="Write the report as JSON to this file")
+    argparser.add_argument("-v", "--verbose", action="store_true", help="Show the logging of the functions")
+    args = argparser.parse_args()
+
+    # Set before the functions configure logging
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    os.environ.setdefault("DATA_SELECTOR", "data")
+
+    consume_email, consume_email_config = load_function(CONSUME_EMAIL_DIR, os.path.abspath(args.consume_email_config))
+    from emailprocessor.payloads import iter_payloads
+
+    msg_to_html_body, msg_to_html_body_config = load_function(
+        MSG_TO_HTML_BODY_DIR, os.path.abspath(args.msg_to_html_body_config)
+    )
+    os.chdir(MSG_TO_HTML_BODY_DIR)
+
+    if not args.firestore_emulator:
+        if args.firestore_data:
+            with open(args.firestore_data) as firestore_data_file:
+                collections = json.load(firestore_data_file)
+        else:
+            collections = recipient_documents(msg_to_html_body_config.RECIPIENT_MAPPING)
+        db_client = FakeFirestoreClient(collections, args.latency_ms / 1000)
+        msg_to_html_body.parser.gcp_firestore.db_client = db_client
+        fake_deduplication_backends(consume_email, db_client)
+
+    if args.input:
+        payloads = itertools.islice(iter_payloads(args.input), args.messages)
+    else:
+        payloads = generate_payloads(args.messages, args.size, consume_email_config, msg_to_html_body_config)
+    # Requests are made before starting, so sending them costs (almost) nothing
+    requests = [
+        push_request(json.dumps(payload).encode("utf-8"), "consume-email", message_id)
+        for message_id, payload in enumerate(payloads)
+    ]
+
+    FakePublisherClient.latency = args.latency_ms / 1000
+    load_test = LoadTest(consume_email, msg_to_html_body, args.root, args.concurrency)
+    with mock.patch("google.cloud.pubsub_v1.PublisherClient", FakePublisherClient):
+        seconds = load_test.run(requests, args.rate)
+
+    report = load_test.report(len(requests), seconds)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
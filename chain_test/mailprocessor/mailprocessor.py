@@ -1,6 +1,13 @@
 import config
 import logging
 import base64
+import itertools
+import os
+import string
+import threading
+import time
+from concurrent import futures
+from email.header import Header
 from apiclient import errors
 
 import google.auth
@@ -15,14 +22,60 @@ from email.mime.text import MIMEText
 logging.basicConfig(level=logging.INFO)
 TOKEN_URI = 'https://accounts.google.com/o/oauth2/token'  # nosec
 
+# Optional: values of template variables in load mode, per variable a list of values the mails cycle through
+LOAD_FIELD_VALUES = getattr(config, "LOAD_FIELD_VALUES", {})
+
+# Spliced out of the prebuilt MIME message, and replaced by the subject and (base64) body of every mail
+SUBJECT_PLACEHOLDER = b"SUBJECT-PLACEHOLDER-5f0c2e"
+BODY_PLACEHOLDER = b"BODY-PLACEHOLDER-5f0c2e"
+
+# Maximum number of mails in a single Gmail batch request
+MAX_BATCH_SIZE = 100
+
+
+class RateLimiter(object):
+    # Spaces out mails evenly over time, shared by all threads. A rate of 0 does not limit.
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self, mails=1):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next_time, now)
+            self.next_time = start + mails * self.interval
+        if start > now:
+            time.sleep(start - now)
+
 
 class MailProcessor(object):
     def __init__(self):
-        credentials, project_id = google.auth.default(scopes=['https://www.googleapis.com/auth/iam'])
-        delegated_credentials = self.get_delegated_credentials(credentials)
-        self.mail_service = googleapiclient.discovery.build(
-            'gmail', 'v1', credentials=delegated_credentials, cache_discovery=False)
         self.mail_addresses = config.MAIL_ADDRESSES
+        # Credentials and Gmail services are created on first use, so dry runs do not need them.
+        # Gmail services are not thread-safe, every thread gets its own.
+        self._credentials = None
+        self._credentials_lock = threading.Lock()
+        self._local = threading.local()
+        self._templates = {}
+        self._skeleton = None
+
+    @property
+    def mail_service(self):
+        if getattr(self._local, "mail_service", None) is None:
+            self._local.mail_service = googleapiclient.discovery.build(
+                'gmail', 'v1', credentials=self.credentials, cache_discovery=False)
+        return self._local.mail_service
+
+    @property
+    def credentials(self):
+        with self._credentials_lock:
+            if self._credentials is None:
+                credentials, project_id = google.auth.default(scopes=['https://www.googleapis.com/auth/iam'])
+                self._credentials = self.get_delegated_credentials(credentials)
+        return self._credentials
 
     @staticmethod
     def get_delegated_credentials(credentials):
@@ -42,21 +95,68 @@ class MailProcessor(object):
 
         return creds
 
-    def generate_mail(self, mail_template):
-        msg = MIMEMultipart('alternative')
-        msg['From'] = config.GMAIL_REPLYTO_ADDRESS
-        msg['Subject'] = config.SUBJECT
-        msg['To'] = self.mail_addresses[0]
+    def get_template(self, mail_template):
+        # Templates are only read once
+        if mail_template not in self._templates:
+            with open(mail_template, 'r') as template_file:
+                self._templates[mail_template] = string.Template(template_file.read())
+        return self._templates[mail_template]
+
+    def get_skeleton(self):
+        # The MIME message is built once, with placeholders for the subject and body, and split at them
+        if self._skeleton is None:
+            msg = MIMEMultipart('alternative')
+            msg['From'] = config.GMAIL_REPLYTO_ADDRESS
+            msg['Subject'] = SUBJECT_PLACEHOLDER.decode()
+            msg['To'] = self.mail_addresses[0]
+
+            if len(self.mail_addresses) > 1:
+                msg['Bcc'] = ','.join(self.mail_addresses[1:])
 
-        if len(self.mail_addresses) > 1:
-            msg['Bcc'] = ','.join(self.mail_addresses[1:])
+            # The body is encoded as base64 by make_mail, which is what this part's Content-Transfer-Encoding says
+            text = MIMEText('', 'html', 'utf-8')
+            text.set_payload(BODY_PLACEHOLDER.decode())
+            msg.attach(text)
 
-        msg.attach(MIMEText(open(mail_template, 'r').read(), 'html'))
-        raw = base64.urlsafe_b64encode(msg.as_bytes())
+            head, rest = msg.as_bytes().split(SUBJECT_PLACEHOLDER)
+            middle, tail = rest.split(BODY_PLACEHOLDER)
+            self._skeleton = (head, middle, tail)
+        return self._skeleton
+
+    def make_mail(self, subject, html_body):
+        head, middle, tail = self.get_skeleton()
+        if subject.isascii():
+            encoded_subject = subject.encode()
+        else:
+            encoded_subject = Header(subject, 'utf-8').encode().encode()
+        encoded_body = base64.encodebytes(html_body.encode('utf-8')).rstrip(b"\n")
+        return b"".join((head, encoded_subject, middle, encoded_body, tail))
+
+    def generate_mail(self, mail_template):
+        mail = self.make_mail(config.SUBJECT, self.get_template(mail_template).template)
+        raw = base64.urlsafe_b64encode(mail)
         raw = raw.decode()
 
         return {'raw': raw}
 
+    def generate_mails(self, mail_template, count, first_ticket_number=1):
+        # Mails with varied ticket numbers and field values, for load tests. The template and SUBJECT can use the
+        # variables ${index}, ${ticket_number} and those of LOAD_FIELD_VALUES. When SUBJECT does not contain the ticket
+        # number, it is prefixed with it.
+        template = self.get_template(mail_template)
+        subject = config.SUBJECT
+        if "${ticket_number}" not in subject:
+            subject = "[Ticket#${ticket_number}] " + subject
+        subject_template = string.Template(subject)
+
+        for index in range(count):
+            variables = {
+                name: values[index % len(values)] for name, values in LOAD_FIELD_VALUES.items() if values
+            }
+            variables["index"] = index
+            variables["ticket_number"] = first_ticket_number + index
+            yield self.make_mail(subject_template.safe_substitute(variables), template.safe_substitute(variables))
+
     def send_mails(self, mail_template):
         try:
             mail_body = self.generate_mail(mail_template)
@@ -66,3 +166,72 @@ class MailProcessor(object):
         except errors.HttpError as e:
             logging.error('An exception occurred when sending an email: {}'.format(e))
             return False
+
+    def send_load(self, mail_template, count, workers=4, rate=0, batch_size=1, dry_run_directory=None,
+                  first_ticket_number=1):
+        # Sends count mails on a pool of workers, at most rate mails per second. With a batch size above 1, the mails
+        # are sent in Gmail batch requests. With a dry run directory, the mails are written there as .eml files instead.
+        batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        rate_limiter = RateLimiter(rate)
+        if dry_run_directory:
+            os.makedirs(dry_run_directory, exist_ok=True)
+            send = self.write_batch
+        else:
+            send = self.send_batch
+
+        def send_limited(batch):
+            rate_limiter.wait(len(batch))
+            return send(batch, dry_run_directory)
+
+        start = time.monotonic()
+        sent = 0
+        mails = enumerate(self.generate_mails(mail_template, count, first_ticket_number))
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # At most 2 batches per worker are waiting, so mails are generated while others are sent
+            pending = set()
+            while True:
+                batch = list(itertools.islice(mails, batch_size))
+                if batch:
+                    pending.add(executor.submit(send_limited, batch))
+                if len(pending) >= 2 * workers or (not batch and pending):
+                    done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                    sent += sum(future.result() for future in done)
+                if not batch and not pending:
+                    break
+
+        seconds = time.monotonic() - start
+        logging.info("{} of {} emails {} in {:.2f}s ({:.1f}/s)".format(
+            sent, count, "written" if dry_run_directory else "sent", seconds, sent / (seconds or 1)))
+        return {"sent": sent, "failed": count - sent, "seconds": seconds}
+
+    def send_batch(self, batch, dry_run_directory=None):
+        # Returns the number of mails sent
+        bodies = [{'raw': base64.urlsafe_b64encode(mail).decode()} for _, mail in batch]
+        try:
+            if len(bodies) == 1:
+                self.mail_service.users().messages().send(userId="me", body=bodies[0]).execute()
+                return 1
+
+            failures = []
+
+            def callback(request_id, response, exception):
+                if exception is not None:
+                    failures.append(exception)
+
+            batch_request = self.mail_service.new_batch_http_request(callback=callback)
+            for body in bodies:
+                batch_request.add(self.mail_service.users().messages().send(userId="me", body=body))
+            batch_request.execute()
+            for exception in failures:
+                logging.error('An exception occurred when sending an email: {}'.format(exception))
+            return len(bodies) - len(failures)
+        except errors.HttpError as e:
+            logging.error('An exception occurred when sending {} emails: {}'.format(len(bodies), e))
+            return 0
+
+    @staticmethod
+    def write_batch(batch, dry_run_directory):
+        for index, mail in batch:
+            with open(os.path.join(dry_run_directory, "{:06d}.eml".format(index)), 'wb') as eml_file:
+                eml_file.write(mail)
+        return len(batch)
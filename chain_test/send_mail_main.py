@@ -28,9 +28,30 @@ def handler(mail_template):
     return 'OK', 204
 
 
+def load_handler(mail_template, count, workers, rate, batch_size, dry_run_directory, first_ticket_number):
+    statistics = parser.send_load(
+        mail_template, count, workers=workers, rate=rate, batch_size=batch_size,
+        dry_run_directory=dry_run_directory, first_ticket_number=first_ticket_number)
+    if statistics["failed"]:
+        logging.info("{} of {} E-Mails were not send".format(statistics["failed"], count))
+        sys.exit(1)
+    logging.info("{} E-Mails were send".format(count))
+
+
 if __name__ == '__main__':
     argparser = argparse.ArgumentParser()
     argparser.add_argument('-t', '--mail-template', required=True)
+    argparser.add_argument('-n', '--count', type=int, default=None)
+    argparser.add_argument('-w', '--workers', type=int, default=4)
+    argparser.add_argument('-r', '--rate', type=float, default=0)
+    argparser.add_argument('-b', '--batch-size', type=int, default=1)
+    argparser.add_argument('--first-ticket-number', type=int, default=1)
+    argparser.add_argument('--dry-run', default=None)
     args = argparser.parse_args()
     mail_template = args.mail_template
-    handler(mail_template)
+    if args.count is None and args.dry_run is None:
+        handler(mail_template)
+    else:
+        load_handler(
+            mail_template, args.count or 1, args.workers, args.rate, args.batch_size, args.dry_run,
+            args.first_ticket_number)
@@ -0,0 +1,87 @@
+"""
+Generates synthetic structured e-mails, as sent by Outlook, for benchmarking the parser.
+
+Each e-mail has "field: <<value>>" headers and a 2-column table, wrapped in nested Outlook markup with &nbsp; noise,
+and is padded with quoted e-mail history up to the requested size.
+"""
+import random
+
+OUTLOOK_HEAD = (
+    "<html xmlns:v=\"urn:schemas-microsoft-com:vml\" xmlns:o=\"urn:schemas-microsoft-com:office:office\">\n"
+    "<head>\n<meta http-equiv=\"Content-Type\" content=\"text/html; charset=utf-8\">\n"
+    "<style><!--\np.MsoNormal, li.MsoNormal, div.MsoNormal {margin:0cm; font-size:11.0pt;}\n--></style>\n"
+    "<!--[if gte mso 9]><xml><o:shapedefaults v:ext=\"edit\" spidmax=\"1026\" /></xml><![endif]-->\n"
+    "</head>\n<body lang=\"NL\" link=\"#0563C1\" vlink=\"#954F72\">\n<div class=\"WordSection1\">\n"
+)
+OUTLOOK_TAIL = "</div>\n</body>\n</html>\n"
+
+WORDS = [
+    "ticket", "status", "melding", "storing", "adres", "klant", "monteur", "gepland", "afgehandeld", "locatie",
+    "aansluiting", "levering", "contract", "nummer", "datum", "opmerking", "prioriteit", "regio", "netwerk", "kabel",
+]
+
+
+def _words(rnd, count, nbsp_ratio):
+    words = [rnd.choice(WORDS) for _ in range(count)]
+    return "".join(
+        word + ("&nbsp;" if rnd.random() < nbsp_ratio else " ") for word in words
+    ).rstrip()
+
+
+def _wrap(rnd, content, nesting):
+    # Outlook wraps text in paragraphs and (nested) spans with inline styles.
+    for depth in range(nesting):
+        if depth == 0:
+            content = f"<p class=\"MsoNormal\">{content}<o:p></o:p></p>"
+        else:
+            content = f"<span style=\"font-size:{rnd.choice((9, 10, 11))}.0pt;color:#1F497D\">{content}</span>"
+    return content
+
+
+def generate_email(size=10240, headers=10, table_rows=20, nesting=3, nbsp_ratio=0.1, type_field="type_field",
+                   type_value="SOME_TYPE", seed=0):
+    """
+    Generates the HTML body of a structured e-mail.
+
+    :param size: Approximate size of the body in characters, padded with quoted history.
+    :param headers: Number of "field: <<value>>" headers, including the type field.
+    :param table_rows: Number of rows in the field-value table.
+    :param nesting: Depth of the Outlook markup around every text.
+    :param nbsp_ratio: Fraction of spaces that is a &nbsp; entity.
+    :param type_field: Name of the type field, added as the first header.
+    :param type_value: Value of the type field.
+    :param seed: Seed of the random generator, the same parameters and seed give the same e-mail.
+    :return: The HTML body.
+    :rtype: str
+    """
+    rnd = random.Random(seed)
+    parts = [OUTLOOK_HEAD]
+
+    parts.append(_wrap(rnd, f"{type_field}: &lt;&lt;{type_value}&gt;&gt;", nesting) + "\n")
+    for i in range(1, headers):
+        if i % 5 == 0:
+            # Multi-line value
+            value = "<br>\n".join(_words(rnd, 6, nbsp_ratio) for _ in range(3))
+        else:
+            value = _words(rnd, rnd.randint(1, 4), nbsp_ratio)
+        parts.append(_wrap(rnd, f"header field {i}: &lt;&lt;{value}&gt;&gt;", nesting) + "\n")
+
+    parts.append("<table class=\"MsoNormalTable\" border=\"0\" cellspacing=\"0\" cellpadding=\"0\">\n<tbody>\n")
+    for i in range(table_rows):
+        field = _wrap(rnd, f"table field {i}:", nesting)
+        value = _wrap(rnd, _words(rnd, rnd.randint(1, 6), nbsp_ratio), nesting)
+        parts.append(
+            f"<tr>\n<td width=\"200\" valign=\"top\">{field}</td>\n<td valign=\"top\">{value}</td>\n</tr>\n"
+        )
+    parts.append("</tbody>\n</table>\n")
+
+    # Quoted history, as in long e-mail threads
+    length = sum(len(part) for part in parts) + len(OUTLOOK_TAIL)
+    while length < size:
+        quote = _wrap(rnd, _words(rnd, rnd.randint(5, 30), nbsp_ratio) + ": " + _words(rnd, 5, nbsp_ratio), nesting)
+        quote = f"<blockquote style=\"border-left:solid #CCCCCC 1.0pt\">{quote}</blockquote>\n"
+        parts.append(quote)
+        length += len(quote)
+
+    parts.append(OUTLOOK_TAIL)
+    return "".join(parts)
@@ -0,0 +1,106 @@
+"""
+Compares the header tokenizer with the regular expression it replaced, on inputs of growing size.
+
+The pathological inputs are long lines with colons that are not followed by a value, on which the regular expression
+takes quadratic time, as it tries every position of a line as the start of a field. The tokenizer has to stay linear,
+and give the same headers as the regular expression on all inputs. Exits with 1 when it does not.
+
+Run from the consume-email directory:
+    python -m benchmarks.header_benchmark
+"""
+import argparse
+import re
+import sys
+import time
+
+from emailprocessor.headertokenizer import tokenize_headers
+
+HEADER_REGEX = re.compile(r"([^\n:]+):\s*<<?([^>]*)>>?")
+
+
+def long_line(size):
+    # A single line of text ending in a colon without a value
+    return "x" * (size - 1) + ":"
+
+
+def colons_without_values(size):
+    # Many "field:" parts without "<<", as in a pasted log or a URL-heavy e-mail, followed by a single header
+    part = "some words before a colon: "
+    return part * (size // len(part)) + "\nfield: <<value>>"
+
+
+def greater_than_signs(size):
+    # Long lines full of ">" ending in a colon, followed by whitespace, from which a regular expression restarts
+    part = "a>" * 500 + ":" + "\n" * 100
+    return part * (size // len(part)) + "\nfield: <<value>>"
+
+
+def headers(size):
+    # Realistic rendered text, with a header on every line
+    part = "field name: <<some value>>\nanother field: <<multi\nline value>>\n"
+    return part * (size // len(part))
+
+
+INPUTS = {
+    "long_line": long_line,
+    "colons_without_values": colons_without_values,
+    "greater_than_signs": greater_than_signs,
+    "headers": headers,
+}
+
+
+def measure(function, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-s", "--sizes", type=int, nargs="+", default=[1000, 2000, 4000, 8000, 16000, 32000])
+    argparser.add_argument("-m", "--max-regex-seconds", type=float, default=5.0,
+                           help="Stop measuring the regular expression on an input once it takes longer than this")
+    argparser.add_argument("-g", "--max-growth", type=float, default=3.0,
+                           help="Allowed growth of the tokenizer time, relative to the growth of the input size")
+    args = argparser.parse_args()
+
+    mismatches = 0
+    nonlinear = 0
+    for name, generate in INPUTS.items():
+        print(f"{name}:")
+        previous = None
+        previous_size = None
+        regex_too_slow = False
+        for size in args.sizes:
+            string = generate(size)
+
+            tokenizer_seconds = measure(lambda: list(tokenize_headers(string)))
+            growth = f"x{tokenizer_seconds / previous:.1f}" if previous else ""
+            if previous and tokenizer_seconds / previous > args.max_growth * size / previous_size:
+                growth += " NOT LINEAR"
+                nonlinear += 1
+            previous = tokenizer_seconds
+            previous_size = size
+
+            regex_result = "skipped"
+            if not regex_too_slow:
+                regex_seconds = measure(lambda: HEADER_REGEX.findall(string), repeat=1)
+                regex_too_slow = regex_seconds > args.max_regex_seconds
+                regex_result = f"{regex_seconds * 1000:10.3f} ms"
+
+                if HEADER_REGEX.findall(string) != list(tokenize_headers(string)):
+                    print(f"  Tokenizer gives different headers than the regular expression for {size} characters")
+                    mismatches += 1
+
+            print(f"  {size:>8} chars: tokenizer {tokenizer_seconds * 1000:8.3f} ms {growth:>6}, regex {regex_result}")
+
+    if mismatches or nonlinear:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Benchmarks the parser stages of EmailProcessor on a synthetic corpus of structured e-mails.
+
+Reports throughput, p50/p99 latency and peak memory per stage and e-mail size, and saves the results as JSON, so
+results of different commits can be compared.
+
+Run from the consume-email directory (a config.py has to be present):
+    python -m benchmarks.parse_benchmark --output results.json
+    python -m benchmarks.parse_benchmark --output new.json --compare results.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import platform
+import subprocess  # nosec
+import sys
+import time
+import tracemalloc
+
+from emailprocessor import EmailProcessor
+from emailprocessor.emailprocessor import TYPE_FIELD
+from emailprocessor.fieldplan import FieldPlan
+from emailprocessor.htmlextractors import HTML_EXTRACTORS, IncrementalExtractor
+
+from .corpus import generate_email
+
+DEFAULT_SIZES = [1024, 10240, 102400, 1048576]
+
+# Fields of the synthetic e-mails (see corpus.py) used for the field plan stages, instead of the configured FIELDS,
+# so that the incremental stages can stop before the quoted history.
+DEFAULT_FIELDS = ["header_field_1", "header_field_2", "table_field_0", "table_field_1"]
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def measure(function, argument, repeat):
+    function(argument)
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function(argument)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    mean = sum(latencies) / len(latencies)
+    return {
+        "repeat": repeat,
+        "mean_ms": mean * 1000,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "ops_per_second": 1 / mean if mean else 0.0,
+        "peak_memory_kb": peak_memory / 1024,
+    }
+
+
+def stages(processor):
+    """
+    :return: Tuples of stage name, function, and a function giving the stage's input from the HTML body.
+    """
+    for name, extractor in sorted(HTML_EXTRACTORS.items()):
+        yield f"extract[{name}]", extractor.extract, lambda html: html
+
+    streaming = HTML_EXTRACTORS["streaming"]
+    yield "get_headers", processor._get_headers, lambda html: streaming.extract(html)[0]
+    yield "get_html_table_contents", processor._get_html_table_contents, lambda html: streaming.extract(html)[1]
+    yield (
+        "get_html_table_contents[field plan]",
+        lambda table_data: processor._get_html_table_contents(table_data, processor.field_plan),
+        lambda html: streaming.extract(html)[1],
+    )
+
+    for name, extractor in sorted(HTML_EXTRACTORS.items()):
+        def parse_structured_mail(html, extractor=extractor):
+            processor.html_extractor = extractor
+            return processor._parse_structured_mail(html)
+
+        yield f"parse_structured_mail[{name}]", parse_structured_mail, lambda html: html
+
+    for name in ("streaming", "tables"):
+        def parse_structured_mail_with_plan(html, extractor=HTML_EXTRACTORS[name]):
+            processor.html_extractor = extractor
+            return processor._parse_structured_mail(html, field_plan=processor.field_plan)
+
+        yield f"parse_structured_mail[{name}, field plan]", parse_structured_mail_with_plan, lambda html: html
+
+    for name in ("streaming", "tables"):
+        def parse_structured_mail_incremental(html, extractor=IncrementalExtractor(HTML_EXTRACTORS[name])):
+            processor.html_extractor = extractor
+            return processor._parse_structured_mail(html, field_plan=processor.field_plan)
+
+        yield f"parse_structured_mail[{name}, incremental]", parse_structured_mail_incremental, lambda html: html
+
+
+def verify(corpus, fields):
+    # All extractors have to give the same fields as the reference extractor, and the field plan has to find all fields
+    processor = EmailProcessor()
+    field_plan = FieldPlan(fields, TYPE_FIELD)
+    mismatches = 0
+    for size, html in corpus:
+        processor.html_extractor = HTML_EXTRACTORS["beautifulsoup"]
+        expected = processor._parse_structured_mail(html)
+        missing = field_plan.wanted_fields - set(expected)
+        if missing:
+            print(f"The e-mail of {size} characters does not have the fields {sorted(missing)}", file=sys.stderr)
+            mismatches += 1
+        for name, extractor in HTML_EXTRACTORS.items():
+            processor.html_extractor = extractor
+            if processor._parse_structured_mail(html) != expected:
+                print(f"Extractor {name} gives different fields for the e-mail of {size} characters", file=sys.stderr)
+                mismatches += 1
+    return mismatches == 0
+
+
+def run(corpus, repeat, fields):
+    processor = EmailProcessor()
+    processor.field_plan = FieldPlan(fields, TYPE_FIELD)
+    results = []
+    for size, html in corpus:
+        for stage, function, stage_input in stages(processor):
+            result = measure(function, stage_input(html), max(3, repeat * 10240 // max(size, 10240)))
+            result.update({"stage": stage, "size": size, "characters": len(html)})
+            result["mb_per_second"] = result["ops_per_second"] * len(html) / 1024 / 1024
+            results.append(result)
+            print(
+                f"{stage:>46} {len(html):>9} chars: {result['p50_ms']:9.3f} ms p50, "
+                f"{result['p99_ms']:9.3f} ms p99, {result['mb_per_second']:7.2f} MB/s, "
+                f"{result['peak_memory_kb']:9.1f} KB peak",
+                file=sys.stderr,
+            )
+    return results
+
+
+def compare(results, previous_results, threshold):
+    previous = {(result["stage"], result["size"]): result for result in previous_results}
+    regressions = 0
+    for result in results:
+        before = previous.get((result["stage"], result["size"]))
+        if not before or not before["p50_ms"]:
+            continue
+        ratio = result["p50_ms"] / before["p50_ms"]
+        marker = ""
+        if ratio > 1 + threshold:
+            marker = "  REGRESSION"
+            regressions += 1
+        print(f"{result['stage']:>46} {result['size']:>9}: p50 x{ratio:.2f}{marker}", file=sys.stderr)
+    return regressions
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL)  # nosec
+        return commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-s", "--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Body sizes (chars)")
+    argparser.add_argument("--headers", type=int, default=10)
+    argparser.add_argument("--table-rows", type=int, default=20)
+    argparser.add_argument("--nesting", type=int, default=3)
+    argparser.add_argument("--nbsp-ratio", type=float, default=0.1)
+    argparser.add_argument("-f", "--fields", nargs="+", default=DEFAULT_FIELDS, help="Fields of the field plan stages")
+    argparser.add_argument("-r", "--repeat", type=int, default=50, help="Repetitions for 10 KB bodies")
+    argparser.add_argument("-o", "--output", help="JSON file to save the results to")
+    argparser.add_argument("-c", "--compare", help="JSON file with earlier results to compare with")
+    argparser.add_argument("-t", "--threshold", type=float, default=0.1, help="Allowed p50 slowdown (fraction)")
+    argparser.add_argument("--verify", action="store_true", help="Check that all extractors give the same fields")
+    args = argparser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    corpus = [
+        (size, generate_email(
+            size, args.headers, args.table_rows, args.nesting, args.nbsp_ratio, TYPE_FIELD, seed=size
+        ))
+        for size in args.sizes
+    ]
+
+    if args.verify and not verify(corpus, args.fields):
+        sys.exit(1)
+
+    results = run(corpus, args.repeat, args.fields)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({
+                "created": datetime.datetime.utcnow().isoformat(),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "parameters": vars(args),
+                "results": results,
+            }, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            if compare(results, json.load(previous_file)["results"], args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures the type pre-scan on markup without text, as in the spacer tables of Outlook e-mails, of growing size.
+
+Tags around the type field are skipped as filler, the pre-scan has to stay linear on markup that consists of tags
+only. Exits with 1 when it does not.
+
+Run from the consume-email directory:
+    python -m benchmarks.prescan_benchmark
+"""
+import argparse
+import sys
+import time
+
+from emailprocessor.typeprescanner import TypePrescanner
+
+SPACER_ROW = '<tr><td width="10"></td><td style="x"><img src="s.gif"></td></tr>'
+
+INPUTS = {
+    "spacer_rows": SPACER_ROW,
+    "empty_cells": "<td></td>",
+    "nbsp_cells": "<td>&nbsp;</td>",
+    "field_cells": "<td>type_field</td>" + SPACER_ROW,
+    "field_headers": "type_field: " + SPACER_ROW,
+}
+
+
+def measure(function, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-s", "--sizes", type=int, nargs="+", default=[65536, 262144, 1048576, 4194304])
+    argparser.add_argument("-g", "--max-growth", type=float, default=3.0,
+                           help="Allowed growth of the pre-scan time, relative to the growth of the input size")
+    args = argparser.parse_args()
+
+    prescanner = TypePrescanner("type_field", ["ALLOWED"])
+
+    nonlinear = 0
+    for name, unit in INPUTS.items():
+        print(f"{name}:")
+        previous = None
+        previous_size = None
+        for size in args.sizes:
+            html = unit * (size // len(unit))
+
+            seconds = measure(lambda: prescanner.find_rejected_type(html))
+            growth = f"x{seconds / previous:.1f}" if previous else ""
+            if previous and seconds / previous > args.max_growth * size / previous_size:
+                growth += " NOT LINEAR"
+                nonlinear += 1
+            previous = seconds
+            previous_size = size
+
+            print(f"  {size:>8} chars: {seconds * 1000:8.3f} ms {growth}")
+
+    if nonlinear:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
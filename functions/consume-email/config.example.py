@@ -29,3 +29,46 @@ TOPIC_PROJECT_ID = "topic-project-id"
 
 # Name of the topic to send extracted data to.
 TOPIC_NAME = "topic-name"
+
+# Optional: the extractor used to parse the HTML content of e-mails, "streaming" (default), "beautifulsoup" or "tables".
+# The first two give the same results, "streaming" is faster as it does not build a tree of the HTML content.
+# "tables" reads the field-value rows of all (nested) tables instead of the first table, and stops parsing once all
+# FIELDS are found. It assumes headers precede the tables.
+HTML_EXTRACTOR = "streaming"
+
+# Optional: parse the HTML content in chunks of this many characters, and stop parsing once all FIELDS are found. It
+# assumes every field occurs once, headers and table rows after the last found field are not extracted. Works with the
+# "streaming" and "tables" extractors. Leave out to parse the whole content.
+# PARSE_CHUNK_SIZE = 16384
+
+# Optional: the maximum number of characters of HTML content. Longer contents are truncated after the last tag within
+# the maximum (BODY_SIZE_EXCEEDED = "truncate", the default), or rejected (BODY_SIZE_EXCEEDED = "reject").
+# Leave out to parse contents of any size.
+# MAX_BODY_SIZE = 1000000
+# BODY_SIZE_EXCEEDED = "truncate"
+
+# Optional: reject e-mails with a type that is not allowed by scanning their raw HTML content, before parsing it.
+# E-mails are only rejected this way when none of the ALLOWED_TYPES occurs in the content. Defaults to True.
+# TYPE_PRESCAN = True
+
+# Optional: publish parsed e-mails in batches. Publishes are only waited for at the end of a request, or when
+# max_in_flight e-mails are being published. Leave out to wait for every single e-mail to be published.
+# PUBLISH_BATCH_SETTINGS = {
+#     "max_messages": 100,
+#     "max_bytes": 1000000,
+#     "max_latency": 0.05,
+#     "max_in_flight": 1000
+# }
+
+# Optional: log a JSON line with the stage durations and sizes of every message, and keep counters and histograms of
+# them in memory. Defaults to False.
+# METRICS_ENABLED = True
+
+# Optional: do not publish e-mails with an id that was already processed, e.g. when a message is delivered again.
+# The ids of the last max_size e-mails are kept in memory. The optional backend ("file" or "firestore") remembers all
+# ids in the file or Firestore collection given as location. Leave out to publish every e-mail.
+# DEDUPLICATION = {
+#     "max_size": 10000,
+#     "backend": "firestore",
+#     "location": "processed-emails"
+# }
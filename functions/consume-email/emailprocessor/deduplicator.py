@@ -0,0 +1,213 @@
+import datetime
+import logging
+import os
+import threading
+from typing import Optional
+
+from cachetools import LRUCache
+
+
+class Deduplicator(object):
+    """
+    Remembers the ids of processed e-mails, so e-mails that are delivered again are not published again.
+
+    The ids of recently processed e-mails are kept in a bounded LRU. An optional persistent backend remembers them
+    across instances and restarts. An id is claimed before its e-mail is published, and only stored in the backend
+    after it was published, so an e-mail that failed to publish is processed again when it is delivered again.
+    """
+
+    def __init__(self, max_size: int = 10000, backend=None):
+        """
+        :param max_size: Maximum number of ids kept in memory.
+        :type max_size: int
+        :param backend: Persistent store of ids, with contains(id) and add(id) methods.
+        :type backend: FileBackend|FirestoreBackend|None
+        """
+        self.ids = LRUCache(maxsize=max_size)
+        self.backend = backend
+        self.checks = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def claim(self, mail_id: str) -> bool:
+        """
+        Claims an id for processing.
+
+        :param mail_id: The id of the e-mail.
+        :type mail_id: str
+        :return: False when the e-mail was already processed, or is being processed, True otherwise.
+        :rtype: bool
+        """
+        with self._lock:
+            self.checks += 1
+            if mail_id in self.ids:
+                self.duplicates += 1
+                return False
+
+        if self.backend is not None:
+            try:
+                processed = self.backend.contains(mail_id)
+            except BackendUnavailable as e:
+                self._disable_backend(e)
+                processed = False
+            except Exception as e:
+                # Processing an e-mail twice is better than not processing it
+                logging.exception(f"Could not check whether e-mail with ID {mail_id} was processed: {e}")
+                processed = False
+
+            if processed:
+                with self._lock:
+                    self.duplicates += 1
+                    self.ids[mail_id] = True
+                return False
+
+        with self._lock:
+            if mail_id in self.ids:
+                self.duplicates += 1
+                return False
+            self.ids[mail_id] = False
+
+        return True
+
+    def confirm(self, mail_id: str):
+        """
+        Marks a claimed id as processed, after its e-mail was published.
+
+        :param mail_id: The id of the e-mail.
+        :type mail_id: str
+        """
+        with self._lock:
+            self.ids[mail_id] = True
+
+        if self.backend is not None:
+            try:
+                self.backend.add(mail_id)
+            except BackendUnavailable as e:
+                self._disable_backend(e)
+            except Exception as e:
+                logging.exception(f"Could not store that e-mail with ID {mail_id} was processed: {e}")
+
+    def release(self, mail_id: str):
+        """
+        Releases a claimed id, after publishing its e-mail failed.
+
+        :param mail_id: The id of the e-mail.
+        :type mail_id: str
+        """
+        with self._lock:
+            self.ids.pop(mail_id, None)
+
+    def _disable_backend(self, error: Exception):
+        """
+        Falls back to the ids kept in memory, so e-mails do not all wait for a backend that can not be used.
+        """
+        if self.backend is not None:
+            logging.error(f"Deduplication backend is unavailable, only checking the ids kept in memory: {error}")
+            self.backend = None
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                "checks": self.checks,
+                "duplicates": self.duplicates,
+                "duplicate_rate": self.duplicates / self.checks if self.checks else 0.0,
+                "size": len(self.ids),
+            }
+
+
+class BackendUnavailable(Exception):
+    """
+    Raised by a backend that can not be used at all, e.g. because its client could not be created.
+    """
+
+
+class FileBackend(object):
+    """
+    Stores the ids of processed e-mails in a local file, one id per line.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ids = set()
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as ids_file:
+                self.ids.update(line.rstrip("\n") for line in ids_file if line.strip())
+
+    def contains(self, mail_id: str) -> bool:
+        return mail_id in self.ids
+
+    def add(self, mail_id: str):
+        with self._lock:
+            if mail_id in self.ids:
+                return
+            with open(self.path, "a") as ids_file:
+                ids_file.write(f"{mail_id}\n")
+            self.ids.add(mail_id)
+
+
+class FirestoreBackend(object):
+    """
+    Stores the ids of processed e-mails as documents in a Firestore collection.
+
+    The Firestore library is only imported, and its client created, on first use. Creating the client is only tried
+    once, when it fails BackendUnavailable is raised.
+    """
+
+    def __init__(self, collection: str, db_client=None):
+        self.collection_name = collection
+        self._db_client = db_client
+        self._client_error = None
+
+    @property
+    def collection(self):
+        if self._db_client is None:
+            if self._client_error is None:
+                try:
+                    from google.cloud import firestore
+
+                    self._db_client = firestore.Client()
+                except Exception as e:
+                    self._client_error = e
+
+            if self._client_error is not None:
+                raise BackendUnavailable(f"Could not create Firestore client: {self._client_error}")
+
+        return self._db_client.collection(self.collection_name)
+
+    @staticmethod
+    def document_id(mail_id: str) -> str:
+        # Document ids can not contain slashes.
+        return mail_id.replace("/", "_")
+
+    def contains(self, mail_id: str) -> bool:
+        return self.collection.document(self.document_id(mail_id)).get().exists
+
+    def add(self, mail_id: str):
+        self.collection.document(self.document_id(mail_id)).set(
+            {"id": mail_id, "processed_on": datetime.datetime.utcnow().isoformat()}
+        )
+
+
+# Backends by name, created with the "location" of the settings: a file path or a Firestore collection.
+DEDUPLICATION_BACKENDS = {
+    "file": FileBackend,
+    "firestore": FirestoreBackend,
+}
+
+
+def create_deduplicator(settings: Optional[dict]) -> Optional[Deduplicator]:
+    """
+    :param settings: The DEDUPLICATION settings.
+    :type settings: dict|None
+    :return: A deduplicator with the configured backend, None when deduplication is not configured.
+    :rtype: Deduplicator|None
+    """
+    if settings is None:
+        return None
+
+    backend_name = settings.get("backend")
+    backend = DEDUPLICATION_BACKENDS[backend_name](settings["location"]) if backend_name else None
+
+    return Deduplicator(max_size=settings.get("max_size", 10000), backend=backend)
@@ -1,12 +1,12 @@
+import collections
 import json
 import logging
+import os
 import re
-from typing import Optional
-
-from bs4 import BeautifulSoup
-from gobits import Gobits
-from google.cloud import pubsub_v1
+import threading
+from typing import TYPE_CHECKING, Optional
 
+import config
 from config import (
     SENDER_WHITELIST,
     TYPE_FIELD,
@@ -16,82 +16,352 @@ from config import (
     TOPIC_PROJECT_ID
 )
 
+from .deduplicator import create_deduplicator
+from .fieldplan import FieldPlan
+from .headertokenizer import tokenize_headers
+from .htmlextractors import HTML_EXTRACTORS, IncrementalExtractor
+from .metrics import NULL_MESSAGE_METRICS, Metrics
+from .typeprescanner import TypePrescanner
+from .validation import BodySizeValidation, SenderValidation, TicketValidation, TypePrescanValidation
+
+if TYPE_CHECKING:
+    from google.cloud import pubsub_v1
+
 
-HEADER_REGEX = re.compile(r"([^\n:]+):\s*<<?([^>]*)>>?")
 TICKET_NUMBER_REGEX = re.compile(r"^[^[]*\[(Ticket#[^]]+)]")
 
+# Compiled once, as they are checked for every e-mail.
+WHITELISTED_SENDERS = frozenset(SENDER_WHITELIST)
+ALLOWED_TYPE_VALUES = frozenset(ALLOWED_TYPES)
+
+# Name under which rejections after parsing the HTML content are counted.
+PARSE_STAGE = "parse"
+
+# Optional: reject e-mails with a type that is not allowed before parsing their HTML content.
+TYPE_PRESCAN = getattr(config, "TYPE_PRESCAN", True)
+
+# Optional: publish parsed e-mails in batches instead of waiting for every single publish.
+PUBLISH_BATCH_SETTINGS = getattr(config, "PUBLISH_BATCH_SETTINGS", None)
+
+# Optional: the extractor used to parse the HTML content of e-mails.
+HTML_EXTRACTOR = getattr(config, "HTML_EXTRACTOR", "streaming")
+
+# Optional: parse the HTML content in chunks of this many characters, and stop once all configured fields are found.
+PARSE_CHUNK_SIZE = getattr(config, "PARSE_CHUNK_SIZE", None)
+
+# Optional: the maximum number of characters of HTML content, longer contents are truncated or rejected.
+MAX_BODY_SIZE = getattr(config, "MAX_BODY_SIZE", None)
+BODY_SIZE_EXCEEDED = getattr(config, "BODY_SIZE_EXCEEDED", "truncate")
+BODY_SIZE_BEHAVIOURS = ("truncate", "reject")
+
+# Optional: log the stage durations and sizes of every message, and keep counters and histograms of them.
+METRICS_ENABLED = getattr(config, "METRICS_ENABLED", False)
+
+# Optional: skip e-mails with an id that was already processed, e.g. when a message is delivered again.
+DEDUPLICATION = getattr(config, "DEDUPLICATION", None)
+
 logging.basicConfig(level=logging.INFO)
 
 
+class PublishBatch(object):
+    """
+    The e-mails queued for publishing in batch publishing mode by a single request.
+
+    Requests processed concurrently by the same EmailProcessor each have their own batch, so a request only waits for,
+    and gets the results of, the e-mails it queued itself.
+    """
+
+    def __init__(self, max_in_flight: int = 1000):
+        """
+        :param max_in_flight: Number of queued e-mails at which they are waited for, before more are queued.
+        :type max_in_flight: int
+        """
+        self.max_in_flight = max_in_flight
+        self.pending_publishes = []
+        self.results = {}
+
+
 class EmailProcessor(object):
 
-    def process(self, payload):
+    def __init__(self, batch_publishing: Optional[bool] = None):
+        """
+        :param batch_publishing: Whether to publish in batches, by default when PUBLISH_BATCH_SETTINGS is configured.
+        :type batch_publishing: bool|None
+        """
+        if batch_publishing is None:
+            batch_publishing = PUBLISH_BATCH_SETTINGS is not None
+
+        self.topic_path = f"projects/{TOPIC_PROJECT_ID}/topics/{TOPIC_NAME}"
+        self._publisher = None
+        self._publisher_pid = None
+        self._publisher_lock = threading.Lock()
+
+        self.batch_settings = (PUBLISH_BATCH_SETTINGS or {}) if batch_publishing else None
+
+        self.html_extractor = HTML_EXTRACTORS[HTML_EXTRACTOR]
+        if PARSE_CHUNK_SIZE:
+            self.html_extractor = IncrementalExtractor(self.html_extractor, PARSE_CHUNK_SIZE)
+        self.type_prescanner = TypePrescanner(TYPE_FIELD, ALLOWED_TYPE_VALUES) if TYPE_PRESCAN else None
+
+        if BODY_SIZE_EXCEEDED not in BODY_SIZE_BEHAVIOURS:
+            raise ValueError(f"BODY_SIZE_EXCEEDED must be one of {', '.join(BODY_SIZE_BEHAVIOURS)}.")
+        # Longer contents are truncated before they are checked, or rejected as the first check.
+        self.truncated_body_size = MAX_BODY_SIZE if BODY_SIZE_EXCEEDED == "truncate" else None
+
+        # Checks run before parsing, cheapest first.
+        self.validation_stages = []
+        if MAX_BODY_SIZE is not None and BODY_SIZE_EXCEEDED == "reject":
+            self.validation_stages.append(BodySizeValidation(MAX_BODY_SIZE))
+        self.validation_stages += [SenderValidation(WHITELISTED_SENDERS), TicketValidation(TICKET_NUMBER_REGEX)]
+        if self.type_prescanner:
+            self.validation_stages.append(TypePrescanValidation(self.type_prescanner))
+        self.rejections = collections.Counter()
+
+        self.field_plan = FieldPlan(FIELDS, TYPE_FIELD)
+        self.deduplicator = create_deduplicator(DEDUPLICATION)
+        self.metrics = Metrics("consume-email", METRICS_ENABLED)
+
+    @property
+    def publisher(self) -> "pubsub_v1.PublisherClient":
+        """
+        Pub/Sub publisher shared by all e-mails processed by this instance.
+
+        The client is created on first use and kept for as long as the (reused) Cloud Functions instance lives. The
+        Pub/Sub library is only imported then, to keep it out of the cold start of the function.
+        It is recreated when the process was forked after creating it, as its gRPC channel cannot be shared
+        between processes.
+
+        :return: The Pub/Sub publisher client.
+        :rtype: pubsub_v1.PublisherClient
+        """
+        pid = os.getpid()
+        if self._publisher is None or self._publisher_pid != pid:
+            with self._publisher_lock:
+                if self._publisher is None or self._publisher_pid != pid:
+                    self._publisher = self._create_publisher()
+                    self._publisher_pid = pid
+
+        return self._publisher
+
+    def _create_publisher(self) -> "pubsub_v1.PublisherClient":
+        from google.cloud import pubsub_v1
+
+        if self.batch_settings is None:
+            return pubsub_v1.PublisherClient()
+
+        batch_settings = pubsub_v1.types.BatchSettings(
+            max_messages=self.batch_settings.get("max_messages", 100),
+            max_bytes=self.batch_settings.get("max_bytes", 1000000),
+            max_latency=self.batch_settings.get("max_latency", 0.05),
+        )
+        return pubsub_v1.PublisherClient(batch_settings=batch_settings)
+
+    def reset_publisher(self):
+        """
+        Drops the shared publisher, so a new client is created for the next message.
+        """
+        with self._publisher_lock:
+            self._publisher = None
+            self._publisher_pid = None
+
+    def publish_batch(self) -> Optional[PublishBatch]:
+        """
+        Starts a batch of e-mails to publish, for a single request.
+
+        :return: A new batch in batch publishing mode, None otherwise.
+        :rtype: PublishBatch|None
+        """
+        if self.batch_settings is None:
+            return None
+
+        return PublishBatch(self.batch_settings.get("max_in_flight", 1000))
+
+    def process(self, payload, message_metrics=None, publish_batch: Optional[PublishBatch] = None) -> Optional[str]:
+        """
+        Processes a message containing an e-mail.
+
+        With a publish batch the parsed e-mail is only queued for publishing, call flush() with the batch to wait for
+        it. Without one, the e-mail is published right away.
+
+        :param payload: The message containing the e-mail.
+        :type payload: dict
+        :param message_metrics: Measurements of the message started by the caller, e.g. to include decoding it.
+        :type message_metrics: MessageMetrics|None
+        :param publish_batch: The batch of the request, from publish_batch().
+        :type publish_batch: PublishBatch|None
+        :return: The id of the published (or queued, or already processed) e-mail, None when the e-mail was not
+            processed.
+        :rtype: str|None
+        """
+        if message_metrics is None:
+            message_metrics = self.metrics.message()
+
         mail = payload["email"]
-        if self._process_mail(mail) is False:
+        mail_id = self._process_mail(mail, message_metrics, publish_batch)
+        if not mail_id:
             logging.info("Message not processed")
         else:
             logging.info("Message is processed")
 
-    def _process_mail(self, mail) -> bool:
-        mail_sender = mail["sender"].lower()
-        subject = mail["subject"]
+        return mail_id
 
-        logging.info(f"Processing e-mail '{subject}' from '{mail_sender}'")
+    def flush(self, publish_batch: Optional[PublishBatch] = None) -> dict:
+        """
+        Waits for all e-mails queued in a publish batch to be published.
 
-        if mail_sender not in SENDER_WHITELIST:
-            date = mail.get("received_on", "")
-            logging.error(
-                f"E-mail received on {str(date)} was not send by a whitelisted e-mail address ({mail_sender})."
-            )
-            return False
+        :param publish_batch: The batch of the request, from publish_batch(). Without a batch, nothing was queued.
+        :type publish_batch: PublishBatch|None
+        :return: Per e-mail id whether it was published, for all e-mails queued in the batch since its previous flush.
+        :rtype: dict
+        """
+        if publish_batch is None:
+            return {}
+
+        self._wait_for_pending_publishes(publish_batch)
+
+        results = publish_batch.results
+        publish_batch.results = {}
+
+        return results
+
+    def _process_mail(self, mail, message_metrics, publish_batch: Optional[PublishBatch] = None) -> Optional[str]:
+        mail_variables = self.parse_mail(mail, message_metrics)
+        if not mail_variables:
+            message_metrics.finish("rejected")
+            return None
+
+        mail_id = mail_variables["id"]
+        if self.deduplicator is not None and not self.deduplicator.claim(mail_id):
+            logging.info(f"E-mail with ID {mail_id} was already processed, not publishing it again")
+            message_metrics.finish("duplicate", mail_id)
+            return mail_id
+
+        with message_metrics.stage("publish"):
+            published = self.publish(mail_variables, publish_batch)
+        if not published:
+            if self.deduplicator is not None:
+                self.deduplicator.release(mail_id)
+            message_metrics.finish("failed", mail_id)
+            return None
+
+        # In a publish batch, the id is confirmed when the e-mail is published.
+        if self.deduplicator is not None and publish_batch is None:
+            self.deduplicator.confirm(mail_id)
+
+        message_metrics.finish("published", mail_id)
+        return mail_id
+
+    def publish(self, mail_variables: dict, publish_batch: Optional[PublishBatch] = None) -> bool:
+        """
+        Publishes the fields of a parsed e-mail to the topic, without deduplicating it.
+
+        With a publish batch the e-mail is only queued for publishing, call flush() with the batch to wait for it.
+
+        :param mail_variables: The fields and id of the e-mail, from parse_mail().
+        :type mail_variables: dict
+        :param publish_batch: The batch to queue the e-mail in, from publish_batch().
+        :type publish_batch: PublishBatch|None
+        :return: Whether the e-mail was published, or queued.
+        :rtype: bool
+        """
+        from gobits import Gobits
+
+        return self._publish_to_topic(mail_variables, Gobits(), publish_batch)
+
+    def parse_mail(self, mail, message_metrics=NULL_MESSAGE_METRICS) -> Optional[dict]:
+        """
+        Validates an e-mail and extracts the configured fields from it, without publishing them.
+
+        :param mail: The e-mail object.
+        :type mail: dict
+        :param message_metrics: Measurements of the message the e-mail is part of.
+        :type message_metrics: MessageMetrics|NullMessageMetrics
+        :return: The configured fields and the generated id of the e-mail, None when the e-mail is rejected.
+        :rtype: dict|None
+        """
+        logging.info(f"Processing e-mail '{mail['subject']}' from '{mail['sender'].lower()}'")
 
         html_content = mail["body"]
-        mail_variables = self._parse_structured_mail(html_content)
+        message_metrics.size("body_characters", len(html_content))
+
+        if self.truncated_body_size is not None and len(html_content) > self.truncated_body_size:
+            body_size = len(html_content)
+            html_content = self._truncate_body(html_content, self.truncated_body_size)
+            mail = dict(mail, body=html_content)
+            logging.warning(f"E-mail content of {body_size} characters truncated to {len(html_content)} characters.")
+            if self.metrics.enabled:
+                self.metrics.increment("truncated_bodies")
+
+        for validation_stage in self.validation_stages:
+            with message_metrics.stage(validation_stage.name):
+                valid = validation_stage.validate(mail)
+            if not valid:
+                self._reject(validation_stage.name)
+                return None
+
+        mail_variables = self._parse_structured_mail(html_content, message_metrics, self.field_plan)
 
         if TYPE_FIELD not in mail_variables:
             logging.error(f"'{TYPE_FIELD}' was not found in e-mail data.")
+            self._reject(PARSE_STAGE)
+            return None
 
         mail_type = mail_variables[TYPE_FIELD]
-        if mail_type not in ALLOWED_TYPES:
+        if mail_type not in ALLOWED_TYPE_VALUES:
             logging.error(f"'{mail_type}' is not an allowed type.")
-            return False
+            self._reject(PARSE_STAGE)
+            return None
 
         # Create subset of mail_variables, making sure only configured fields are present, and substituting
         # missing variables with empty strings.
-        mail_variables = {field: mail_variables.get(field, str()) for field in FIELDS}
+        mail_variables = self.field_plan.project(mail_variables)
 
         mail_id = self._generate_id(mail, mail_type)
         if not mail_id:
             logging.error("Could not generate id for e-mail.")
-            return False
+            self._reject(PARSE_STAGE)
+            return None
 
         mail_variables["id"] = mail_id
 
-        metadata = Gobits()
-        return self._publish_to_topic(mail_variables, metadata)
+        return mail_variables
+
+    def _reject(self, stage_name: str):
+        self.rejections[stage_name] += 1
+        if self.metrics.enabled:
+            self.metrics.increment(f"rejected_by_{stage_name}")
 
-    def _parse_structured_mail(self, html_text_raw: str) -> dict:
+    def _parse_structured_mail(self, html_text_raw: str, message_metrics=NULL_MESSAGE_METRICS,
+                               field_plan: Optional[FieldPlan] = None) -> dict:
         """
         Extracts information from HTML e-mail content in structured e-mail format.
 
         :param html_text_raw: Raw HTML contents from e-mail.
         :type html_text_raw: str
+        :param message_metrics: Measurements of the message the e-mail is part of.
+        :type message_metrics: MessageMetrics|NullMessageMetrics
+        :param field_plan: Plan of the fields to extract, all fields are extracted when None.
+        :type field_plan: FieldPlan|None
         :return: Field-value pairs extracted from the provided HTML.
         :rtype: dict
         """
-        html_content = BeautifulSoup(html_text_raw, "html.parser")
-        html_text_rendered = html_content.get_text()
+        with message_metrics.stage("extract"):
+            html_text_rendered, table_data = self.html_extractor.extract(
+                html_text_raw, field_plan.wanted_fields if field_plan is not None else None
+            )
 
-        headers = self._get_headers(html_text_rendered)
-        table_contents = self._get_html_table_contents(html_content)
+        with message_metrics.stage("headers"):
+            headers = self._get_headers(html_text_rendered, field_plan)
+        with message_metrics.stage("table"):
+            table_contents = self._get_html_table_contents(table_data, field_plan)
 
         # Merging data, and transforming field names.
         variables = self._merge_dictionaries(headers, table_contents)
-        variables = {field.lower().replace(" ", "_"): value for field, value in variables.items()}
+        variables = {FieldPlan.normalise(field): value for field, value in variables.items()}
 
         return variables
 
-    def _get_headers(self, string: str) -> dict:
+    def _get_headers(self, string: str, field_plan: Optional[FieldPlan] = None) -> dict:
         """
         Extracts field-value pairs from headers in string.
 
@@ -103,25 +373,29 @@ class EmailProcessor(object):
 
         :param string: Plain text containing headers
         :type string: str
+        :param field_plan: Plan of the fields to extract, all fields are extracted when None.
+        :type field_plan: FieldPlan|None
         :return: A dictionary with all field-value pairs from found headers.
         :rtype: dict
         """
         values = dict()
-        for match in HEADER_REGEX.findall(string):
-            field, value = match
+        for field, value in tokenize_headers(string):
             if not field:
                 continue
 
             field = self._sanitise_string(field)
+            if field_plan is not None and not field_plan.wants(field):
+                continue
+
             value = self._sanitise_string(value)
 
             values[field] = value
 
         return values
 
-    def _get_html_table_contents(self, html_content: BeautifulSoup) -> dict:
+    def _get_html_table_contents(self, table_data: Optional[list], field_plan: Optional[FieldPlan] = None) -> dict:
         """
-        Extracts field-value pairs from the first table in the HTML content.
+        Extracts field-value pairs from the cells of the first table in the HTML content.
 
         This table must have 2 columns, the first one being the field, the second the value.
 
@@ -135,19 +409,19 @@ class EmailProcessor(object):
             </tbody>
         </table>
 
-        :param html_content: The HTML content to extract the table contents from.
-        :type html_content: BeautifulSoup
+        :param table_data: The texts of all cells in the table, None when the HTML content has no table.
+        :type table_data: list|None
+        :param field_plan: Plan of the fields to extract, all fields are extracted when None.
+        :type field_plan: FieldPlan|None
         :return: A dictionary containing field-value pairs found in the table.
         :rtype: dict
         """
         values = dict()
 
-        table = html_content.table
-        if not table:
+        if table_data is None:
             logging.error("No table found in content.")
             return values
 
-        table_data = [table_data.text for table_data in table.find_all("td")]
         table_data_count = len(table_data)
 
         if table_data_count % 2:
@@ -163,12 +437,33 @@ class EmailProcessor(object):
                 field = field[:-1]
 
             field = self._sanitise_string(field)
+            if field_plan is not None and not field_plan.wants(field):
+                continue
+
             value = self._sanitise_string(value)
 
             values[field] = value
 
         return values
 
+    @staticmethod
+    def _truncate_body(html_text_raw: str, max_body_size: int) -> str:
+        """
+        Truncates HTML content after the last tag that ends within the maximum body size.
+
+        The content is not cut inside a tag or character reference, which would otherwise be rendered as text.
+
+        :param html_text_raw: Raw HTML content.
+        :type html_text_raw: str
+        :param max_body_size: The maximum number of characters.
+        :type max_body_size: int
+        :return: The truncated HTML content, of at most max_body_size characters.
+        :rtype: str
+        """
+        end = html_text_raw.rfind(">", 0, max_body_size) + 1
+
+        return html_text_raw[:end or max_body_size]
+
     @staticmethod
     def _merge_dictionaries(dictionary: dict, other: dict) -> dict:
         """
@@ -238,23 +533,57 @@ class EmailProcessor(object):
 
         return f"{message_type}_{ticket_number}_{received_on}"
 
-    @staticmethod
-    def _publish_to_topic(message, gobits) -> bool:
+    def _publish_to_topic(self, message, gobits, publish_batch: Optional[PublishBatch] = None) -> bool:
         pubsub_message = {"gobits": [gobits.to_json()], "parsed_email": message}
         try:
             # Publish to topic
-            publisher = pubsub_v1.PublisherClient()
-            topic_path = "projects/{}/topics/{}".format(
-                TOPIC_PROJECT_ID, TOPIC_NAME
-            )
-            future = publisher.publish(
-                topic_path, bytes(json.dumps(pubsub_message).encode("utf-8"))
+            future = self.publisher.publish(
+                self.topic_path, bytes(json.dumps(pubsub_message).encode("utf-8"))
             )
             logging.debug(f"Publishing email with ID {message['id']}")
+            if publish_batch is not None:
+                publish_batch.pending_publishes.append((message["id"], future))
+                if len(publish_batch.pending_publishes) >= publish_batch.max_in_flight:
+                    self._wait_for_pending_publishes(publish_batch)
+                return True
+
             logging.info(f"Published email with ID {message['id']}: {future.result()}")
             return True
         except Exception as e:
             logging.exception(
                 "Unable to publish parsed email to topic because of {}".format(e)
             )
+            # The client may be left in a broken state, e.g. after its channel was closed on a reused instance.
+            self.reset_publisher()
         return False
+
+    def _wait_for_pending_publishes(self, publish_batch: PublishBatch):
+        """
+        Waits for all in-flight publishes of a publish batch, storing the result per e-mail id in the batch.
+
+        :param publish_batch: The batch of the request.
+        :type publish_batch: PublishBatch
+        """
+        pending_publishes = publish_batch.pending_publishes
+        publish_batch.pending_publishes = []
+
+        failed = False
+        for mail_id, future in pending_publishes:
+            try:
+                logging.info(f"Published email with ID {mail_id}: {future.result()}")
+                published = True
+            except Exception as e:
+                logging.exception(f"Unable to publish parsed email with ID {mail_id} to topic because of {e}")
+                published = False
+                failed = True
+
+            publish_batch.results[mail_id] = publish_batch.results.get(mail_id, True) and published
+
+            if self.deduplicator is not None:
+                if published:
+                    self.deduplicator.confirm(mail_id)
+                else:
+                    self.deduplicator.release(mail_id)
+
+        if failed:
+            self.reset_publisher()
@@ -0,0 +1,82 @@
+import re
+from typing import Iterable
+
+# Field names that can be the result of a collision, when merging headers and table contents: "{field}_{counter}".
+COLLISION_NAME_REGEX = re.compile(r"^(.+)_[1-9][0-9]*$")
+
+# Maximum number of field names of which the decision is remembered, e-mails of the same kind use the same names.
+MAX_REMEMBERED_FIELDS = 10000
+
+
+class FieldPlan(object):
+    """
+    Plan of the fields to extract from e-mails, compiled once from the configured fields.
+
+    Field names found in an e-mail are normalised (lowercased, spaces replaced with underscores) after headers and
+    table contents are merged. When a table field is already taken by a header, it gets a "_{counter}" suffix. Only
+    the fields that can end up as one of the wanted fields are extracted:
+    * Fields that normalise to a wanted field.
+    * Fields that normalise to the base of a wanted field with a suffix ("eggs" for "eggs_1"), and of that base.
+    * Fields that normalise to such a base with a suffix ("eggs_2"), as they decide which suffix a field gets.
+    """
+
+    def __init__(self, fields: Iterable[str], type_field: str):
+        """
+        :param fields: The fields to extract, as configured in FIELDS.
+        :type fields: list
+        :param type_field: The field containing the type of an e-mail.
+        :type type_field: str
+        """
+        self.fields = tuple(fields)
+        self.wanted_fields = frozenset(self.fields) | {type_field}
+
+        bases = set()
+        names = list(self.wanted_fields)
+        while names:
+            match = COLLISION_NAME_REGEX.match(names.pop())
+            if match and match.group(1) not in bases:
+                bases.add(match.group(1))
+                names.append(match.group(1))
+
+        self.bases = frozenset(bases)
+        self._names = self.wanted_fields | self.bases
+        self._decisions = {}
+
+    @staticmethod
+    def normalise(field: str) -> str:
+        return field.lower().replace(" ", "_")
+
+    def wants(self, field: str) -> bool:
+        """
+        :param field: A sanitised field name, as found in an e-mail.
+        :type field: str
+        :return: Whether the field has to be extracted.
+        :rtype: bool
+        """
+        wanted = self._decisions.get(field)
+        if wanted is None:
+            wanted = self._wants(field)
+            if len(self._decisions) >= MAX_REMEMBERED_FIELDS:
+                self._decisions.clear()
+            self._decisions[field] = wanted
+
+        return wanted
+
+    def _wants(self, field: str) -> bool:
+        name = self.normalise(field)
+        if name in self._names:
+            return True
+        if not self.bases:
+            return False
+
+        match = COLLISION_NAME_REGEX.match(name)
+        return match is not None and match.group(1) in self.bases
+
+    def project(self, variables: dict) -> dict:
+        """
+        :param variables: Extracted fields, with normalised names.
+        :type variables: dict
+        :return: The configured fields, in configured order, with empty strings for fields that were not found.
+        :rtype: dict
+        """
+        return {field: variables.get(field, str()) for field in self.fields}
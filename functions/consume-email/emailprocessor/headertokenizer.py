@@ -0,0 +1,155 @@
+import re
+from typing import Iterator, List, Tuple
+
+# Gives the same field-value pairs as re.findall(r"([^\n:]+):\s*<<?([^>]*)>>?", string), but only tries the positions
+# after a newline, colon or ">" (the end of the previous header) as the start of a field, instead of every position.
+HEADER_REGEX = re.compile(r"(?<![^\n:>])([^\n:]+):\s*<<?([^>]*)>>?")
+
+# From every ">", HEADER_REGEX still scans the rest of the line, and the whitespace after its colon. It is only used
+# when the number of ">" times the longest line is at most this many times the length of the text, and no colon is
+# followed by a long run of whitespace, so it stays linear.
+HEADER_REGEX_MAX_COST = 16
+LONG_WHITESPACE_REGEX = re.compile(r":\s{64}")
+
+# A colon followed by the start of a value, the field before the colon is found separately.
+VALUE_START_REGEX = re.compile(r":\s*<")
+
+
+def tokenize_headers(string: str) -> Iterator[Tuple[str, str]]:
+    """
+    Finds "field: <<value>>" headers in plain text, in linear time.
+
+    Gives the same field-value pairs as re.findall(r"([^\\n:]+):\\s*<<?([^>]*)>>?", string), which takes quadratic
+    time on long lines with colons that are not followed by a value. Ordinary text is matched with HEADER_REGEX, which
+    is fastest, text on which HEADER_REGEX could take more than linear time is scanned by _scan_headers.
+
+    :param string: Plain text containing headers.
+    :type string: str
+    :return: Field-value pairs of the headers, in order of appearance.
+    :rtype: iterator
+    """
+    greater_than_signs = string.count(">")
+    if greater_than_signs <= HEADER_REGEX_MAX_COST or (
+        greater_than_signs * max(map(len, string.split("\n"))) <= HEADER_REGEX_MAX_COST * len(string)
+        and not LONG_WHITESPACE_REGEX.search(string)
+    ):
+        return iter(HEADER_REGEX.findall(string))
+
+    return _scan_headers(string)
+
+
+def _scan_headers(string: str) -> Iterator[Tuple[str, str]]:
+    """
+    Finds "field: <<value>>" headers in plain text, in a single pass.
+
+    Instead of trying positions as the start of a field, the scan anchors on the delimiters:
+    * A value starts after a colon, any whitespace and "<" or "<<".
+    * The field is the text before that colon, up to the previous colon, newline or end of the previous header.
+    * The value ends at the next ">", and may span multiple lines. One more ">" is skipped.
+
+    :param string: Plain text containing headers.
+    :type string: str
+    :return: Field-value pairs of the headers, in order of appearance.
+    :rtype: iterator
+    """
+    position = 0
+
+    while True:
+        match = VALUE_START_REGEX.search(string, position)
+        if match is None:
+            return
+
+        colon = match.start()
+        start = max(position, string.rfind(":", position, colon) + 1, string.rfind("\n", position, colon) + 1)
+        if start == colon:
+            position = colon + 1
+            continue
+
+        index = match.end()
+        if string.startswith("<", index):
+            index += 1
+
+        end = string.find(">", index)
+        if end == -1:
+            # No header can follow without a closing ">".
+            return
+
+        yield string[start:colon], string[index:end]
+
+        position = end + 1
+        if string.startswith(">", position):
+            position += 1
+
+
+class HeaderScanner(object):
+    """
+    Finds the fields of headers in plain text that is rendered part by part, e.g. while HTML is parsed in chunks.
+
+    Gives the same fields as tokenize_headers would for all text fed so far, without scanning that text again on every
+    part: only the text that can still be part of a header is kept, which is the text after the last colon or newline
+    outside of headers, or the text of a header whose value is not closed yet.
+    """
+
+    def __init__(self):
+        self._text = ""
+        # Whether the last header ended at the end of the text, and one more ">" is still to be skipped.
+        self._skip_value_end = False
+
+    def feed(self, text: str) -> List[str]:
+        """
+        :param text: The next part of the plain text.
+        :type text: str
+        :return: The fields of the headers that are complete with this part, in order of appearance.
+        :rtype: list
+        """
+        if not text:
+            return []
+
+        if self._skip_value_end:
+            self._skip_value_end = False
+            if text[0] == ">":
+                text = text[1:]
+
+        string = self._text + text
+        fields = []
+        position = 0
+        open_colon = None
+
+        while True:
+            match = VALUE_START_REGEX.search(string, position)
+            if match is None:
+                # A colon followed by whitespace only can start a value in the next part.
+                colon = string.rfind(":", position)
+                if colon != -1 and not string[colon + 1:].strip():
+                    open_colon = colon
+                break
+
+            colon = match.start()
+            start = max(position, string.rfind(":", position, colon) + 1, string.rfind("\n", position, colon) + 1)
+            if start == colon:
+                position = colon + 1
+                continue
+
+            index = match.end()
+            if string.startswith("<", index):
+                index += 1
+
+            end = string.find(">", index)
+            if end == -1:
+                open_colon = colon
+                break
+
+            fields.append(string[start:colon])
+
+            position = end + 1
+            if string.startswith(">", position):
+                position += 1
+            elif position == len(string):
+                self._skip_value_end = True
+
+        # The field of a header starts after the previous colon or newline, so the text before that is not kept.
+        limit = len(string) if open_colon is None else open_colon
+        keep = max(position, string.rfind(":", position, limit), string.rfind("\n", position, limit))
+        self._text = string[keep:]
+
+        return fields
@@ -0,0 +1,524 @@
+import collections
+from html.entities import name2codepoint
+from html.parser import HTMLParser
+from typing import AbstractSet, List, Optional, Tuple
+
+from .fieldplan import FieldPlan
+from .headertokenizer import HeaderScanner, tokenize_headers
+
+# Tags that are closed right away, as they can not have any contents.
+EMPTY_ELEMENT_TAGS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta", "param",
+    "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex", "nextid", "spacer"
+])
+
+# Tags whose textual contents are not part of the rendered text.
+STRING_CONTAINER_TAGS = frozenset(["style", "script", "template"])
+
+# Tags in which whitespace-only strings are kept as they are.
+PRESERVE_WHITESPACE_TAGS = frozenset(["pre", "textarea"])
+
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+ENTITY_TO_CHARACTER = {name: chr(codepoint) for name, codepoint in name2codepoint.items()}
+ENTITY_TO_CHARACTER["apos"] = "'"
+
+# Tags of the cells in a table row, a field and its value can both be in either.
+CELL_TAGS = frozenset(["td", "th"])
+
+
+class BeautifulSoupExtractor(object):
+    """
+    Reference extractor, building a full BeautifulSoup tree with the "html.parser" parser.
+
+    BeautifulSoup is only imported when this extractor is used.
+    """
+
+    @staticmethod
+    def extract(html_text_raw: str,
+                wanted_fields: Optional[AbstractSet[str]] = None) -> Tuple[str, Optional[List[str]]]:
+        """
+        Extracts the rendered text and the texts of the first table's cells from HTML content.
+
+        :param html_text_raw: Raw HTML content.
+        :type html_text_raw: str
+        :param wanted_fields: Not used, the whole content is always extracted.
+        :type wanted_fields: set|None
+        :return: The rendered text, and the texts of all cells in the first table (None when there is no table).
+        :rtype: (str, list|None)
+        """
+        from bs4 import BeautifulSoup
+
+        html_content = BeautifulSoup(html_text_raw, "html.parser")
+
+        table = html_content.table
+        table_data = [table_data.text for table_data in table.find_all("td")] if table else None
+
+        return html_content.get_text(), table_data
+
+
+class StreamingExtractor(object):
+    """
+    Extractor collecting the rendered text and the first table's cells in a single pass, without building a tree.
+
+    The results are equal to the ones of the BeautifulSoupExtractor.
+    """
+
+    @staticmethod
+    def extract(html_text_raw: str,
+                wanted_fields: Optional[AbstractSet[str]] = None) -> Tuple[str, Optional[List[str]]]:
+        """
+        Extracts the rendered text and the texts of the first table's cells from HTML content.
+
+        :param html_text_raw: Raw HTML content.
+        :type html_text_raw: str
+        :param wanted_fields: Not used, the whole content is always extracted.
+        :type wanted_fields: set|None
+        :return: The rendered text, and the texts of all cells in the first table (None when there is no table).
+        :rtype: (str, list|None)
+        """
+        parser = StreamingExtractor.create_parser()
+        parser.feed(html_text_raw)
+        parser.close()
+
+        return parser.text, parser.table_data
+
+    @staticmethod
+    def create_parser(wanted_fields: Optional[AbstractSet[str]] = None) -> "StreamingHtmlParser":
+        """
+        :param wanted_fields: Not used, the parser always parses all content it is fed.
+        :type wanted_fields: set|None
+        :return: The parser of this extractor, which the IncrementalExtractor feeds in chunks.
+        :rtype: StreamingHtmlParser
+        """
+        return StreamingHtmlParser()
+
+
+class StreamingHtmlParser(HTMLParser):
+    """
+    HTML parser collecting the rendered text and the texts of the first table's cells while parsing.
+
+    Mimics the way BeautifulSoup builds strings with the "html.parser" parser: data between two markup events forms
+    a single string, whitespace-only strings are collapsed and tags are never closed implicitly.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+
+        self.text_parts = []
+        self.table_cells = None
+
+        # Open tags, as (name, index of the first table's cell or None).
+        self._tag_stack = []
+        self._open_cells = []
+        self._first_table_index = None
+        self._string_containers = 0
+        self._preserve_whitespace = 0
+        # Empty elements closed at their start tag, per tag name, of which an end tag is ignored once.
+        self._already_closed_empty_elements = collections.Counter()
+        self._current_data = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self.text_parts)
+
+    @property
+    def table_data(self) -> Optional[List[str]]:
+        if self.table_cells is None:
+            return None
+
+        return ["".join(cell) for cell in self.table_cells]
+
+    def close(self):
+        super().close()
+        self._end_data()
+
+    def completed_table_data(self) -> Optional[List[str]]:
+        """
+        :return: The texts of the first table's cells once it is closed, an empty list before it is opened and None
+            while it is parsed.
+        :rtype: list|None
+        """
+        if self.table_cells is None:
+            return []
+        if self._first_table_index is not None:
+            return None
+
+        return self.table_data
+
+    def handle_starttag(self, tag, attrs):
+        self._end_data()
+        self._push_tag(tag)
+
+        if tag in EMPTY_ELEMENT_TAGS:
+            self._pop_to_tag(tag)
+            self._already_closed_empty_elements[tag] += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._end_data()
+        self._push_tag(tag)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self._already_closed_empty_elements[tag]:
+            self._already_closed_empty_elements[tag] -= 1
+            return
+
+        self._end_data()
+        self._pop_to_tag(tag)
+
+    def handle_data(self, data):
+        self._current_data.append(data)
+
+    def handle_charref(self, name):
+        if name[0] in ("x", "X"):
+            codepoint = int(name.lstrip(name[0]), 16)
+        else:
+            codepoint = int(name)
+
+        data = None
+        if codepoint < 256:
+            # Numeric references sometimes point to Windows-1252 characters instead of Unicode code points.
+            try:
+                data = bytearray([codepoint]).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(codepoint)
+            except (ValueError, OverflowError):
+                pass
+
+        self.handle_data(data or "\N{REPLACEMENT CHARACTER}")
+
+    def handle_entityref(self, name):
+        self.handle_data(ENTITY_TO_CHARACTER.get(name, f"&{name}"))
+
+    def handle_comment(self, data):
+        self._end_data()
+
+    def handle_decl(self, decl):
+        self._end_data()
+
+    def handle_pi(self, data):
+        self._end_data()
+
+    def unknown_decl(self, data):
+        self._end_data()
+
+        # CDATA sections are part of the rendered text, other declarations are not.
+        if data.upper().startswith("CDATA["):
+            self._current_data.append(data[len("CDATA["):])
+            self._end_data()
+
+    def _end_data(self):
+        if not self._current_data:
+            return
+
+        data = "".join(self._current_data)
+        self._current_data = []
+
+        if not self._preserve_whitespace and not data.strip(ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+
+        if self._string_containers:
+            return
+
+        self.text_parts.append(data)
+        self._add_table_data(data)
+
+    def _push_tag(self, tag):
+        marker = self._open_table_tag(tag)
+
+        if tag in STRING_CONTAINER_TAGS:
+            self._string_containers += 1
+        if tag in PRESERVE_WHITESPACE_TAGS:
+            self._preserve_whitespace += 1
+
+        self._tag_stack.append((tag, marker))
+
+    def _pop_to_tag(self, tag):
+        for i in range(len(self._tag_stack) - 1, -1, -1):
+            if self._tag_stack[i][0] == tag:
+                break
+        else:
+            return
+
+        for depth in range(len(self._tag_stack) - 1, i - 1, -1):
+            name, marker = self._tag_stack[depth]
+            self._close_table_tag(name, marker, depth)
+            if name in STRING_CONTAINER_TAGS:
+                self._string_containers -= 1
+            if name in PRESERVE_WHITESPACE_TAGS:
+                self._preserve_whitespace -= 1
+
+        del self._tag_stack[i:]
+
+    def _open_table_tag(self, tag):
+        # Returns the marker stored with the tag on the stack: the index of the first table's cell, or None.
+        if tag == "table" and self.table_cells is None:
+            self.table_cells = []
+            self._first_table_index = len(self._tag_stack)
+        elif tag == "td" and self._first_table_index is not None:
+            cell = len(self.table_cells)
+            self.table_cells.append([])
+            self._open_cells.append(cell)
+            return cell
+
+        return None
+
+    def _close_table_tag(self, tag, marker, depth):
+        if marker is not None:
+            self._open_cells.pop()
+        if depth == self._first_table_index:
+            self._first_table_index = None
+
+    def _add_table_data(self, data):
+        for cell in self._open_cells:
+            self.table_cells[cell].append(data)
+
+
+class TablesExtractor(object):
+    """
+    Extractor collecting the rendered text and the field-value rows of all tables in a single pass.
+
+    E-mails are often wrapped in layout tables, of which the first table only contains other tables. Instead of the
+    cells of the first table, the cells of every row with exactly 2 cells (td or th) are collected, from all tables.
+    Rows containing a table are layout, the rows of the tables in them are collected instead.
+
+    When the wanted fields are given, extraction stops as soon as all of them are found. This assumes that headers
+    precede the tables containing field-value rows, and that every field occurs once: headers after the row with the
+    last wanted field are not extracted, and of fields occurring in multiple rows the first value is kept, instead of
+    the last one.
+    """
+
+    @staticmethod
+    def extract(html_text_raw: str,
+                wanted_fields: Optional[AbstractSet[str]] = None) -> Tuple[str, Optional[List[str]]]:
+        """
+        Extracts the rendered text and the texts of the cells of all field-value rows from HTML content.
+
+        :param html_text_raw: Raw HTML content.
+        :type html_text_raw: str
+        :param wanted_fields: Normalised names of the fields after which extraction can stop, None to extract all.
+        :type wanted_fields: set|None
+        :return: The rendered text, and the texts of the field and value cell of every field-value row, in order
+            (None when there is no table).
+        :rtype: (str, list|None)
+        """
+        parser = TablesExtractor.create_parser(wanted_fields)
+        try:
+            parser.feed(html_text_raw)
+            parser.close()
+        except AllFieldsFound:
+            pass
+
+        return parser.text, parser.table_data
+
+    @staticmethod
+    def create_parser(wanted_fields: Optional[AbstractSet[str]] = None) -> "TablesHtmlParser":
+        """
+        :param wanted_fields: Normalised names of the fields after which the parser stops, None to parse all content.
+        :type wanted_fields: set|None
+        :return: The parser of this extractor, which the IncrementalExtractor feeds in chunks.
+        :rtype: TablesHtmlParser
+        """
+        return TablesHtmlParser(wanted_fields)
+
+
+class AllFieldsFound(Exception):
+    """
+    Raised while parsing, to stop the TablesHtmlParser once all wanted fields are found.
+    """
+
+
+class TablesHtmlParser(StreamingHtmlParser):
+    """
+    HTML parser collecting the rendered text and the field and value cells of all tables' 2-cell rows while parsing.
+
+    Tables, rows and cells are kept on a stack of their own. A row belongs to the innermost open table, and a cell to
+    the innermost open row, cells outside a row are not collected.
+    """
+
+    def __init__(self, wanted_fields: Optional[AbstractSet[str]] = None):
+        super().__init__()
+
+        self._table_elements = []
+        self._missing_fields = set(wanted_fields) if wanted_fields else None
+        self._headers_found = False
+
+    @property
+    def table_data(self) -> Optional[List[str]]:
+        return self.table_cells
+
+    def completed_table_data(self) -> Optional[List[str]]:
+        # Rows are only added once they are closed.
+        return self.table_cells if self.table_cells is not None else []
+
+    def _open_table_tag(self, tag):
+        top = self._table_elements[-1] if self._table_elements else None
+
+        if tag == "table":
+            if self.table_cells is None:
+                self.table_cells = []
+            if isinstance(top, TableCell):
+                top.row.layout = True
+            element = Table(len(self.text_parts))
+        elif tag == "tr" and isinstance(top, Table):
+            element = TableRow(top)
+        elif tag in CELL_TAGS and isinstance(top, TableRow):
+            element = TableCell(top)
+            top.cells.append(element)
+        else:
+            return None
+
+        self._table_elements.append(element)
+        return element
+
+    def _close_table_tag(self, tag, marker, depth):
+        if marker is None:
+            return
+
+        self._table_elements.pop()
+        if isinstance(marker, TableRow) and not marker.layout and len(marker.cells) == 2:
+            field, value = ("".join(cell.parts) for cell in marker.cells)
+            self.table_cells.extend((field, value))
+
+            if self._missing_fields is not None and not self._headers_found:
+                # Headers precede the first table with field-value rows, they are all in the text rendered before it.
+                self._headers_found = True
+                self._found_fields(
+                    header for header, _ in tokenize_headers("".join(self.text_parts[:marker.table.text_index]))
+                )
+            self._found_fields((field,))
+
+    def _add_table_data(self, data):
+        if self._table_elements and isinstance(self._table_elements[-1], TableCell):
+            self._table_elements[-1].parts.append(data)
+
+    def _found_fields(self, fields):
+        if self._missing_fields is None:
+            return
+
+        for field in fields:
+            self._missing_fields.discard(normalise_field(field))
+
+        if not self._missing_fields:
+            raise AllFieldsFound()
+
+
+class Table(object):
+    __slots__ = ("text_index",)
+
+    def __init__(self, text_index: int):
+        # Number of text parts rendered before the table.
+        self.text_index = text_index
+
+
+class TableRow(object):
+    __slots__ = ("table", "cells", "layout")
+
+    def __init__(self, table: Table):
+        self.table = table
+        self.cells = []
+        # Whether the row contains a table, and is part of the layout instead of a field-value row.
+        self.layout = False
+
+
+class TableCell(object):
+    __slots__ = ("row", "parts")
+
+    def __init__(self, row: TableRow):
+        self.row = row
+        self.parts = []
+
+
+class IncrementalExtractor(object):
+    """
+    Extractor feeding HTML content in chunks to the parser of the StreamingExtractor or TablesExtractor, and stopping
+    as soon as all wanted fields are found in the headers and table cells parsed so far.
+
+    The quoted history of long e-mail threads, after the structured block, is then not parsed at all. This assumes
+    that every field occurs once: headers and rows after the chunk in which the last wanted field is found are not
+    extracted. The first table of the StreamingExtractor is only searched once it is closed, and when parsing stops
+    before it is opened no table cells are extracted.
+    """
+
+    def __init__(self, extractor, chunk_size: int = 16384):
+        """
+        :param extractor: The extractor of which the parser is used, which must have a create_parser method.
+        :type extractor: type
+        :param chunk_size: Number of characters fed to the parser at once.
+        :type chunk_size: int
+        """
+        if not hasattr(extractor, "create_parser"):
+            raise ValueError(f"The {extractor.__name__} can not parse HTML content in chunks.")
+
+        self.extractor = extractor
+        self.chunk_size = chunk_size
+
+    def extract(self, html_text_raw: str,
+                wanted_fields: Optional[AbstractSet[str]] = None) -> Tuple[str, Optional[List[str]]]:
+        """
+        Extracts the rendered text and table cells from HTML content, like the wrapped extractor does.
+
+        :param html_text_raw: Raw HTML content.
+        :type html_text_raw: str
+        :param wanted_fields: Normalised names of the fields after which extraction can stop, None to extract all.
+        :type wanted_fields: set|None
+        :return: The rendered text, and the texts of the table cells (None when there is no table).
+        :rtype: (str, list|None)
+        """
+        if not wanted_fields:
+            return self.extractor.extract(html_text_raw)
+
+        # Parsing stops here instead of in the parser, all fields are searched for in the same way.
+        parser = self.extractor.create_parser()
+        missing_fields = set(wanted_fields)
+        header_scanner = HeaderScanner()
+        text_index = 0
+        cell_index = 0
+
+        for start in range(0, len(html_text_raw), self.chunk_size):
+            parser.feed(html_text_raw[start:start + self.chunk_size])
+
+            # Only text parts that are complete are scanned, data at the end of the chunk may still continue.
+            text_parts = parser.text_parts
+            for field in header_scanner.feed("".join(text_parts[text_index:])):
+                missing_fields.discard(normalise_field(field))
+            text_index = len(text_parts)
+
+            table_data = parser.completed_table_data()
+            if table_data is None or len(table_data) % 2:
+                continue
+            for i in range(cell_index, len(table_data), 2):
+                missing_fields.discard(normalise_field(table_data[i]))
+            cell_index = len(table_data)
+
+            if not missing_fields:
+                return parser.text, table_data
+
+        parser.close()
+        return parser.text, parser.table_data
+
+
+def normalise_field(field: str) -> str:
+    """
+    Normalises the field of a header or table row the way EmailProcessor does, to compare it to wanted fields.
+
+    :param field: The field, as it is found in the rendered text or table cell.
+    :type field: str
+    :return: The normalised field name.
+    :rtype: str
+    """
+    if field[-1:] == ":":
+        field = field[:-1]
+
+    return FieldPlan.normalise(field.replace(u"\xa0", u" ").strip())
+
+
+HTML_EXTRACTORS = {
+    "beautifulsoup": BeautifulSoupExtractor,
+    "streaming": StreamingExtractor,
+    "tables": TablesExtractor,
+}
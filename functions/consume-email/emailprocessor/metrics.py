@@ -0,0 +1,197 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+# Upper bounds (in milliseconds) of the histogram buckets, the last bucket counts everything above them.
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram(object):
+    """
+    Histogram of durations, with fixed buckets.
+    """
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_dict(self) -> dict:
+        buckets = {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {"count": self.count, "sum": self.sum, "max": self.max, "buckets": buckets}
+
+
+class Metrics(object):
+    """
+    In-process counters and histograms of the processed messages.
+
+    When disabled, message() returns a shared no-op object, so instrumented code costs (almost) nothing.
+    """
+
+    def __init__(self, name: str, enabled: bool = False):
+        """
+        :param name: Name of the function, added to every log line.
+        :type name: str
+        :param enabled: Whether to measure and log messages.
+        :type enabled: bool
+        """
+        self.name = name
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def message(self):
+        """
+        Starts measuring a message.
+
+        :return: The measurements of the message, call finish() on it when the message is processed.
+        :rtype: MessageMetrics|NullMessageMetrics
+        """
+        if not self.enabled:
+            return NULL_MESSAGE_METRICS
+
+        return MessageMetrics(self)
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self) -> dict:
+        """
+        :return: The current counters and histograms.
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            }
+
+
+class MessageMetrics(object):
+    """
+    Stage durations and sizes of a single message.
+    """
+
+    __slots__ = ("metrics", "start", "stages", "sizes", "finished")
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.sizes = {}
+        self.finished = False
+
+    def stage(self, name: str):
+        """
+        Times a stage, as a context manager. The durations of a stage that is entered more than once are summed.
+
+        :param name: Name of the stage.
+        :type name: str
+        """
+        return StageTimer(self, name)
+
+    def size(self, name: str, value: int):
+        self.sizes[name] = value
+
+    def finish(self, status: str, mail_id: Optional[str] = None):
+        """
+        Records the measurements of the message and logs them as a single JSON line.
+
+        Only the first call has effect, so a message can be finished early with a more specific status.
+
+        :param status: Outcome of processing the message.
+        :type status: str
+        :param mail_id: The id of the e-mail, when known.
+        :type mail_id: str|None
+        """
+        if self.finished:
+            return
+        self.finished = True
+
+        total = (time.perf_counter() - self.start) * 1000
+
+        self.metrics.increment(f"messages_{status}")
+        self.metrics.observe("total_ms", total)
+        for name, duration in self.stages.items():
+            self.metrics.observe(f"{name}_ms", duration)
+        for name, value in self.sizes.items():
+            self.metrics.increment(name, value)
+
+        logging.info(json.dumps({
+            "metrics": self.metrics.name,
+            "status": status,
+            "mail_id": mail_id,
+            "total_ms": round(total, 3),
+            "stages_ms": {name: round(duration, 3) for name, duration in self.stages.items()},
+            "sizes": self.sizes,
+        }))
+
+
+class StageTimer(object):
+    __slots__ = ("message_metrics", "name", "start")
+
+    def __init__(self, message_metrics: MessageMetrics, name: str):
+        self.message_metrics = message_metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stages = self.message_metrics.stages
+        stages[self.name] = stages.get(self.name, 0.0) + (time.perf_counter() - self.start) * 1000
+        return False
+
+
+class NullMessageMetrics(object):
+    """
+    Measurements of a message when metrics are disabled, doing nothing.
+    """
+
+    __slots__ = ()
+
+    def stage(self, name: str):
+        return NULL_STAGE_TIMER
+
+    def size(self, name: str, value: int):
+        pass
+
+    def finish(self, status: str, mail_id: Optional[str] = None):
+        pass
+
+
+class NullStageTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_MESSAGE_METRICS = NullMessageMetrics()
+NULL_STAGE_TIMER = NullStageTimer()
@@ -0,0 +1,68 @@
+import collections
+import itertools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional, Tuple
+
+from .emailprocessor import EmailProcessor
+
+# Processor of a worker process, created once per worker.
+_worker_processor = None
+
+
+def _init_worker():
+    global _worker_processor
+    _worker_processor = EmailProcessor()
+
+
+def _parse_chunk(mails: list) -> list:
+    return [_parse_mail(mail) for mail in mails]
+
+
+def _parse_mail(mail: dict) -> Optional[dict]:
+    # A malformed e-mail should not fail the other e-mails of its chunk.
+    try:
+        return _worker_processor.parse_mail(mail)
+    except Exception as e:
+        logging.exception(f"E-mail could not be parsed: {e}")
+        return None
+
+
+class ParallelParser(object):
+    """
+    Parses e-mails in a pool of worker processes, so parsing scales over all CPU cores.
+
+    E-mails are submitted in chunks, with a bounded number of chunks in flight, and results are returned in order.
+    Publishing is left to the calling process.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 50, max_pending_chunks: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_pending_chunks = max_pending_chunks or self.workers * 2
+
+    def parse(self, mails: Iterable[dict]) -> Iterator[Tuple[dict, Optional[dict]]]:
+        """
+        Parses e-mails, like EmailProcessor.parse_mail.
+
+        :param mails: The e-mail objects.
+        :type mails: Iterable[dict]
+        :return: Tuples of each e-mail and its parsed fields (None when rejected), in the order of the e-mails.
+        :rtype: Iterator[(dict, dict|None)]
+        """
+        mails = iter(mails)
+        pending = collections.deque()
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) as executor:
+            while True:
+                chunk = list(itertools.islice(mails, self.chunk_size))
+                if chunk:
+                    pending.append((chunk, executor.submit(_parse_chunk, chunk)))
+                if not pending:
+                    break
+                if chunk and len(pending) < self.max_pending_chunks:
+                    continue
+
+                chunk, future = pending.popleft()
+                yield from zip(chunk, future.result())
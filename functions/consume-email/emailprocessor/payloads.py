@@ -0,0 +1,55 @@
+import gzip
+import json
+import logging
+import os
+import sys
+from typing import Iterator, Optional
+
+
+def iter_payloads(path: str, statistics: Optional[dict] = None) -> Iterator[dict]:
+    """
+    Iterates over stored e-mail payloads ({"email": {...}}, as consumed by EmailProcessor.process).
+
+    The payloads are streamed, so memory use does not depend on the size of the input.
+
+    :param path: A (gzipped) JSONL file with a payload per line, "-" for stdin, or a directory with a JSON file per
+        payload.
+    :type path: str
+    :param statistics: Optional dictionary in which the number of characters read is counted ("characters").
+    :type statistics: dict|None
+    :return: The payloads, one at a time.
+    :rtype: Iterator[dict]
+    """
+    if statistics is None:
+        statistics = {}
+    statistics.setdefault("characters", 0)
+
+    if os.path.isdir(path):
+        for file_name in sorted(os.listdir(path)):
+            if not file_name.endswith(".json"):
+                continue
+            with open(os.path.join(path, file_name), encoding="utf-8") as payload_file:
+                payload = payload_file.read()
+            statistics["characters"] += len(payload)
+            yield json.loads(payload)
+        return
+
+    if path == "-":
+        yield from _iter_lines(sys.stdin, path, statistics)
+    elif path.endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8") as payload_file:
+            yield from _iter_lines(payload_file, path, statistics)
+    else:
+        with open(path, encoding="utf-8") as payload_file:
+            yield from _iter_lines(payload_file, path, statistics)
+
+
+def _iter_lines(payload_file, path: str, statistics: dict) -> Iterator[dict]:
+    for line_number, line in enumerate(payload_file, start=1):
+        statistics["characters"] += len(line)
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            logging.error(f"Line {line_number} of {path} is not valid JSON: {e}")
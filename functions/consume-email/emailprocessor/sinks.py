@@ -0,0 +1,89 @@
+import gzip
+import json
+import sys
+from typing import Optional
+
+from .emailprocessor import EmailProcessor
+
+
+class StdoutSink(object):
+    """
+    Writes parsed e-mails to stdout, one JSON object per line.
+    """
+
+    def __init__(self, output=None):
+        self.output = output or sys.stdout
+
+    def write(self, mail_variables: dict):
+        self.output.write(json.dumps(mail_variables) + "\n")
+
+    def close(self) -> int:
+        """
+        :return: The number of e-mails that could not be written.
+        :rtype: int
+        """
+        self.output.flush()
+        return 0
+
+
+class FileSink(StdoutSink):
+    """
+    Writes parsed e-mails to a JSONL file, gzipped when its name ends with ".gz".
+    """
+
+    def __init__(self, path: str):
+        if path.endswith(".gz"):
+            output = gzip.open(path, "wt", encoding="utf-8")
+        else:
+            output = open(path, "w", encoding="utf-8")
+        super().__init__(output)
+
+    def close(self) -> int:
+        self.output.close()
+        return 0
+
+
+class PubSubSink(object):
+    """
+    Publishes parsed e-mails to the configured topic in batches.
+
+    The publishes are waited for every flush_every e-mails, and only the number of failed publishes is kept, so memory
+    use does not grow with the number of e-mails. The Pub/Sub client connects to a local emulator when the
+    PUBSUB_EMULATOR_HOST environment variable is set.
+    """
+
+    def __init__(self, flush_every: Optional[int] = None):
+        """
+        :param flush_every: Number of e-mails after which their publishes are waited for, by default max_in_flight of
+            the PUBLISH_BATCH_SETTINGS.
+        :type flush_every: int|None
+        """
+        self.processor = EmailProcessor(batch_publishing=True)
+        self.publish_batch = self.processor.publish_batch()
+        self.flush_every = flush_every or self.publish_batch.max_in_flight
+        self.queued_count = 0
+        self.failed_count = 0
+
+    def write(self, mail_variables: dict):
+        if not self.processor.publish(mail_variables, self.publish_batch):
+            self.failed_count += 1
+
+        self.queued_count += 1
+        if self.queued_count >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        results = self.processor.flush(self.publish_batch)
+        self.failed_count += sum(1 for published in results.values() if not published)
+        self.queued_count = 0
+
+    def close(self) -> int:
+        self.flush()
+        return self.failed_count
+
+
+SINKS = {
+    "stdout": StdoutSink,
+    "file": FileSink,
+    "pubsub": PubSubSink,
+}
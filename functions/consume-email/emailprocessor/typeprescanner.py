@@ -0,0 +1,117 @@
+import html
+import re
+from typing import Iterable, Optional
+
+TAG_REGEX = re.compile(r"<[^>]*>")
+
+CELL_START_REGEX = re.compile(r"<td(?:\s[^>]*)?>")
+
+# Maximum number of tags and &nbsp; entities around a field or value, which do not end up as text in it. Bounded, so
+# a match that fails on markup without text does not scan all tags that follow.
+MAX_FILLER = 16
+
+# Whitespace, &nbsp; and tags.
+FILLER = r"\s*(?:(?:&nbsp;|<[^>]*>)\s*){{0,{}}}".format(MAX_FILLER)
+
+
+class TypePrescanner(object):
+    """
+    Finds the type of an e-mail in its raw HTML content, without parsing the HTML.
+
+    Looks for the type field as a header (field: <<value>>) and as a table row (<td>field</td><td>value</td>). This is a
+    best-effort scan: an e-mail is only rejected when type values were found, none of them is allowed, and none of the
+    allowed types occurs anywhere in the raw content. Any e-mail of which the type might still be allowed is left to the
+    full parse.
+    """
+
+    def __init__(self, type_field: str, allowed_types: Iterable[str]):
+        # Field names are lowercased and spaces are replaced with underscores after extraction.
+        field = r"(?i:{})".format(r"[ _]".join(re.escape(part) for part in type_field.split("_")))
+
+        # Occurrences of the field are found first, the header and table row are only matched around them.
+        self.field_regex = re.compile(r"(?<!\w){}".format(field))
+        self.header_regex = re.compile(
+            r"\s*:{filler}&lt;(?:&lt;)?((?:[^<&>]|<[^>]*>|&(?!gt;))*?)&gt;".format(filler=FILLER)
+        )
+        self.table_regex = re.compile(
+            r"(?::(?:<[^>]*>){{0,{max_filler}}}|{filler})</td>{filler}<td(?:\s[^>]*)?>(.*?)</td>".format(
+                max_filler=MAX_FILLER, filler=FILLER
+            ),
+            re.DOTALL,
+        )
+
+        self.allowed_types = frozenset(allowed_types)
+        self._allowed_type_markers = frozenset(
+            marker for allowed_type in self.allowed_types
+            for marker in (allowed_type, html.escape(allowed_type, quote=False))
+        )
+
+    def find_rejected_type(self, html_text_raw: str) -> Optional[str]:
+        """
+        Finds a type in the raw HTML content that allows rejecting the e-mail before parsing it.
+
+        :param html_text_raw: Raw HTML contents from e-mail.
+        :type html_text_raw: str
+        :return: A type found in the content when the e-mail can be rejected, None otherwise.
+        :rtype: str|None
+        """
+        header_values = []
+        table_values = []
+        for field_match in self.field_regex.finditer(html_text_raw):
+            end = field_match.end()
+
+            header_match = self.header_regex.match(html_text_raw, end)
+            if header_match:
+                header_values.append(header_match.group(1))
+
+            if self._follows_cell_start(html_text_raw, field_match.start()):
+                table_match = self.table_regex.match(html_text_raw, end)
+                if table_match:
+                    table_values.append(table_match.group(1))
+
+        found_types = [self._clean_value(value) for value in header_values + table_values]
+        found_types = [found_type for found_type in found_types if found_type]
+
+        if not found_types or any(found_type in self.allowed_types for found_type in found_types):
+            return None
+
+        if any(marker in html_text_raw for marker in self._allowed_type_markers):
+            return None
+
+        return found_types[0]
+
+    @staticmethod
+    def _follows_cell_start(html_text_raw: str, position: int) -> bool:
+        """
+        :param html_text_raw: Raw HTML contents from e-mail.
+        :type html_text_raw: str
+        :param position: Start of an occurrence of the field.
+        :type position: int
+        :return: Whether the field is preceded by the start tag of a cell, and at most MAX_FILLER tags and &nbsp;
+            entities.
+        :rtype: bool
+        """
+        for _ in range(MAX_FILLER + 1):
+            while position and html_text_raw[position - 1].isspace():
+                position -= 1
+
+            if html_text_raw.endswith("&nbsp;", 0, position):
+                position -= len("&nbsp;")
+                continue
+            if not html_text_raw.endswith(">", 0, position):
+                return False
+
+            start = html_text_raw.rfind("<", 0, position)
+            if start == -1 or html_text_raw.find(">", start, position - 1) != -1:
+                return False
+            if CELL_START_REGEX.fullmatch(html_text_raw, start, position):
+                return True
+
+            position = start
+
+        return False
+
+    @staticmethod
+    def _clean_value(value: str) -> str:
+        value = html.unescape(TAG_REGEX.sub("", value))
+        return value.replace(u"\xa0", u" ").strip()
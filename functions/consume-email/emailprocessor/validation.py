@@ -0,0 +1,105 @@
+import abc
+import logging
+from typing import Iterable, Pattern
+
+from .typeprescanner import TypePrescanner
+
+
+class ValidationStage(abc.ABC):
+    """
+    A check of an e-mail before its HTML content is parsed.
+
+    EmailProcessor runs its validation stages in order, cheapest first, and rejects an e-mail at the first stage it
+    does not pass. Custom stages can be added to EmailProcessor.validation_stages.
+    """
+
+    # Name of the stage, under which its rejections are counted.
+    name = None
+
+    @abc.abstractmethod
+    def validate(self, mail: dict) -> bool:
+        """
+        :param mail: The e-mail object.
+        :type mail: dict
+        :return: Whether the e-mail passes the stage, the reason is logged when it does not.
+        :rtype: bool
+        """
+
+
+class BodySizeValidation(ValidationStage):
+    """
+    Rejects e-mails with HTML content longer than the maximum body size.
+    """
+
+    name = "body_size"
+
+    def __init__(self, max_body_size: int):
+        self.max_body_size = max_body_size
+
+    def validate(self, mail: dict) -> bool:
+        body_size = len(mail["body"])
+        if body_size <= self.max_body_size:
+            return True
+
+        logging.error(f"E-mail content of {body_size} characters exceeds the maximum of {self.max_body_size}.")
+        return False
+
+
+class SenderValidation(ValidationStage):
+    """
+    Rejects e-mails that were not sent by a whitelisted e-mail address.
+    """
+
+    name = "sender"
+
+    def __init__(self, whitelisted_senders: Iterable[str]):
+        self.whitelisted_senders = frozenset(whitelisted_senders)
+
+    def validate(self, mail: dict) -> bool:
+        mail_sender = mail["sender"].lower()
+        if mail_sender in self.whitelisted_senders:
+            return True
+
+        date = mail.get("received_on", "")
+        logging.error(
+            f"E-mail received on {str(date)} was not send by a whitelisted e-mail address ({mail_sender})."
+        )
+        return False
+
+
+class TicketValidation(ValidationStage):
+    """
+    Rejects e-mails without a ticket number in their subject, as no id can be generated for them.
+    """
+
+    name = "ticket"
+
+    def __init__(self, ticket_number_regex: Pattern):
+        self.ticket_number_regex = ticket_number_regex
+
+    def validate(self, mail: dict) -> bool:
+        subject = mail["subject"]
+        if self.ticket_number_regex.match(subject):
+            return True
+
+        logging.error(f"No ticket number found in e-mail subject ({subject}).")
+        return False
+
+
+class TypePrescanValidation(ValidationStage):
+    """
+    Rejects e-mails with a type that is not allowed, found in their raw HTML content.
+    """
+
+    name = "type_prescan"
+
+    def __init__(self, type_prescanner: TypePrescanner):
+        self.type_prescanner = type_prescanner
+
+    def validate(self, mail: dict) -> bool:
+        rejected_type = self.type_prescanner.find_rejected_type(mail["body"])
+        if rejected_type is None:
+            return True
+
+        logging.error(f"'{rejected_type}' is not an allowed type.")
+        return False
@@ -1,4 +1,4 @@
-import base64
+import binascii
 import json
 import logging
 
@@ -7,9 +7,13 @@ from config import DEBUG_LOGGING
 from emailprocessor import EmailProcessor
 
 parser = EmailProcessor()
+batch_parser = EmailProcessor(batch_publishing=True)
 
 logging.basicConfig(level=logging.INFO)
 
+# Maximum number of payload bytes shown in debug logging.
+DEBUG_PAYLOAD_BYTES = 1024
+
 
 def log(debug_message, normal_message):
     if DEBUG_LOGGING:
@@ -18,20 +22,62 @@ def log(debug_message, normal_message):
         logging.info(normal_message)
 
 
+def decode_message_data(message: dict) -> bytes:
+    """
+    Decodes the base64 data of a Pub/Sub message, and removes it from the message.
+
+    binascii decodes the base64 text directly, without the ASCII copy base64.b64decode makes of it first, and removing
+    the data from the message frees the base64 text as soon as it is decoded. Large e-mails (e.g. with inline images)
+    are then only kept in memory once, as bytes.
+
+    :param message: The Pub/Sub message.
+    :type message: dict
+    :return: The decoded data.
+    :rtype: bytes
+    """
+    return binascii.a2b_base64(message.pop("data"))
+
+
+def payload_for_logging(payload: bytes) -> str:
+    """
+    :return: The payload, truncated to DEBUG_PAYLOAD_BYTES bytes.
+    :rtype: str
+    """
+    if len(payload) <= DEBUG_PAYLOAD_BYTES:
+        return str(payload)
+
+    return f"{payload[:DEBUG_PAYLOAD_BYTES]}... ({len(payload)} bytes)"
+
+
 def email_parser(request):
-    # Extract data from request
-    envelope = json.loads(request.data.decode("utf-8"))
-    payload = base64.b64decode(envelope["message"]["data"])
+    message_metrics = parser.metrics.message()
+
+    # Extract data from request, json.loads decodes the UTF-8 bytes itself
+    with message_metrics.stage("decode"):
+        envelope = json.loads(request.data)
+        payload = decode_message_data(envelope["message"])
+    message_metrics.size("payload_bytes", len(payload))
 
     # Extract subscription from subscription string
     try:
         subscription = envelope["subscription"].split("/")[-1]
         log(
-            f"Message received from {subscription} [{payload}]",
+            f"Message received from {subscription} [{payload_for_logging(payload)}]",
             f"Message received from {subscription}",
         )
 
-        parser.process(json.loads(payload))
+        with message_metrics.stage("decode"):
+            mail_payload = json.loads(payload)
+        # Only the parsed payload is needed from here on
+        del envelope, payload
+
+        # E-mails are queued in a batch of this request in batch publishing mode, and waited for at its end
+        publish_batch = parser.publish_batch()
+        parser.process(mail_payload, message_metrics, publish_batch)
+
+        for mail_id, published in parser.flush(publish_batch).items():
+            if not published:
+                logging.error(f"Message with e-mail ID {mail_id} not processed")
 
     except Exception as e:
         logging.info("Extract of subscription failed")
@@ -41,3 +87,85 @@ def email_parser(request):
     # Returning any 2xx status indicates successful receipt of the message.
     # 204: no content, delivery successfull, no further actions needed
     return "OK", 204
+
+
+def email_parser_batch(request):
+    """
+    Processes a batch of e-mails in a single request.
+
+    The request contains either a JSON array of Pub/Sub push envelopes, or a Pub/Sub pull response
+    ({"receivedMessages": [...]}). The parsed e-mails are published in bulk, and the response tells per message
+    whether it should be acknowledged.
+    """
+    body = json.loads(request.data)
+    entries = body.get("receivedMessages", []) if isinstance(body, dict) else body
+
+    messages = []
+    for index, entry in enumerate(entries):
+        message = entry.get("message", {})
+        message_id = entry.get("ackId") or message.get("messageId") or message.get("message_id") or str(index)
+        try:
+            payload = decode_message_data(message)
+        except Exception as e:
+            logging.error(f"Data of message {message_id} could not be decoded: {e}")
+            payload = None
+        messages.append((message_id, payload))
+
+    del body, entries
+
+    acks = process_payloads(messages)
+    log(
+        f"Batch of {len(acks)} messages processed: {acks}",
+        f"Batch of {len(acks)} messages processed",
+    )
+
+    results = [
+        {"id": message_id, "status": "ack" if acks[message_id] else "nack"}
+        for message_id, _ in messages
+    ]
+    return json.dumps({"results": results}), 200, {"Content-Type": "application/json"}
+
+
+def process_payloads(messages):
+    """
+    Processes e-mail messages, publishing the parsed e-mails in bulk.
+
+    A message should not be acknowledged when it could not be decoded or processed, or when publishing its parsed
+    e-mail failed. E-mails that are rejected by the parser are acknowledged, like in email_parser.
+
+    :param messages: Tuples of message id and payload, the payload is None when the message could not be decoded.
+    :type messages: list
+    :return: Per message id whether the message can be acknowledged.
+    :rtype: dict
+    """
+    acks = {}
+    message_ids_per_mail = {}
+    # Concurrent requests share the batch_parser, the e-mails of this request are published in a batch of its own
+    publish_batch = batch_parser.publish_batch()
+
+    for message_id, payload in messages:
+        if payload is None:
+            acks[message_id] = False
+            continue
+
+        message_metrics = batch_parser.metrics.message()
+        message_metrics.size("payload_bytes", len(payload))
+        try:
+            with message_metrics.stage("decode"):
+                mail_payload = json.loads(payload)
+            mail_id = batch_parser.process(mail_payload, message_metrics, publish_batch)
+        except Exception as e:
+            logging.exception(f"Message {message_id} could not be processed: {e}")
+            acks[message_id] = False
+            continue
+
+        acks[message_id] = True
+        if mail_id:
+            message_ids_per_mail.setdefault(mail_id, []).append(message_id)
+
+    for mail_id, published in batch_parser.flush(publish_batch).items():
+        if not published:
+            for message_id in message_ids_per_mail.get(mail_id, []):
+                acks[message_id] = False
+
+    return acks
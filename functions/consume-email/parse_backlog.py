@@ -0,0 +1,68 @@
+"""
+Parses a backlog of stored e-mail payloads on all CPU cores.
+
+The payloads ({"email": {...}}) are read from a JSONL file or a directory of JSON files, and parsed in a pool of worker
+processes. The parsed e-mails are written as JSONL, or published to the configured topic from this process.
+
+Run from the consume-email directory (a config.py has to be present):
+    python parse_backlog.py --input payloads.jsonl --output parsed.jsonl --workers 8
+"""
+import argparse
+import logging
+import sys
+import time
+
+from emailprocessor.parallel import ParallelParser
+from emailprocessor.payloads import iter_payloads
+from emailprocessor.sinks import FileSink, PubSubSink, StdoutSink
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_backlog(input_path, sink, workers, chunk_size):
+    parallel_parser = ParallelParser(workers=workers, chunk_size=chunk_size)
+
+    parsed_count = rejected_count = 0
+    start = time.perf_counter()
+
+    mails = (payload["email"] for payload in iter_payloads(input_path))
+    for mail, mail_variables in parallel_parser.parse(mails):
+        if not mail_variables:
+            rejected_count += 1
+            continue
+
+        parsed_count += 1
+        sink.write(mail_variables)
+
+    failed_count = sink.close()
+
+    elapsed = time.perf_counter() - start
+    total = parsed_count + rejected_count
+    print(
+        f"Parsed {parsed_count} and rejected {rejected_count} e-mails in {elapsed:.1f}s "
+        f"({total / elapsed if elapsed else 0:.0f} e-mails/s) with {parallel_parser.workers} workers, "
+        f"{failed_count} could not be written",
+        file=sys.stderr,
+    )
+    return failed_count == 0
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-i", "--input", required=True, help="JSONL file or directory of JSON files")
+    argparser.add_argument("-o", "--output", help="JSONL file to write the parsed e-mails to (default stdout)")
+    argparser.add_argument("-w", "--workers", type=int, help="Number of worker processes (default all cores)")
+    argparser.add_argument("-c", "--chunk-size", type=int, default=50)
+    argparser.add_argument("-p", "--publish", action="store_true", help="Publish to the configured topic")
+    argparser.add_argument("-l", "--log-level", default="CRITICAL", help="Log level of the e-mail processing")
+    args = argparser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    if args.publish:
+        backlog_sink = PubSubSink()
+    elif args.output:
+        backlog_sink = FileSink(args.output)
+    else:
+        backlog_sink = StdoutSink()
+    succeeded = parse_backlog(args.input, backlog_sink, args.workers, args.chunk_size)
+    sys.exit(0 if succeeded else 1)
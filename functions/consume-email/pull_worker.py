@@ -0,0 +1,59 @@
+"""
+Pulls messages containing e-mails from a Pub/Sub subscription, and processes them in batches.
+
+Processes the same messages as the email_parser function, but pays the per-invocation overhead once per batch.
+Messages that could not be processed are negatively acknowledged, so they are delivered again.
+
+Run from the consume-email directory (a config.py has to be present):
+    python pull_worker.py --subscription projects/{project}/subscriptions/{subscription} --max-messages 100
+"""
+import argparse
+import logging
+
+from google.api_core import exceptions
+from google.cloud import pubsub_v1
+
+from main import process_payloads
+
+logging.basicConfig(level=logging.INFO)
+
+
+def pull_batches(subscription, max_messages, timeout):
+    subscriber = pubsub_v1.SubscriberClient()
+
+    while True:
+        try:
+            response = subscriber.pull(
+                request={"subscription": subscription, "max_messages": max_messages}, timeout=timeout
+            )
+        except exceptions.DeadlineExceeded:
+            continue
+
+        if not response.received_messages:
+            continue
+
+        messages = [
+            (received_message.ack_id, received_message.message.data)
+            for received_message in response.received_messages
+        ]
+        acks = process_payloads(messages)
+
+        ack_ids = [ack_id for ack_id, ack in acks.items() if ack]
+        nack_ids = [ack_id for ack_id, ack in acks.items() if not ack]
+        if ack_ids:
+            subscriber.acknowledge(request={"subscription": subscription, "ack_ids": ack_ids})
+        if nack_ids:
+            subscriber.modify_ack_deadline(
+                request={"subscription": subscription, "ack_ids": nack_ids, "ack_deadline_seconds": 0}
+            )
+
+        logging.info(f"Processed batch of {len(messages)} messages, {len(nack_ids)} not acknowledged")
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-s", "--subscription", required=True)
+    argparser.add_argument("-m", "--max-messages", type=int, default=100)
+    argparser.add_argument("-t", "--timeout", type=float, default=60)
+    args = argparser.parse_args()
+    pull_batches(args.subscription, args.max_messages, args.timeout)
@@ -0,0 +1,98 @@
+"""
+Replays archived e-mail payloads through the parse, validation and id pipeline of the consume-email function.
+
+The payloads ({"email": {...}}) are streamed line by line from a (gzipped) JSONL file or stdin, so memory use stays
+constant whatever the size of the archive. The parsed e-mails are written to a sink:
+    stdout: JSON lines on stdout
+    file: JSON lines in the file given by --output (gzipped when it ends with ".gz")
+    pubsub: published to the configured topic, set PUBSUB_EMULATOR_HOST to publish to a local emulator
+
+Run from the consume-email directory (a config.py has to be present):
+    python replay.py --input archive.jsonl.gz --sink file --output parsed.jsonl.gz
+"""
+import argparse
+import logging
+import resource
+import sys
+import time
+
+from emailprocessor import EmailProcessor
+from emailprocessor.parallel import ParallelParser
+from emailprocessor.payloads import iter_payloads
+from emailprocessor.sinks import SINKS
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_serially(mails):
+    processor = EmailProcessor()
+    for mail in mails:
+        try:
+            yield mail, processor.parse_mail(mail)
+        except Exception as e:
+            logging.exception(f"E-mail could not be parsed: {e}")
+            yield mail, None
+
+
+def replay(input_path, sink, workers=1, limit=None, progress_every=0):
+    statistics = {"read": 0, "parsed": 0, "rejected": 0}
+    mails = (payload.get("email", {}) for payload in iter_payloads(input_path, statistics))
+    if workers > 1:
+        results = ParallelParser(workers=workers).parse(mails)
+    else:
+        results = parse_serially(mails)
+
+    start = time.perf_counter()
+
+    for mail, mail_variables in results:
+        statistics["read"] += 1
+        if mail_variables:
+            statistics["parsed"] += 1
+            sink.write(mail_variables)
+        else:
+            statistics["rejected"] += 1
+
+        if progress_every and statistics["read"] % progress_every == 0:
+            print(f"{statistics['read']} e-mails read", file=sys.stderr)
+        if limit and statistics["read"] >= limit:
+            break
+
+    statistics["failed"] = sink.close()
+    statistics["seconds"] = time.perf_counter() - start
+    return statistics
+
+
+def report(statistics):
+    seconds = statistics["seconds"] or float("inf")
+    # ru_maxrss is in kilobytes on Linux
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(
+        f"Read {statistics['read']} e-mails in {statistics['seconds']:.2f}s: "
+        f"{statistics['parsed']} parsed, {statistics['rejected']} rejected, {statistics['failed']} failed to write\n"
+        f"Throughput: {statistics['read'] / seconds:.1f} e-mails/s, "
+        f"{statistics['characters'] / seconds / 1024 / 1024:.2f} MB/s of JSON\n"
+        f"Peak memory: {peak_memory:.1f} MB",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-i", "--input", required=True, help="(Gzipped) JSONL file, or - for stdin")
+    argparser.add_argument("-s", "--sink", choices=sorted(SINKS), default="stdout")
+    argparser.add_argument("-o", "--output", help="Output file of the file sink")
+    argparser.add_argument("-w", "--workers", type=int, default=1, help="Number of parsing processes")
+    argparser.add_argument("-n", "--limit", type=int, help="Maximum number of e-mails to replay")
+    argparser.add_argument("-p", "--progress-every", type=int, default=0, help="Report progress every N e-mails")
+    argparser.add_argument("-l", "--log-level", default="CRITICAL", help="Log level of the e-mail processing")
+    args = argparser.parse_args()
+
+    if args.sink == "file" and not args.output:
+        argparser.error("--output is required for the file sink")
+
+    logging.getLogger().setLevel(args.log_level)
+    replay_sink = SINKS[args.sink](args.output) if args.sink == "file" else SINKS[args.sink]()
+    replay_statistics = replay(args.input, replay_sink, args.workers, args.limit, args.progress_every)
+    report(replay_statistics)
+    sys.exit(1 if replay_statistics["failed"] else 0)
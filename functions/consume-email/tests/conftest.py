@@ -0,0 +1,141 @@
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+FUNCTION_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, FUNCTION_DIRECTORY)
+
+# The tests run with the example configuration when no config.py is present.
+if not os.path.exists(os.path.join(FUNCTION_DIRECTORY, "config.py")):
+    spec = importlib.util.spec_from_file_location("config", os.path.join(FUNCTION_DIRECTORY, "config.example.py"))
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    sys.modules["config"] = config
+
+
+class FakeDocumentSnapshot(object):
+    def __init__(self, exists):
+        self.exists = exists
+
+
+class FakeDocument(object):
+    def __init__(self, documents, document_id):
+        self.documents = documents
+        self.document_id = document_id
+
+    def get(self):
+        return FakeDocumentSnapshot(self.document_id in self.documents)
+
+    def set(self, data):
+        self.documents[self.document_id] = data
+
+
+class FakeCollection(object):
+    def __init__(self):
+        self.documents = {}
+
+    def document(self, document_id):
+        return FakeDocument(self.documents, document_id)
+
+
+class FakeFirestoreClient(object):
+    """
+    In-memory Firestore client, with the collection and document methods used by the FirestoreBackend.
+    """
+
+    def __init__(self):
+        self.collections = {}
+
+    def collection(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+
+class FakeFuture(object):
+    def __init__(self, message_id=None, error=None):
+        self.message_id = message_id
+        self.error = error
+
+    def result(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return self.message_id
+
+
+class FakePublisherClient(object):
+    """
+    Pub/Sub publisher keeping the published messages. Publishing the e-mails with an id in fail_ids fails.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.fail_ids = set()
+        # Called with every published message, e.g. to process another request while this one is publishing
+        self.on_publish = None
+
+    def publish(self, topic, data, **attributes):
+        message = json.loads(data)
+        self.messages.append(message)
+        if self.on_publish is not None:
+            self.on_publish(message)
+        if message["parsed_email"]["id"] in self.fail_ids:
+            return FakeFuture(error=RuntimeError("Publishing failed"))
+        return FakeFuture(str(len(self.messages)))
+
+
+@pytest.fixture
+def publisher(monkeypatch):
+    """
+    The publisher every EmailProcessor creates, also after resetting it.
+    """
+    from emailprocessor import EmailProcessor
+
+    publisher = FakePublisherClient()
+    monkeypatch.setattr(EmailProcessor, "_create_publisher", lambda self: publisher)
+    return publisher
+
+
+class CountingString(str):
+    """
+    Text that counts the characters scanned by find and rfind.
+    """
+    scanned = 0
+
+    def find(self, sub, start=0, end=None):
+        end = len(self) if end is None else end
+        index = super().find(sub, start, end)
+        self.scanned += (end if index == -1 else index + len(sub)) - start
+        return index
+
+    def rfind(self, sub, start=0, end=None):
+        end = len(self) if end is None else end
+        index = super().rfind(sub, start, end)
+        self.scanned += end - (start if index == -1 else index)
+        return index
+
+
+def make_mail(ticket: int = 1, mail_type=None, filler: str = "") -> dict:
+    """
+    An e-mail that passes all validation stages of the configuration, with the type in a header and all FIELDS in a
+    table. The filler is added after the table.
+    """
+    import config
+
+    mail_type = mail_type or config.ALLOWED_TYPES[0]
+    rows = "".join(f"<tr><td>{field}:</td><td>{field} {ticket}</td></tr>" for field in config.FIELDS)
+    return {
+        "sender": config.SENDER_WHITELIST[0],
+        "subject": f"[Ticket#{ticket}] Test",
+        "received_on": "2021-01-01T00:00:00+00:00",
+        "body": f"<html><body><p>{config.TYPE_FIELD}: &lt;&lt;{mail_type}&gt;&gt;</p>"
+                f"<table>{rows}</table>{filler}</body></html>",
+    }
+
+
+def mail_id(ticket: int = 1, mail_type=None) -> str:
+    import config
+
+    return f"{mail_type or config.ALLOWED_TYPES[0]}_Ticket#{ticket}_2021-01-01T00-00-00"
@@ -0,0 +1,118 @@
+"""
+Tests of the Deduplicator and its file and Firestore backends.
+"""
+import pytest
+from conftest import FakeFirestoreClient
+
+from emailprocessor.deduplicator import Deduplicator, FileBackend, FirestoreBackend, create_deduplicator
+
+
+@pytest.fixture
+def db_client():
+    return FakeFirestoreClient()
+
+
+def test_duplicate_is_skipped():
+    deduplicator = Deduplicator()
+
+    assert deduplicator.claim("a")
+    # An id that is being processed is not claimed again.
+    assert not deduplicator.claim("a")
+    deduplicator.confirm("a")
+    assert not deduplicator.claim("a")
+    assert deduplicator.claim("b")
+
+    assert deduplicator.info() == {"checks": 4, "duplicates": 2, "duplicate_rate": 0.5, "size": 2}
+
+
+def test_claim_is_released_after_failed_publish(db_client):
+    deduplicator = Deduplicator(backend=FirestoreBackend("processed", db_client))
+
+    assert deduplicator.claim("a")
+    deduplicator.release("a")
+
+    assert db_client.collection("processed").documents == {}
+    assert deduplicator.claim("a")
+
+
+def test_lru_eviction(db_client):
+    deduplicator = Deduplicator(max_size=2)
+    for mail_id in ["a", "b", "c"]:
+        assert deduplicator.claim(mail_id)
+        deduplicator.confirm(mail_id)
+
+    assert deduplicator.info()["size"] == 2
+    # The least recently used id is evicted, and processed again.
+    assert deduplicator.claim("a")
+    assert not deduplicator.claim("c")
+
+    # With a backend, evicted ids are still known.
+    deduplicator = Deduplicator(max_size=2, backend=FirestoreBackend("processed", db_client))
+    for mail_id in ["a", "b", "c"]:
+        assert deduplicator.claim(mail_id)
+        deduplicator.confirm(mail_id)
+
+    assert not deduplicator.claim("a")
+
+
+def test_file_backend(tmp_path):
+    path = str(tmp_path / "processed.txt")
+    deduplicator = Deduplicator(backend=FileBackend(path))
+
+    assert deduplicator.claim("a")
+    deduplicator.confirm("a")
+    deduplicator.confirm("a")
+    assert deduplicator.claim("b")
+    deduplicator.release("b")
+
+    with open(path) as ids_file:
+        assert ids_file.read() == "a\n"
+
+    # Ids are remembered across instances.
+    deduplicator = Deduplicator(backend=FileBackend(path))
+    assert not deduplicator.claim("a")
+    assert deduplicator.claim("b")
+
+
+def test_firestore_backend(db_client):
+    deduplicator = Deduplicator(backend=FirestoreBackend("processed", db_client))
+
+    assert deduplicator.claim("SOME_TYPE_Ticket#1/2_2020-01-01")
+    deduplicator.confirm("SOME_TYPE_Ticket#1/2_2020-01-01")
+
+    documents = db_client.collection("processed").documents
+    assert list(documents) == ["SOME_TYPE_Ticket#1_2_2020-01-01"]
+    assert documents["SOME_TYPE_Ticket#1_2_2020-01-01"]["id"] == "SOME_TYPE_Ticket#1/2_2020-01-01"
+
+    deduplicator = Deduplicator(backend=FirestoreBackend("processed", db_client))
+    assert not deduplicator.claim("SOME_TYPE_Ticket#1/2_2020-01-01")
+
+
+def test_unavailable_firestore_client_falls_back_to_memory(monkeypatch):
+    firestore = pytest.importorskip("google.cloud.firestore")
+    created = []
+
+    def failing_client(*args, **kwargs):
+        created.append(True)
+        raise RuntimeError("no credentials")
+
+    monkeypatch.setattr(firestore, "Client", failing_client)
+    deduplicator = create_deduplicator({"max_size": 10, "backend": "firestore", "location": "processed"})
+
+    for mail_id in ["a", "b", "c"]:
+        assert deduplicator.claim(mail_id)
+        deduplicator.confirm(mail_id)
+
+    # The client is only tried once, after which only the ids in memory are checked.
+    assert created == [True]
+    assert deduplicator.backend is None
+    assert not deduplicator.claim("a")
+
+
+def test_create_deduplicator(tmp_path):
+    assert create_deduplicator(None) is None
+    assert create_deduplicator({}).backend is None
+
+    deduplicator = create_deduplicator({"max_size": 5, "backend": "file", "location": str(tmp_path / "ids")})
+    assert isinstance(deduplicator.backend, FileBackend)
+    assert deduplicator.ids.maxsize == 5
@@ -0,0 +1,119 @@
+"""
+Tests of processing and publishing e-mails with the EmailProcessor, with a fake Pub/Sub publisher.
+"""
+import config
+import pytest
+from conftest import mail_id, make_mail
+
+from emailprocessor import EmailProcessor
+from emailprocessor.deduplicator import Deduplicator
+from emailprocessor.validation import ValidationStage
+
+
+def published_ids(publisher):
+    return [message["parsed_email"]["id"] for message in publisher.messages]
+
+
+def test_process_publishes_the_configured_fields(publisher):
+    processor = EmailProcessor(batch_publishing=False)
+
+    assert processor.process({"email": make_mail(1)}) == mail_id(1)
+    assert processor.flush() == {}
+
+    parsed_email = publisher.messages[0]["parsed_email"]
+    assert parsed_email == dict({field: f"{field} 1" for field in config.FIELDS}, id=mail_id(1))
+
+
+def test_publish_batches_are_flushed_separately(publisher):
+    processor = EmailProcessor(batch_publishing=True)
+    publisher.fail_ids = {mail_id(2)}
+    first_batch = processor.publish_batch()
+    second_batch = processor.publish_batch()
+
+    processor.process({"email": make_mail(1)}, publish_batch=first_batch)
+    processor.process({"email": make_mail(2)}, publish_batch=second_batch)
+    processor.process({"email": make_mail(3)}, publish_batch=first_batch)
+
+    assert processor.flush(second_batch) == {mail_id(2): False}
+    assert processor.flush(first_batch) == {mail_id(1): True, mail_id(3): True}
+    assert processor.flush(first_batch) == {}
+
+
+def test_publishes_are_waited_for_at_max_in_flight(publisher):
+    processor = EmailProcessor(batch_publishing=True)
+    publish_batch = processor.publish_batch()
+    publish_batch.max_in_flight = 2
+
+    for ticket in range(1, 4):
+        processor.process({"email": make_mail(ticket)}, publish_batch=publish_batch)
+
+    assert [queued_id for queued_id, _ in publish_batch.pending_publishes] == [mail_id(3)]
+    assert publish_batch.results == {mail_id(1): True, mail_id(2): True}
+
+
+def test_failed_flush_resets_the_publisher(publisher):
+    processor = EmailProcessor(batch_publishing=True)
+    processor.deduplicator = Deduplicator()
+    publisher.fail_ids = {mail_id(1)}
+    publish_batch = processor.publish_batch()
+
+    processor.process({"email": make_mail(1)}, publish_batch=publish_batch)
+    processor.process({"email": make_mail(2)}, publish_batch=publish_batch)
+    assert processor._publisher is publisher
+
+    assert processor.flush(publish_batch) == {mail_id(1): False, mail_id(2): True}
+    assert processor._publisher is None
+
+    # The id of the e-mail that failed to publish is released, the published one is confirmed
+    publisher.fail_ids = set()
+    processor.process({"email": make_mail(1)}, publish_batch=publish_batch)
+    processor.process({"email": make_mail(2)}, publish_batch=publish_batch)
+    assert processor.flush(publish_batch) == {mail_id(1): True}
+    assert published_ids(publisher) == [mail_id(1), mail_id(2), mail_id(1)]
+
+
+def test_failed_publish_without_batch_resets_the_publisher(publisher):
+    processor = EmailProcessor(batch_publishing=False)
+    processor.deduplicator = Deduplicator()
+    publisher.fail_ids = {mail_id(1)}
+
+    assert processor.process({"email": make_mail(1)}) is None
+    assert processor._publisher is None
+
+    publisher.fail_ids = set()
+    assert processor.process({"email": make_mail(1)}) == mail_id(1)
+
+
+def test_duplicate_is_not_published_again(publisher):
+    processor = EmailProcessor(batch_publishing=False)
+    processor.deduplicator = Deduplicator()
+
+    assert processor.process({"email": make_mail(1)}) == mail_id(1)
+    assert processor.process({"email": make_mail(1)}) == mail_id(1)
+    assert published_ids(publisher) == [mail_id(1)]
+    assert processor.deduplicator.info()["duplicates"] == 1
+
+
+class EvenTicketValidation(ValidationStage):
+    name = "even_ticket"
+
+    def validate(self, mail):
+        return int(mail["subject"][len("[Ticket#"):].split("]")[0]) % 2 == 0
+
+
+def test_custom_validation_stage(publisher):
+    processor = EmailProcessor(batch_publishing=False)
+    processor.validation_stages.append(EvenTicketValidation())
+
+    processor.process({"email": make_mail(1)})
+    processor.process({"email": make_mail(2)})
+    assert published_ids(publisher) == [mail_id(2)]
+    assert processor.rejections["even_ticket"] == 1
+
+
+def test_validation_stage_without_validate_can_not_be_created():
+    class IncompleteValidation(ValidationStage):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        IncompleteValidation()
@@ -0,0 +1,50 @@
+"""
+Tests of the FieldPlan, checking that skipping unused fields does not change the extracted fields.
+"""
+import pytest
+
+from emailprocessor import EmailProcessor
+from emailprocessor.fieldplan import FieldPlan
+
+HTML = (
+    "<p>Some Field: &lt;&lt;header&gt;&gt;</p><p>unused: &lt;&lt;x&gt;&gt;</p><p>type: &lt;&lt;A&gt;&gt;</p>"
+    "<table><tr><td>some field:</td><td>row</td></tr><tr><td>Some_Field</td><td>second row</td></tr>"
+    "<tr><td>some field 2</td><td>suffixed</td></tr><tr><td>unused</td><td>y</td></tr>"
+    "<tr><td>Other&nbsp;Field</td><td> other </td></tr></table>"
+)
+
+
+@pytest.mark.parametrize("fields", [
+    ["some_field"],
+    ["some_field_1", "some_field_2"],
+    ["some_field_2"],
+    ["other_field", "missing"],
+    ["some_field_2_1"],
+])
+def test_plan_gives_the_fields_of_a_full_extraction(fields):
+    processor = EmailProcessor(batch_publishing=False)
+    plan = FieldPlan(fields, "type")
+
+    variables = processor._parse_structured_mail(HTML, field_plan=plan)
+    all_variables = processor._parse_structured_mail(HTML)
+
+    assert plan.project(variables) == plan.project(all_variables)
+    assert "unused" not in variables
+
+
+def test_wanted_fields():
+    plan = FieldPlan(["eggs_1", "spam"], "type")
+
+    assert plan.wanted_fields == {"eggs_1", "spam", "type"}
+    assert plan.bases == {"eggs"}
+    for field in ["Eggs 1", "eggs", "EGGS_2", "spam", "type"]:
+        assert plan.wants(field), field
+    for field in ["eggs_0", "eggsx", "spam_1", "ham"]:
+        assert not plan.wants(field), field
+
+
+def test_project():
+    plan = FieldPlan(["b", "a", "c"], "type")
+
+    projected = plan.project({"a": "1", "b": "2", "d": "3", "type": "A"})
+    assert list(projected.items()) == [("b", "2"), ("a", "1"), ("c", "")]
@@ -0,0 +1,122 @@
+"""
+Tests of the header tokenizer against the regular expression it replaced, and of its work on pathological inputs.
+"""
+import random
+import re
+
+import pytest
+from conftest import CountingString
+
+from emailprocessor import headertokenizer
+from emailprocessor.headertokenizer import HeaderScanner, _scan_headers, tokenize_headers
+
+REFERENCE_REGEX = re.compile(r"([^\n:]+):\s*<<?([^>]*)>>?")
+
+CASES = [
+    "field: <<value>>",
+    "field:<value>",
+    "a: <<1>>b: <<2>>",
+    "a>b: <<1>>>c: <<2>>",
+    "multi line: <<Line 1\nLine 2>>\nnext: <<x>>",
+    "field:\n\n<<value on the next line>>",
+    "no value: here\nfield: <<value>>",
+    "field: <<unclosed",
+    ": <<no field>>",
+    "x" * 1000 + ":" + " " * 100 + "\nfield: <<value>>",
+    "a>" * 500 + ":" + "\n" * 100 + "field: <<value>>",
+    "",
+]
+
+ALPHABET = list("ab: <>\n\t") + ["<<", ">>", ": <<", ">>\n", ">" * 20, " " * 70]
+
+# Long lines with colons that are not followed by a value, on which the reference regular expression takes quadratic
+# time, and ordinary headers.
+PATHOLOGICAL_INPUTS = {
+    "long_line": lambda size: "x" * (size - 1) + ":",
+    "colons_without_values": lambda size: "some words before a colon: " * (size // 27) + "\nfield: <<value>>",
+    "greater_than_signs": lambda size: ("a>" * 500 + ":" + "\n" * 100) * (size // 1101) + "\nfield: <<value>>",
+    "headers": lambda size: "field name: <<some value>>\nanother field: <<multi\nline value>>\n" * (size // 64),
+    "headers_on_one_line": lambda size: "field name: <<some value>> " * (size // 27),
+}
+
+# Characters scanned by _scan_headers per character of the text: the regular expression search from the previous
+# header up to the next value, and the searches back to the start of the field and forward to the end of the value.
+MAX_SCANS_PER_CHARACTER = 3
+
+
+class CountingRegex(object):
+    """
+    Regular expression that counts the characters scanned by search in a CountingString.
+    """
+
+    def __init__(self, regex):
+        self.regex = regex
+
+    def search(self, string, position=0):
+        match = self.regex.search(string, position)
+        string.scanned += (len(string) if match is None else match.end()) - position
+        return match
+
+
+def random_strings(count, seed=1):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rnd.choice(ALPHABET) for _ in range(rnd.randint(0, 30)))
+
+
+@pytest.mark.parametrize("string", CASES)
+def test_cases(string):
+    assert list(tokenize_headers(string)) == REFERENCE_REGEX.findall(string)
+    assert list(_scan_headers(string)) == REFERENCE_REGEX.findall(string)
+
+
+def test_random_strings():
+    for string in random_strings(20000):
+        assert list(tokenize_headers(string)) == REFERENCE_REGEX.findall(string), string
+        assert list(_scan_headers(string)) == REFERENCE_REGEX.findall(string), string
+
+
+def test_header_scanner_in_parts():
+    rnd = random.Random(2)
+    for string in random_strings(20000, seed=3):
+        scanner = HeaderScanner()
+        fields = []
+        position = 0
+        while position < len(string):
+            length = rnd.randint(1, 6)
+            fields += scanner.feed(string[position:position + length])
+            position += length
+        assert fields == [field for field, _ in tokenize_headers(string)], string
+
+
+@pytest.mark.parametrize("name", sorted(PATHOLOGICAL_INPUTS))
+def test_pathological_inputs(name):
+    # Small enough for the reference regular expression, which is quadratic on most of these inputs.
+    string = PATHOLOGICAL_INPUTS[name](8192)
+
+    assert list(tokenize_headers(string)) == REFERENCE_REGEX.findall(string)
+    assert list(_scan_headers(string)) == REFERENCE_REGEX.findall(string)
+
+
+@pytest.mark.parametrize("name", sorted(PATHOLOGICAL_INPUTS))
+@pytest.mark.parametrize("size", [4096, 262144])
+def test_scan_is_linear(monkeypatch, name, size):
+    monkeypatch.setattr(headertokenizer, "VALUE_START_REGEX", CountingRegex(headertokenizer.VALUE_START_REGEX))
+    string = CountingString(PATHOLOGICAL_INPUTS[name](size))
+
+    list(_scan_headers(string))
+    assert 0 < string.scanned <= MAX_SCANS_PER_CHARACTER * len(string)
+
+
+def test_regular_expression_only_on_bounded_lines(monkeypatch):
+    # From every ">", HEADER_REGEX scans the rest of the line, long lines full of ">" are left to _scan_headers.
+    searched = []
+    monkeypatch.setattr(headertokenizer, "_scan_headers", lambda string: searched.append(string) or iter([]))
+
+    for name in ("long_line", "colons_without_values", "headers"):
+        list(tokenize_headers(PATHOLOGICAL_INPUTS[name](262144)))
+    assert not searched
+
+    for name in ("greater_than_signs", "headers_on_one_line"):
+        list(tokenize_headers(PATHOLOGICAL_INPUTS[name](262144)))
+    assert len(searched) == 2
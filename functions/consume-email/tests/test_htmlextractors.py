@@ -0,0 +1,82 @@
+"""
+Differential tests of the StreamingExtractor against the BeautifulSoupExtractor it emulates.
+"""
+import random
+
+import pytest
+
+from emailprocessor.htmlextractors import BeautifulSoupExtractor, StreamingExtractor
+
+pytest.importorskip("bs4")
+
+EDGE_CASES = [
+    # Nested tables, only the cells of the first table are collected.
+    "a<table><tr><td>x</td><td>y<table><td>n</td></table></td></tr></table><table><td>z</td></table>",
+    # Cells outside a table, and unclosed cells.
+    "<td>out</td><table><td>a<td>b</td>c</table> tail",
+    # Whitespace-only strings, preserved in pre.
+    "<pre>  \n </pre>   \n  <p> </p>&nbsp;<br>x</br>y<br/>z",
+    # End tags of empty elements.
+    "<br><br/>a</br>b<table><td>x</td></br>",
+    "<br><br><br></br></br>a</br><img></img><img/>b",
+    # Strings in script, style and template are not rendered.
+    "<script>var a='<td>';</script><style>td{}</style><template><p>t</p><table><td>q</td></table></template>"
+    "<table><td>r</td></table>",
+    # Declarations, comments, processing instructions and character references.
+    "<!DOCTYPE html><!-- c --><![CDATA[cd]]><?pi x?>&amp;&foo;&#150;&#x41;&#0;&#99999999; &nbsp &copy",
+    "<![if !supportLists]>x<![endif]>",
+    # Tags are never closed implicitly.
+    "<table><tr><td>k:</td><td>v</td></tr></table x><td>after</td>",
+    "<p>unclosed <b>bold <table><td>x</p></td>y</table>",
+    "<TABLE><TD>Upper</TD></TABLE>",
+    "type: &lt;&lt;A&gt;&gt;<table><tbody><tr><td>a</td><td>b</td></tr>",
+    "<table><td><pre> </pre></td><td>  </td></table>",
+    "",
+]
+
+TAGS = [
+    "table", "td", "tr", "th", "p", "br", "pre", "script", "style", "template", "b", "span", "textarea", "img", "div"
+]
+REFERENCES = ["&nbsp;", "&amp;", "&lt;&lt;", "&#150;", "&bogus;", "<!--c-->", "<![CDATA[x]]>", "&nbsp"]
+TEXTS = ["  ", "\n", " \n\t", "abc", "key:", " v ", "\xa0", "x y"]
+
+
+def random_documents(count, seed=1):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        parts = []
+        for _ in range(rnd.randint(1, 40)):
+            r = rnd.random()
+            tag = rnd.choice(TAGS)
+            if r < 0.3:
+                parts.append(f"<{tag}>")
+            elif r < 0.5:
+                parts.append(f"</{tag}>")
+            elif r < 0.55:
+                parts.append(f"<{tag}/>")
+            elif r < 0.6:
+                parts.append(rnd.choice(REFERENCES))
+            else:
+                parts.append(rnd.choice(TEXTS))
+        yield "".join(parts)
+
+
+@pytest.mark.parametrize("html", EDGE_CASES)
+def test_edge_cases(html):
+    assert StreamingExtractor.extract(html) == BeautifulSoupExtractor.extract(html)
+
+
+def test_random_documents():
+    mismatches = [
+        html for html in random_documents(3000)
+        if StreamingExtractor.extract(html) != BeautifulSoupExtractor.extract(html)
+    ]
+    assert mismatches == []
+
+
+@pytest.mark.parametrize("size", [1024, 102400])
+def test_corpus_emails(size):
+    from benchmarks.corpus import generate_email
+
+    html = generate_email(size, seed=size)
+    assert StreamingExtractor.extract(html) == BeautifulSoupExtractor.extract(html)
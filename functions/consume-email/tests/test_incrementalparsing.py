@@ -0,0 +1,81 @@
+"""
+Tests of parsing HTML content in chunks until all fields are found, and of capping the size of HTML content.
+"""
+import pytest
+from conftest import mail_id, make_mail
+
+import emailprocessor.emailprocessor
+from emailprocessor import EmailProcessor
+from emailprocessor.htmlextractors import IncrementalExtractor, StreamingExtractor, TablesExtractor
+
+# Quoted history after the structured block of an e-mail.
+HISTORY = "<blockquote><p>history: &lt;&lt;quoted&gt;&gt;</p><table><tr><td>a</td><td>b</td></tr></table></blockquote>"
+
+
+def processor_with(monkeypatch, **settings):
+    for name, value in settings.items():
+        monkeypatch.setattr(emailprocessor.emailprocessor, name, value)
+    return EmailProcessor(batch_publishing=False)
+
+
+@pytest.mark.parametrize("extractor", [StreamingExtractor, TablesExtractor])
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 100000])
+def test_chunks_give_the_fields_of_the_whole_content(extractor, chunk_size):
+    processor = EmailProcessor(batch_publishing=False)
+    mail = make_mail(1, filler=HISTORY * 10)
+    expected = processor.parse_mail(mail)
+
+    processor.html_extractor = IncrementalExtractor(extractor, chunk_size)
+
+    assert processor.parse_mail(mail) == expected
+    assert expected["id"] == mail_id(1)
+
+
+@pytest.mark.parametrize("extractor", [StreamingExtractor, TablesExtractor])
+def test_parsing_stops_once_all_fields_are_found(extractor):
+    processor = EmailProcessor(batch_publishing=False)
+    html = make_mail(1, filler=HISTORY * 1000)["body"]
+
+    text, _ = IncrementalExtractor(extractor, 256).extract(html, processor.field_plan.wanted_fields)
+    assert text.count("history") < 10
+
+    # Without wanted fields, the whole content is parsed
+    text, _ = IncrementalExtractor(extractor, 256).extract(html)
+    assert text.count("history") == 1000
+
+
+def test_extractor_without_parser_can_not_parse_in_chunks():
+    from emailprocessor.htmlextractors import BeautifulSoupExtractor
+
+    with pytest.raises(ValueError):
+        IncrementalExtractor(BeautifulSoupExtractor)
+
+
+def test_oversized_body_is_truncated(monkeypatch):
+    mail = make_mail(1, filler=HISTORY * 100)
+    processor = processor_with(monkeypatch, MAX_BODY_SIZE=len(make_mail(1)["body"]) + 10)
+
+    assert processor.parse_mail(mail) == EmailProcessor(batch_publishing=False).parse_mail(mail)
+    assert processor.rejections == {}
+
+
+def test_truncated_body_ends_after_a_tag():
+    assert EmailProcessor._truncate_body("<p>abc</p><p>def</p>", 12) == "<p>abc</p>"
+    assert EmailProcessor._truncate_body("<p>abc</p><p>def</p>", 14) == "<p>abc</p><p>"
+    # Without a tag within the maximum, the content is cut at the maximum
+    assert EmailProcessor._truncate_body("abcdef<p>", 4) == "abcd"
+
+
+def test_oversized_body_is_rejected(monkeypatch):
+    body_size = len(make_mail(1)["body"])
+    processor = processor_with(monkeypatch, MAX_BODY_SIZE=body_size, BODY_SIZE_EXCEEDED="reject")
+
+    assert processor.parse_mail(make_mail(1))["id"] == mail_id(1)
+    assert processor.parse_mail(make_mail(1, filler="<br>")) is None
+    assert processor.rejections == {"body_size": 1}
+    assert processor.validation_stages[0].name == "body_size"
+
+
+def test_unknown_body_size_behaviour(monkeypatch):
+    with pytest.raises(ValueError):
+        processor_with(monkeypatch, MAX_BODY_SIZE=10, BODY_SIZE_EXCEEDED="ignore")
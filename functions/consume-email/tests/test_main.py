@@ -0,0 +1,77 @@
+"""
+Tests of the entry points of the function, with a fake Pub/Sub publisher.
+"""
+import base64
+import json
+
+import pytest
+from conftest import mail_id, make_mail
+
+import main
+
+
+class FakeRequest(object):
+    def __init__(self, body):
+        self.data = json.dumps(body).encode("utf-8")
+
+
+def envelope(message_id, data):
+    return {"message": {"data": base64.b64encode(data).decode("ascii"), "messageId": message_id}}
+
+
+def payload(ticket, **mail_fields):
+    return json.dumps({"email": dict(make_mail(ticket), **mail_fields)}).encode("utf-8")
+
+
+@pytest.fixture(autouse=True)
+def deduplicators(monkeypatch):
+    # The processors of the module are shared by all tests, none of them deduplicates
+    monkeypatch.setattr(main.parser, "deduplicator", None)
+    monkeypatch.setattr(main.batch_parser, "deduplicator", None)
+
+
+def test_email_parser(publisher):
+    request = FakeRequest(dict(envelope("1", payload(1)), subscription="projects/p/subscriptions/s"))
+
+    assert main.email_parser(request) == ("OK", 204)
+    assert [message["parsed_email"]["id"] for message in publisher.messages] == [mail_id(1)]
+
+
+def test_email_parser_batch(publisher):
+    publisher.fail_ids = {mail_id(3)}
+    request = FakeRequest([
+        envelope("published", payload(1)),
+        envelope("rejected", payload(2, sender="unknown@example.com")),
+        envelope("failed", payload(3)),
+        envelope("undecodable", b"{"),
+        {"message": {"data": "not base64!", "messageId": "no data"}},
+    ])
+
+    body, status, headers = main.email_parser_batch(request)
+
+    assert status == 200
+    assert json.loads(body)["results"] == [
+        {"id": "published", "status": "ack"},
+        {"id": "rejected", "status": "ack"},
+        {"id": "failed", "status": "nack"},
+        {"id": "undecodable", "status": "nack"},
+        {"id": "no data", "status": "nack"},
+    ]
+
+
+def test_batch_requests_do_not_share_a_batch(publisher):
+    publisher.fail_ids = {mail_id(1)}
+    other_acks = []
+
+    def process_other_request(message):
+        # After the first request queued its failing e-mail, another request is processed to its end
+        if message["parsed_email"]["id"] == mail_id(2) and not other_acks:
+            other_acks.append(main.process_payloads([("other 3", payload(3)), ("other 4", payload(4))]))
+
+    publisher.on_publish = process_other_request
+
+    acks = main.process_payloads([("1", payload(1)), ("2", payload(2))])
+
+    # The other request did not take the result of the e-mail the first request had queued
+    assert other_acks == [{"other 3": True, "other 4": True}]
+    assert acks == {"1": False, "2": True}
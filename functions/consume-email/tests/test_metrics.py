@@ -0,0 +1,78 @@
+"""
+Tests of the per-message metrics.
+"""
+import json
+import logging
+
+from conftest import mail_id, make_mail
+
+from emailprocessor import EmailProcessor
+from emailprocessor.metrics import NULL_MESSAGE_METRICS, Histogram, Metrics
+
+
+def metrics_lines(caplog):
+    messages = (record.getMessage() for record in caplog.records)
+    return [json.loads(message) for message in messages if message.startswith('{"metrics"')]
+
+
+def test_finish_is_idempotent(caplog):
+    metrics = Metrics("test", enabled=True)
+    message_metrics = metrics.message()
+    with message_metrics.stage("parse"):
+        pass
+    message_metrics.size("body_characters", 10)
+
+    with caplog.at_level(logging.INFO):
+        message_metrics.finish("failed", "id")
+        message_metrics.finish("published", "id")
+
+    assert [line["status"] for line in metrics_lines(caplog)] == ["failed"]
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"] == {"messages_failed": 1, "body_characters": 10}
+    assert snapshot["histograms"]["total_ms"]["count"] == 1
+    assert snapshot["histograms"]["parse_ms"]["count"] == 1
+
+
+def test_stages_entered_more_than_once_are_summed():
+    message_metrics = Metrics("test", enabled=True).message()
+    for _ in range(3):
+        with message_metrics.stage("decode"):
+            pass
+
+    assert list(message_metrics.stages) == ["decode"]
+
+
+def test_disabled_metrics_do_nothing():
+    metrics = Metrics("test")
+
+    assert metrics.message() is NULL_MESSAGE_METRICS
+    with metrics.message().stage("parse"):
+        pass
+    metrics.message().finish("published")
+    assert metrics.snapshot() == {"counters": {}, "histograms": {}}
+
+
+def test_histogram_buckets():
+    histogram = Histogram(buckets=(1, 10))
+    for value in [0.5, 1, 5, 100]:
+        histogram.observe(value)
+
+    assert histogram.to_dict() == {"count": 4, "sum": 106.5, "max": 100, "buckets": {"1": 2, "10": 1, "+Inf": 1}}
+
+
+def test_processed_e_mails_are_finished_once(publisher, caplog):
+    processor = EmailProcessor(batch_publishing=False)
+    processor.metrics = Metrics("consume-email", enabled=True)
+    publisher.fail_ids = {mail_id(2)}
+
+    with caplog.at_level(logging.INFO):
+        processor.process({"email": make_mail(1)})
+        processor.process({"email": make_mail(2)})
+        processor.process({"email": make_mail(3, mail_type="NOT_ALLOWED")})
+
+    assert [(line["status"], line["mail_id"]) for line in metrics_lines(caplog)] == [
+        ("published", mail_id(1)), ("failed", mail_id(2)), ("rejected", None)
+    ]
+    assert set(metrics_lines(caplog)[0]["stages_ms"]) >= {"sender", "ticket", "extract", "headers", "table", "publish"}
+    counters = processor.metrics.snapshot()["counters"]
+    assert sum(count for name, count in counters.items() if name.startswith("rejected_by_")) == 1
@@ -0,0 +1,32 @@
+"""
+Tests of parsing e-mails in a pool of worker processes.
+"""
+import multiprocessing
+
+import pytest
+from conftest import make_mail
+
+from emailprocessor import EmailProcessor
+from emailprocessor.parallel import ParallelParser
+
+# Worker processes only have the configuration of the tests when they are forked.
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="Workers are not forked")
+
+
+def test_results_are_in_order_and_equal_to_serial_parsing():
+    mails = [make_mail(ticket, mail_type="NOT_ALLOWED" if ticket % 3 == 0 else None) for ticket in range(1, 40)]
+    # A malformed e-mail does not fail the other e-mails of its chunk
+    mails[5] = {"subject": "no body"}
+
+    processor = EmailProcessor(batch_publishing=False)
+    expected = [None if mail is mails[5] else processor.parse_mail(mail) for mail in mails]
+
+    results = list(ParallelParser(workers=2, chunk_size=4, max_pending_chunks=2).parse(iter(mails)))
+
+    assert [mail for mail, _ in results] == mails
+    assert [mail_variables for _, mail_variables in results] == expected
+    assert sum(1 for mail_variables in expected if mail_variables) == 26
+
+
+def test_without_e_mails():
+    assert list(ParallelParser(workers=2).parse([])) == []
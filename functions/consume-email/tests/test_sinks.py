@@ -0,0 +1,42 @@
+"""
+Tests of the sinks the replay and backlog scripts write parsed e-mails to.
+"""
+import gzip
+import io
+import json
+
+from emailprocessor.sinks import FileSink, PubSubSink, StdoutSink
+
+
+def test_stdout_sink():
+    output = io.StringIO()
+    sink = StdoutSink(output)
+    sink.write({"id": "a"})
+    sink.write({"id": "b"})
+
+    assert sink.close() == 0
+    assert output.getvalue() == '{"id": "a"}\n{"id": "b"}\n'
+
+
+def test_gzipped_file_sink(tmp_path):
+    path = str(tmp_path / "parsed.jsonl.gz")
+    sink = FileSink(path)
+    sink.write({"id": "a"})
+
+    assert sink.close() == 0
+    with gzip.open(path, "rt") as parsed_file:
+        assert [json.loads(line) for line in parsed_file] == [{"id": "a"}]
+
+
+def test_pubsub_sink_keeps_only_the_failed_count(publisher):
+    publisher.fail_ids = {"id-3", "id-6"}
+    sink = PubSubSink(flush_every=2)
+
+    for i in range(7):
+        sink.write({"id": f"id-{i}"})
+        # The results are dropped at every flush, the batch never holds more than flush_every e-mails.
+        assert len(sink.publish_batch.pending_publishes) + len(sink.publish_batch.results) < 2
+
+    assert sink.failed_count == 1
+    assert sink.close() == 2
+    assert [message["parsed_email"]["id"] for message in publisher.messages] == [f"id-{i}" for i in range(7)]
@@ -0,0 +1,49 @@
+"""
+Tests of the TablesExtractor, reading the field-value rows of all (nested) tables.
+"""
+import pytest
+
+from emailprocessor.htmlextractors import StreamingExtractor, TablesExtractor
+
+# An Outlook-like layout table, with the field-value rows in nested tables.
+LAYOUT_HTML = (
+    "<p>type: &lt;&lt;A&gt;&gt;</p>"
+    "<table><tr><td><img src='logo.png'></td></tr>"
+    "<tr><td><table><tr><th>Name:</th><td>Jane <b>Doe</b></td></tr><tr><td>Team</td><td>a</td></tr></table></td>"
+    "<td><table><tr><td>Ticket</td><td>1</td></tr><tr><td>only one cell</td></tr></table></td></tr></table>"
+    "<table><tr><td>Status</td><td>open</td><td>3 cells</td></tr><tr><td>Priority</td><td>high</td></tr></table>"
+    "<td>Outside</td><td>a row</td>"
+)
+
+
+def test_rows_of_all_tables():
+    text, table_data = TablesExtractor.extract(LAYOUT_HTML)
+
+    assert table_data == ["Name:", "Jane Doe", "Team", "a", "Ticket", "1", "Priority", "high"]
+    assert text == StreamingExtractor.extract(LAYOUT_HTML)[0]
+
+
+def test_without_tables():
+    assert TablesExtractor.extract("<p>type: &lt;&lt;A&gt;&gt;</p>") == ("type: <<A>>", None)
+    assert TablesExtractor.extract("<table><tr><td>a</td></tr></table>") == ("a", [])
+
+
+@pytest.mark.parametrize("wanted_fields, last_field", [
+    ({"type", "name", "team"}, "Team"),
+    ({"ticket"}, "Ticket"),
+    ({"priority"}, "Priority"),
+    ({"type", "missing"}, "Priority"),
+])
+def test_extraction_stops_once_all_wanted_fields_are_found(wanted_fields, last_field):
+    _, table_data = TablesExtractor.extract(LAYOUT_HTML, wanted_fields)
+
+    assert table_data[-2] == last_field
+
+
+def test_headers_before_the_first_table_are_found():
+    # Parsing only stops after a table row, headers are searched for in the text before the first table
+    html = "<p>type: &lt;&lt;A&gt;&gt;</p><table><tr><td>name</td><td>x</td></tr><tr><td>b</td><td>y</td></tr></table>"
+
+    assert TablesExtractor.extract(html, {"type"})[1] == ["name", "x"]
+    assert TablesExtractor.extract(html, {"type", "name"})[1] == ["name", "x"]
+    assert TablesExtractor.extract(html, {"other"})[1] == ["name", "x", "b", "y"]
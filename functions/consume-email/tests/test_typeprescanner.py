@@ -0,0 +1,77 @@
+"""
+Tests of the TypePrescanner, including markup without text on which its work has to stay bounded.
+"""
+import pytest
+from conftest import CountingString
+
+from emailprocessor.typeprescanner import MAX_FILLER, TypePrescanner
+
+# Layout markup without any text, as in the spacer tables of Outlook e-mails.
+SPACER_ROW = '<tr><td width="10"></td><td style="x"><img src="s.gif"></td></tr>'
+
+
+# Characters scanned by the searches back from every occurrence of the field to the start tag of its cell.
+MAX_SCANS_PER_CHARACTER = 2
+
+
+class CountingRegex(object):
+    """
+    Regular expression that counts the positions at which it is matched.
+    """
+
+    def __init__(self, regex):
+        self.regex = regex
+        self.positions = []
+
+    def match(self, string, position=0):
+        self.positions.append(position)
+        return self.regex.match(string, position)
+
+
+@pytest.fixture
+def prescanner():
+    return TypePrescanner("type_field", ["ALLOWED"])
+
+
+@pytest.mark.parametrize("html, rejected_type", [
+    ("<p>type_field: &lt;&lt;OTHER&gt;&gt;</p>", "OTHER"),
+    ("<p><span>Type Field:</span>&nbsp;<span>&lt;&lt;</span>OTHER&gt;&gt;</p>", "OTHER"),
+    ("<table><tr><td width=\"200\"><p><span>type field:</span></p></td>\n<td><p>OTHER</p></td></tr></table>", "OTHER"),
+    ("<table><tr><td>type_field</td><td>OTHER &amp; MORE</td></tr></table>", "OTHER & MORE"),
+    # Allowed types are never rejected, also when another type is found or the allowed type occurs elsewhere.
+    ("<p>type_field: &lt;&lt;ALLOWED&gt;&gt;</p>", None),
+    ("<p>type_field: &lt;&lt;OTHER&gt;&gt;</p><table><tr><td>type_field</td><td>ALLOWED</td></tr></table>", None),
+    ("<p>type_field: &lt;&lt;OTHER&gt;&gt;</p><p>ALLOWED</p>", None),
+    # Without the type field, the e-mail is left to the full parse.
+    ("<p>other_field: &lt;&lt;OTHER&gt;&gt;</p>", None),
+    ("<p>my_type_field: &lt;&lt;OTHER&gt;&gt;</p>", None),
+    ("<td>a</td><td>type_field</td>", None),
+])
+def test_find_rejected_type(prescanner, html, rejected_type):
+    assert prescanner.find_rejected_type(html) == rejected_type
+
+
+@pytest.mark.parametrize("unit", [
+    SPACER_ROW, "<td>", "<td></td>", "<td>&nbsp;</td>", "<td>type_field</td>" + SPACER_ROW, "type_field: " + SPACER_ROW
+])
+def test_markup_without_text_is_bounded(prescanner, unit):
+    prescanner.header_regex = CountingRegex(prescanner.header_regex)
+    prescanner.table_regex = CountingRegex(prescanner.table_regex)
+    html = CountingString(unit * (1048576 // len(unit)))
+
+    prescanner.find_rejected_type(html)
+
+    # The header and table row are only matched at the occurrences of the field, and the search back to a cell start
+    # tag stops after MAX_FILLER tags.
+    occurrences = [match.end() for match in prescanner.field_regex.finditer(html)]
+    assert prescanner.header_regex.positions == occurrences
+    assert set(prescanner.table_regex.positions) <= set(occurrences)
+    assert html.scanned <= MAX_SCANS_PER_CHARACTER * len(html)
+
+
+@pytest.mark.parametrize("tags, rejected_type", [(MAX_FILLER, "OTHER"), (MAX_FILLER + 1, None)])
+def test_filler_is_bounded(prescanner, tags, rejected_type):
+    filler = "<span>" * tags
+    assert prescanner.find_rejected_type(f"<p>type_field:{filler}&lt;&lt;OTHER&gt;&gt;</p>") == rejected_type
+    assert prescanner.find_rejected_type(f"<td>{filler}type_field</td><td>OTHER</td>") == rejected_type
+    assert prescanner.find_rejected_type(f"<td>type_field</td>{filler}<td>OTHER</td>") == rejected_type
@@ -0,0 +1,83 @@
+"""
+Measures the cold start of the function: the time taken to import its main module, as reported by
+python -X importtime, in fresh interpreters.
+
+Lists the slowest imports, and which of the heavy dependencies are imported before the first message is processed.
+
+Run from the msg-to-html-body directory (a config.py has to be present):
+    python -m benchmarks.import_benchmark --runs 5
+"""
+import argparse
+import statistics
+import subprocess  # nosec
+import sys
+import time
+
+# Dependencies that should only be imported when they are needed.
+HEAVY_MODULES = ("gobits", "google.cloud.firestore", "google.cloud.pubsub_v1", "jinja2")
+
+
+def import_once(module):
+    """
+    Imports the module in a fresh interpreter.
+
+    :return: The wall time in seconds, and the cumulative import time in microseconds per imported module.
+    :rtype: (float, dict)
+    """
+    start = time.perf_counter()
+    process = subprocess.run(  # nosec
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    wall_time = time.perf_counter() - start
+
+    if process.returncode:
+        sys.exit(f"Importing {module} failed:\n{process.stderr}")
+
+    cumulative_times = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        cumulative_times[name.strip()] = (int(cumulative), len(name) - len(name.lstrip()))
+
+    return wall_time, cumulative_times
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-m", "--module", default="main", help="Module to import")
+    argparser.add_argument("-r", "--runs", type=int, default=5)
+    argparser.add_argument("-t", "--top", type=int, default=10, help="Number of slowest imports to list")
+    args = argparser.parse_args()
+
+    runs = [import_once(args.module) for _ in range(args.runs)]
+
+    wall_times = [wall_time for wall_time, _ in runs]
+    import_times = [cumulative_times[args.module][0] for _, cumulative_times in runs]
+    print(f"interpreter start and import of {args.module}: {statistics.median(wall_times) * 1000:.1f} ms (median)")
+    print(f"import of {args.module}: {statistics.median(import_times) / 1000:.1f} ms (median)")
+
+    # The slowest imports of the last run, of modules imported directly by the main module or the top level
+    _, cumulative_times = runs[-1]
+    indent = min(depth for _, depth in cumulative_times.values())
+    slowest = sorted(
+        ((cumulative, name) for name, (cumulative, depth) in cumulative_times.items()
+         if name != args.module and depth <= indent + 2),
+        reverse=True,
+    )
+    print("slowest imports:")
+    for cumulative, name in slowest[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    for module in HEAVY_MODULES:
+        print(f"{module}: {'imported' if module in cumulative_times else 'not imported'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmarks the per-message cost of publishing e-mail messages.
+
+Compares creating a Pub/Sub publisher for every message (the previous behaviour) with the shared publisher of
+MessageProcessor. A local fake publisher is used, so no Google Cloud project is needed. Its client setup cost
+simulates the gRPC channel and auth setup of a real client.
+
+Run from the msg-to-html-body directory (a config.py has to be present):
+    python -m benchmarks.publisher_benchmark --messages 1000 --client-setup-ms 20
+"""
+import argparse
+import logging
+import time
+from concurrent import futures
+from unittest import mock
+
+from messageprocessor import MessageProcessor
+
+
+class FakeGobits(object):
+    def to_json(self):
+        return {}
+
+
+class FakePublisherClient(object):
+    setup_seconds = 0.0
+    instances = 0
+
+    def __init__(self, *args, **kwargs):
+        FakePublisherClient.instances += 1
+        time.sleep(self.setup_seconds)
+
+    @staticmethod
+    def publish(topic_path, data, **attributes):
+        future = futures.Future()
+        future.set_result(str(len(data)))
+        return future
+
+
+def run(processor, messages, per_message_client):
+    message = {"sender": "", "recipient": "", "subject": "subject", "body": "<div></div>", "attachments": []}
+    gobits = FakeGobits()
+
+    start = time.perf_counter()
+    for _ in range(messages):
+        if per_message_client:
+            processor.reset_publisher()
+        processor.publish_to_topic("subject", message, gobits)
+
+    return time.perf_counter() - start
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-m", "--messages", type=int, default=1000)
+    argparser.add_argument("-s", "--client-setup-ms", type=float, default=20.0)
+    args = argparser.parse_args()
+
+    logging.disable(logging.INFO)
+    FakePublisherClient.setup_seconds = args.client_setup_ms / 1000
+
+    with mock.patch("google.cloud.pubsub_v1.PublisherClient", FakePublisherClient):
+        for label, per_message_client in (("client per message", True), ("shared client", False)):
+            FakePublisherClient.instances = 0
+            elapsed = run(MessageProcessor(), args.messages, per_message_client)
+            print(
+                f"{label:>20}: {elapsed / args.messages * 1000:.3f} ms/message, "
+                f"{args.messages / elapsed:.0f} messages/s, {FakePublisherClient.instances} client(s) created"
+            )
+
+
+if __name__ == "__main__":
+    main()
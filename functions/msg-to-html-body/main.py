@@ -1,4 +1,4 @@
-import base64
+import binascii
 import json
 import logging
 
@@ -10,6 +10,9 @@ parser = MessageProcessor()
 
 logging.basicConfig(level=logging.INFO)
 
+# Maximum number of payload bytes shown in debug logging
+DEBUG_PAYLOAD_BYTES = 1024
+
 
 def log(debug_message, normal_message):
     if DEBUG_LOGGING:
@@ -18,20 +21,41 @@ def log(debug_message, normal_message):
         logging.info(normal_message)
 
 
+def decode_message_data(message):
+    # Decodes the base64 data of a Pub/Sub message without an intermediate ASCII copy, and removes it from the message
+    # so the base64 text is freed as soon as it is decoded
+    return binascii.a2b_base64(message.pop("data"))
+
+
+def payload_for_logging(payload):
+    if len(payload) <= DEBUG_PAYLOAD_BYTES:
+        return str(payload)
+    return f"{payload[:DEBUG_PAYLOAD_BYTES]}... ({len(payload)} bytes)"
+
+
 def msg_to_html_body(request):
-    # Extract data from request
-    envelope = json.loads(request.data.decode("utf-8"))
-    payload = base64.b64decode(envelope["message"]["data"])
+    message_metrics = parser.metrics.message()
+
+    # Extract data from request, json.loads decodes the UTF-8 bytes itself
+    with message_metrics.stage("decode"):
+        envelope = json.loads(request.data)
+        payload = decode_message_data(envelope["message"])
+    message_metrics.size("payload_bytes", len(payload))
 
     # Extract subscription from subscription string
     try:
         subscription = envelope["subscription"].split("/")[-1]
         log(
-            f"Message received from {subscription} [{payload}]",
+            f"Message received from {subscription} [{payload_for_logging(payload)}]",
             f"Message received from {subscription}",
         )
 
-        parser.process(json.loads(payload))
+        with message_metrics.stage("decode"):
+            message = json.loads(payload)
+        # Only the parsed payload is needed from here on
+        del envelope, payload
+
+        parser.process(message, message_metrics)
 
     except Exception as e:
         logging.info("Extract of subscription failed")
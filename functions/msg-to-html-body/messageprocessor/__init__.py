@@ -1 +1,2 @@
 from .messageprocessor import MessageProcessor  # noqa: F401
+from .asyncmessageprocessor import AsyncMessageProcessor  # noqa: F401
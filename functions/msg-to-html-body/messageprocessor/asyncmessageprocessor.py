@@ -0,0 +1,130 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+
+import config
+
+from .messageprocessor import MessageProcessor
+
+# Optional: the maximum number of messages processed at the same time by AsyncMessageProcessor.process_many
+ASYNC_CONCURRENCY = getattr(config, "ASYNC_CONCURRENCY", 10)
+
+logging.basicConfig(level=logging.INFO)
+
+
+class AsyncMessageProcessor(MessageProcessor):
+    # Processes messages like MessageProcessor, with asyncio. The Firestore recipient lookup runs while the template
+    # is rendered (in a thread), the Firestore is queried with the asyncio client, and publishes are awaited without
+    # blocking other messages.
+    def __init__(self, concurrency=None):
+        super().__init__()
+        self.concurrency = concurrency or ASYNC_CONCURRENCY
+
+    async def process_many(self, payloads):
+        # Processes the payloads, at most "concurrency" at the same time. Returns the result per payload, in order:
+        # True when processed, False when not, or the exception raised while processing it
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process(payload):
+            async with semaphore:
+                return await self.process_async(payload)
+
+        return await asyncio.gather(*(process(payload) for payload in payloads), return_exceptions=True)
+
+    async def process_async(self, payload, message_metrics=None):
+        self.start()
+        if message_metrics is None:
+            message_metrics = self.metrics.message()
+        processed = await self.process_message_async(payload, message_metrics)
+        message_metrics.finish("published" if processed else "rejected")
+        return processed
+
+    async def process_message_async(self, payload, message_metrics):
+        # Get message
+        message = payload[self.data_selector]
+        # The recipient does not depend on the HTML body, so it is looked up first
+        recipient_mapping_field_message = self.get_recipient_mapping_field(message)
+        if not recipient_mapping_field_message:
+            return False
+
+        # Message to HTML body, while looking up the recipient
+        (html_body, subject), recipient = await asyncio.gather(
+            self.render_async(message, message_metrics),
+            self.get_recipient_async(recipient_mapping_field_message, message_metrics),
+        )
+        if not html_body or not subject:
+            logging.error("Message was not processed")
+            return False
+        # Make topic message
+        topic_message = self.topic_msg(recipient, html_body, subject)
+        if not topic_message:
+            logging.error("Topic message was not made")
+            return False
+        # Make gobits
+        from gobits import Gobits
+
+        gobits = Gobits()
+        # Send message to topic
+        with message_metrics.stage("publish"):
+            return_bool = await self.publish_to_topic_async(subject, topic_message, gobits)
+        if return_bool is False:
+            logging.error("Message was not processed")
+            message_metrics.finish("failed")
+            return False
+        else:
+            logging.info("Message was processed")
+        return True
+
+    async def render_async(self, message, message_metrics):
+        # Rendering is CPU-bound, it runs in a thread so the event loop can handle Firestore and Pub/Sub meanwhile
+        with message_metrics.stage("render"):
+            return await asyncio.get_running_loop().run_in_executor(None, self.message_to_html, message)
+
+    async def get_recipient_async(self, recipient_mapping_field, message_metrics):
+        with message_metrics.stage("recipient"):
+            recipient_query = self.get_recipient_query(recipient_mapping_field)
+            if not recipient_query:
+                return None
+            succeeded, fs_value = await self.gcp_firestore.get_value_async(*recipient_query)
+            return self.recipient_from_value(succeeded, fs_value)
+
+    async def publish_to_topic_async(self, subject, message, gobits):
+        msg = {"gobits": [gobits.to_json()], "email": message}
+        try:
+            # Publish to topic, and wait for the result without blocking the event loop
+            future = self.publisher.publish(
+                self.topic_path, bytes(json.dumps(msg).encode("utf-8"))
+            )
+            await self.wrap_future(future)
+            logging.debug("Published to export email with subject {}".format(subject))
+            return True
+        except Exception as e:
+            logging.exception(
+                "Unable to publish parsed email " + "to topic because of {}".format(e)
+            )
+            # Client could be broken, e.g. when its channel was closed on a reused instance
+            self.reset_publisher()
+        return False
+
+    @staticmethod
+    def wrap_future(future):
+        # Called from a coroutine, the future is bound to its running loop. Pub/Sub futures of older client versions
+        # are not concurrent.futures.Future instances, which asyncio.wrap_future requires
+        loop = asyncio.get_running_loop()
+        if isinstance(future, concurrent.futures.Future):
+            return asyncio.wrap_future(future, loop=loop)
+
+        async_future = loop.create_future()
+
+        def set_result(done_future):
+            if async_future.cancelled():
+                return
+            exception = done_future.exception()
+            if exception is not None:
+                async_future.set_exception(exception)
+            else:
+                async_future.set_result(done_future.result())
+
+        future.add_done_callback(lambda done_future: loop.call_soon_threadsafe(set_result, done_future))
+        return async_future
@@ -1,30 +1,220 @@
-from google.cloud import firestore
+from cachetools import TTLCache
+import asyncio
+import functools
 import logging
+import threading
 
 logging.basicConfig(level=logging.INFO)
 
 
 class FirestoreProcessor(object):
-    def __init__(self):
-        self.db_client = firestore.Client()
+    def __init__(self, cache_settings=None, db_client=None):
+        self._db_client = db_client
+        self._async_db_client = None
+        self._db_client_lock = threading.Lock()
+
+        # Without cache settings every lookup queries the Firestore. With them, found values are cached for "ttl"
+        # seconds, values that could not be found for "negative_ttl" seconds. When a cache is full, the least recently
+        # used value is evicted.
+        self.cache = None
+        self.negative_cache = None
+        if cache_settings is not None:
+            max_size = cache_settings.get("max_size", 1024)
+            ttl = cache_settings.get("ttl", 60)
+            negative_ttl = cache_settings.get("negative_ttl", 10)
+            self.cache = TTLCache(maxsize=max_size, ttl=ttl) if max_size and ttl else None
+            self.negative_cache = TTLCache(maxsize=max_size, ttl=negative_ttl) if max_size and negative_ttl else None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache_lock = threading.Lock()
+        # Queries of get_value_async in progress by cache key, concurrent lookups of the same key wait for the same one
+        self._pending_queries = {}
+
+        # In-memory indexes of listened collections, per collection and per tuple of id fields
+        self.index_fields = {}
+        self.indexes = {}
+        self.watches = {}
+
+    @property
+    def db_client(self):
+        # Created on first use, the Firestore library is only imported then to keep it out of the cold start
+        if self._db_client is None:
+            with self._db_client_lock:
+                if self._db_client is None:
+                    from google.cloud import firestore
+
+                    self._db_client = firestore.Client()
+        return self._db_client
+
+    @db_client.setter
+    def db_client(self, db_client):
+        self._db_client = db_client
+
+    @property
+    def async_db_client(self):
+        # The asyncio client, used by get_value_async
+        if self._async_db_client is None:
+            with self._db_client_lock:
+                if self._async_db_client is None:
+                    from google.cloud import firestore
+
+                    self._async_db_client = firestore.AsyncClient()
+        return self._async_db_client
+
+    @async_db_client.setter
+    def async_db_client(self, async_db_client):
+        self._async_db_client = async_db_client
+
+    def listen(self, recipient_mapping):
+        # Keeps the collections of the recipient mapping in memory, updated by snapshot listeners
+        for recipient_dict in recipient_mapping.values():
+            collection_name = recipient_dict.get("firestore_collection_name")
+            firestore_ids = recipient_dict.get("firestore_ids")
+            if not collection_name or not firestore_ids:
+                continue
+            fields = tuple(fs_id for id_dict in firestore_ids for fs_id in id_dict)
+            self.index_fields.setdefault(collection_name, set()).add(fields)
+
+        for collection_name in self.index_fields:
+            self.watch_collection(collection_name)
+
+    def watch_collection(self, collection_name):
+        self.indexes.pop(collection_name, None)
+        self.watches[collection_name] = self.db_client.collection(
+            collection_name
+        ).on_snapshot(functools.partial(self.on_snapshot, collection_name))
+        logging.info(f"Listening to changes of Firestore collection {collection_name}")
+
+    def on_snapshot(self, collection_name, docs, changes, read_time):
+        # Rebuilds the indexes of the collection, and swaps them in at once
+        indexes = {}
+        for fields in self.index_fields.get(collection_name, ()):
+            index = {}
+            for doc in docs:
+                try:
+                    values = tuple(doc.get(field) for field in fields)
+                    index.setdefault(values, []).append(doc)
+                except (KeyError, TypeError):
+                    # Documents without the fields, or with unhashable values, never match the configured ids
+                    continue
+            indexes[fields] = index
+        self.indexes[collection_name] = indexes
+
+    def get_indexed_docs(self, collection_name, ids: list):
+        # Returns None when the collection is not (yet) synced by a listener
+        if collection_name not in self.watches:
+            return None
+
+        watch = self.watches[collection_name]
+        if not getattr(watch, "is_active", True):
+            logging.warning(f"Listener of Firestore collection {collection_name} stopped, restarting it")
+            self.watch_collection(collection_name)
+            return None
+
+        indexes = self.indexes.get(collection_name)
+        if indexes is None:
+            return None
+        index = indexes.get(tuple(fs_id for id_dict in ids for fs_id in id_dict))
+        if index is None:
+            return None
+        try:
+            return index.get(tuple(id_dict[fs_id] for id_dict in ids for fs_id in id_dict), [])
+        except TypeError:
+            return None
 
     def get_value(self, collection_name, ids: list, fs_value):
+        result = self.get_local_value(collection_name, ids, fs_value)
+        if result is not None:
+            return result
+
+        result = self.query_value(collection_name, ids, fs_value)
+        self.cache_value(collection_name, ids, fs_value, result)
+        return result
+
+    async def get_value_async(self, collection_name, ids: list, fs_value):
+        # Same as get_value, querying the Firestore with the asyncio client
+        result = self.get_local_value(collection_name, ids, fs_value)
+        if result is not None:
+            return result
+
+        key = self.cache_key(collection_name, ids, fs_value)
+        if key is None:
+            return await self.query_value_async(collection_name, ids, fs_value)
+
+        query = self._pending_queries.get(key)
+        if query is None:
+            query = asyncio.ensure_future(self.query_and_cache_value_async(key, collection_name, ids, fs_value))
+            self._pending_queries[key] = query
+        # A cancelled lookup does not cancel the query the other lookups wait for
+        return await asyncio.shield(query)
+
+    async def query_and_cache_value_async(self, key, collection_name, ids: list, fs_value):
+        try:
+            result = await self.query_value_async(collection_name, ids, fs_value)
+            self.cache_value(collection_name, ids, fs_value, result)
+            return result
+        finally:
+            del self._pending_queries[key]
+
+    def get_local_value(self, collection_name, ids: list, fs_value):
+        # Looks up the value in memory, in the index of a listened collection or in the cache.
+        # Returns None when the Firestore has to be queried.
+        if ids:
+            docs = self.get_indexed_docs(collection_name, ids)
+            if docs is not None:
+                return self.value_from_docs(docs, fs_value, self.query_description(ids))
+
+        key = self.cache_key(collection_name, ids, fs_value)
+        if key is None:
+            return None
+
+        with self._cache_lock:
+            for cache in (self.cache, self.negative_cache):
+                if cache is not None and key in cache:
+                    self.cache_hits += 1
+                    return cache[key]
+            self.cache_misses += 1
+        return None
+
+    def cache_value(self, collection_name, ids: list, fs_value, result):
+        key = self.cache_key(collection_name, ids, fs_value)
+        if key is None:
+            return
+
+        succeeded, _ = result
+        cache = self.cache if succeeded else self.negative_cache
+        if cache is not None:
+            with self._cache_lock:
+                cache[key] = result
+
+    def query_value(self, collection_name, ids: list, fs_value):
         query_fs = self.db_client.collection(collection_name)
 
-        query_ids = ""
         if not ids:
-            return False, query_ids
+            return False, ""
         for id_dict in ids:
             for fs_id in id_dict:
-                value = id_dict[fs_id]
-                query_fs = query_fs.where(fs_id, '==', value)
-                if query_ids:
-                    query_ids = query_ids + f"AND {fs_id} == {value}"
-                else:
-                    query_ids = query_ids + f"{fs_id} == {value}"
+                query_fs = query_fs.where(fs_id, '==', id_dict[fs_id])
 
         docs_fs = query_fs.stream()
 
+        return self.value_from_docs(docs_fs, fs_value, self.query_description(ids))
+
+    async def query_value_async(self, collection_name, ids: list, fs_value):
+        if not ids:
+            return False, ""
+
+        query_fs = self.async_db_client.collection(collection_name)
+        for id_dict in ids:
+            for fs_id in id_dict:
+                query_fs = query_fs.where(fs_id, '==', id_dict[fs_id])
+
+        docs_fs = [doc async for doc in query_fs.stream()]
+
+        return self.value_from_docs(docs_fs, fs_value, self.query_description(ids))
+
+    @staticmethod
+    def value_from_docs(docs_fs, fs_value, query_ids):
         if docs_fs:
             docs = []
             for doc in docs_fs:
@@ -40,3 +230,41 @@ class FirestoreProcessor(object):
                 logging.error(f"Multiple Firestore documents belong to querie {query_ids}")
         # If no value is found, return False with the query
         return False, query_ids
+
+    @staticmethod
+    def query_description(ids: list):
+        query_ids = ""
+        for id_dict in ids:
+            for fs_id in id_dict:
+                value = id_dict[fs_id]
+                if query_ids:
+                    query_ids = query_ids + f"AND {fs_id} == {value}"
+                else:
+                    query_ids = query_ids + f"{fs_id} == {value}"
+        return query_ids
+
+    @staticmethod
+    def cache_key(collection_name, ids: list, fs_value):
+        # Returns None when the lookup can not be cached
+        if not ids:
+            return None
+        key = (
+            collection_name,
+            tuple((fs_id, id_dict[fs_id]) for id_dict in ids for fs_id in id_dict),
+            fs_value,
+        )
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def cache_info(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_rate": self.cache_hits / lookups if lookups else 0.0,
+            "size": len(self.cache or ()),
+            "negative_size": len(self.negative_cache or ()),
+        }
@@ -2,15 +2,28 @@ import datetime
 import json
 import logging
 import os
+import threading
 
+import config
 from config import (HTML_TEMPLATE_PATHS, RECIPIENT_MAPPING,
                     RECIPIENT_MAPPING_MESSAGE_FIELD, SENDER,
                     TEMPLATE_PATH_FIELD, TOPIC_NAME, TOPIC_PROJECT_ID)
-from gobits import Gobits
-from google.cloud import pubsub_v1
-from jinja2 import Template
 
 from .firestoreprocessor import FirestoreProcessor
+from .metrics import Metrics
+from .rendercache import RenderCache
+from .templateengine import TemplateEngine
+
+# Optional: the maximum number of compiled templates kept in memory
+TEMPLATE_CACHE_SIZE = getattr(config, "TEMPLATE_CACHE_SIZE", 50)
+# Optional: the maximum number of rendered bodies and subjects kept in memory, 0 disables caching them
+RENDER_CACHE_SIZE = getattr(config, "RENDER_CACHE_SIZE", 256)
+# Optional: size and time to live (in seconds) of the cache of Firestore recipient lookups
+FIRESTORE_CACHE = getattr(config, "FIRESTORE_CACHE", None)
+# Optional: keep the collections of RECIPIENT_MAPPING in memory, updated by Firestore snapshot listeners
+FIRESTORE_LISTEN = getattr(config, "FIRESTORE_LISTEN", False)
+# Optional: log the stage durations and sizes of every message, and keep counters and histograms of them
+METRICS_ENABLED = getattr(config, "METRICS_ENABLED", False)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -27,25 +40,111 @@ class MessageProcessor(object):
         self.recipient_mapping_message_field = RECIPIENT_MAPPING_MESSAGE_FIELD
         self.recipient_mapping = RECIPIENT_MAPPING
         self.sender = SENDER
-        self.gcp_firestore = FirestoreProcessor()
+        # Clients are created, and templates compiled, on first use instead of on import, see start()
+        self.gcp_firestore = FirestoreProcessor(cache_settings=FIRESTORE_CACHE)
+        self.template_engine = TemplateEngine(
+            self.html_template_paths, cache_size=TEMPLATE_CACHE_SIZE
+        )
+        self.render_cache = RenderCache(max_size=RENDER_CACHE_SIZE)
+        self._started = False
+        self._start_lock = threading.Lock()
+        self.topic_path = "projects/{}/topics/{}".format(
+            self.topic_project_id, self.topic_name
+        )
+        self._publisher = None
+        self._publisher_pid = None
+        self._publisher_lock = threading.Lock()
+        self.metrics = Metrics("msg-to-html-body", METRICS_ENABLED)
+
+    @property
+    def publisher(self):
+        # Created on first use and shared by all messages of this (reused) instance,
+        # recreated when the process was forked after creating it
+        pid = os.getpid()
+        if self._publisher is None or self._publisher_pid != pid:
+            with self._publisher_lock:
+                if self._publisher is None or self._publisher_pid != pid:
+                    from google.cloud import pubsub_v1
+
+                    self._publisher = pubsub_v1.PublisherClient()
+                    self._publisher_pid = pid
+        return self._publisher
+
+    def reset_publisher(self):
+        with self._publisher_lock:
+            self._publisher = None
+            self._publisher_pid = None
+
+    def start(self):
+        # Compiles the configured templates and starts the Firestore listeners, once, when the first message
+        # is processed. Doing this on import would add it to the cold start of every instance.
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self.template_engine.warm_up()
+            if FIRESTORE_LISTEN:
+                self.gcp_firestore.listen(self.recipient_mapping)
+            self._started = True
 
-    def process(self, payload):
+    def process(self, payload, message_metrics=None):
+        self.start()
+        # The measurements of the message can be started by the caller, e.g. to include decoding it
+        if message_metrics is None:
+            message_metrics = self.metrics.message()
+        processed = self.process_message(payload, message_metrics)
+        message_metrics.finish("published" if processed else "rejected")
+        return processed
+
+    def process_message(self, payload, message_metrics):
         # Get message
         message = payload[self.data_selector]
         # Message to HTML body
-        html_body, subject = self.message_to_html(message)
+        with message_metrics.stage("render"):
+            html_body, subject = self.message_to_html(message)
         if not html_body or not subject:
             logging.error("Message was not processed")
             return False
         # Make topic message
+        recipient_mapping_field_message = self.get_recipient_mapping_field(message)
+        if not recipient_mapping_field_message:
+            return False
+        with message_metrics.stage("recipient"):
+            topic_message = self.make_topic_msg(
+                recipient_mapping_field_message, html_body, subject
+            )
+        if not topic_message:
+            logging.error("Topic message was not made")
+            return False
+        # Make gobits
+        from gobits import Gobits
+
+        gobits = Gobits()
+        # Send message to topic
+        with message_metrics.stage("publish"):
+            return_bool = self.publish_to_topic(subject, topic_message, gobits)
+        if return_bool is False:
+            logging.error("Message was not processed")
+            message_metrics.finish("failed")
+            return False
+        else:
+            logging.info("Message was processed")
+        return True
+
+    def get_recipient_mapping_field(self, message):
+        # The value of the message field the recipient is looked up with in RECIPIENT_MAPPING
         count = 0
         for field in message:
             message_root = field
             count = count + 1
+        if count == 0:
+            logging.error("Message does not contain a root")
+            return None
         count_bool = count > 1
         if count_bool:
             logging.error("Message has multiple roots")
-            return False
+            return None
         recipient_mapping_field_dict = message.get(message_root)
         recipient_mapping_field_message = recipient_mapping_field_dict.get(
             self.recipient_mapping_message_field
@@ -54,28 +153,16 @@ class MessageProcessor(object):
             logging.error(
                 f"The field {self.recipient_mapping_message_field} could not be found in the message"
             )
-            return False
-        topic_message = self.make_topic_msg(
-            recipient_mapping_field_message, html_body, subject
-        )
-        if not topic_message:
-            logging.error("Topic message was not made")
-            return False
-        # Make gobits
-        gobits = Gobits()
-        # Send message to topic
-        return_bool = self.publish_to_topic(subject, topic_message, gobits)
-        if return_bool is False:
-            logging.error("Message was not processed")
-            return False
-        else:
-            logging.info("Message was processed")
-        return True
+            return None
+        return recipient_mapping_field_message
 
     def make_topic_msg(self, recipient_mapping_field_message, body, subject):
+        recipient = self.get_recipient(recipient_mapping_field_message)
+        return self.topic_msg(recipient, body, subject)
+
+    def topic_msg(self, recipient, body, subject):
         now = datetime.datetime.now()
         now_iso = now.isoformat()
-        recipient = self.get_recipient(recipient_mapping_field_message)
         if not recipient:
             logging.error(
                 "Something went wrong in getting the recipient from the Firestore"
@@ -93,6 +180,14 @@ class MessageProcessor(object):
         return message
 
     def get_recipient(self, recipient_mapping_field):
+        recipient_query = self.get_recipient_query(recipient_mapping_field)
+        if not recipient_query:
+            return None
+        succeeded, fs_value = self.gcp_firestore.get_value(*recipient_query)
+        return self.recipient_from_value(succeeded, fs_value)
+
+    def get_recipient_query(self, recipient_mapping_field):
+        # The Firestore collection, ids and value field to look up the recipient with
         recipient_dict = self.recipient_mapping.get(recipient_mapping_field)
         if not recipient_dict:
             logging.error(
@@ -116,9 +211,10 @@ class MessageProcessor(object):
                 "'firestore_value' not defined in recipient mapping in config"
             )
             return None
-        succeeded, fs_value = self.gcp_firestore.get_value(
-            collection_name, firestore_ids, firestore_value
-        )
+        return collection_name, firestore_ids, firestore_value
+
+    @staticmethod
+    def recipient_from_value(succeeded, fs_value):
         if succeeded:
             return fs_value
         logging.error(
@@ -193,9 +289,14 @@ class MessageProcessor(object):
                                 arg_value, "%Y%m%d%H%M%S"
                             )
                 kwargs.update({arg_field: arg_value})
-        with open(template_path) as file_:
-            template = Template(file_.read())
-        body = template.render(kwargs)
+        template = self.template_engine.get_template(template_path)
+        # A cached body is only used when it was rendered with the current compiled template
+        cache_key = self.render_cache.make_key("body", temp_msg_field, kwargs)
+        body = self.get_cached_render(cache_key, template)
+        if body is None:
+            body = template.render(kwargs)
+            if body:
+                self.render_cache.put(cache_key, body, template)
         return body
 
     def get_subject(self, template_info, temp_msg_field, message_after_root):
@@ -205,6 +306,21 @@ class MessageProcessor(object):
                 f"Field mail_subject could not be found in field {temp_msg_field}"
             )
             return ""
+        subject_args = {
+            field: message_after_root.get(field)
+            for field in mail_subject
+            if mail_subject[field] == "MESSAGE_FIELD"
+        }
+        cache_key = self.render_cache.make_key("subject", temp_msg_field, subject_args)
+        subject = self.get_cached_render(cache_key, template_info)
+        if subject is None:
+            subject = self.make_subject(mail_subject, message_after_root)
+            if subject:
+                self.render_cache.put(cache_key, subject, template_info)
+        return subject
+
+    @staticmethod
+    def make_subject(mail_subject, message_after_root):
         subject = ""
         for field in mail_subject:
             to_add = ""
@@ -224,16 +340,18 @@ class MessageProcessor(object):
                 subject = to_add
         return subject
 
+    def get_cached_render(self, cache_key, source):
+        value = self.render_cache.get(cache_key, source)
+        if self.metrics.enabled:
+            self.metrics.increment("render_cache_hits" if value is not None else "render_cache_misses")
+        return value
+
     def publish_to_topic(self, subject, message, gobits):
         msg = {"gobits": [gobits.to_json()], "email": message}
         try:
             # Publish to topic
-            publisher = pubsub_v1.PublisherClient()
-            topic_path = "projects/{}/topics/{}".format(
-                self.topic_project_id, self.topic_name
-            )
-            future = publisher.publish(
-                topic_path, bytes(json.dumps(msg).encode("utf-8"))
+            future = self.publisher.publish(
+                self.topic_path, bytes(json.dumps(msg).encode("utf-8"))
             )
             future.add_done_callback(
                 lambda x: logging.debug(
@@ -245,4 +363,6 @@ class MessageProcessor(object):
             logging.exception(
                 "Unable to publish parsed email " + "to topic because of {}".format(e)
             )
+            # Client could be broken, e.g. when its channel was closed on a reused instance
+            self.reset_publisher()
         return False
@@ -0,0 +1,159 @@
+import bisect
+import json
+import logging
+import threading
+import time
+
+# Upper bounds (in milliseconds) of the histogram buckets, the last bucket counts everything above them.
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram(object):
+    # Histogram of durations, with fixed buckets
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        buckets = {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {"count": self.count, "sum": self.sum, "max": self.max, "buckets": buckets}
+
+
+class Metrics(object):
+    # In-process counters and histograms of the processed messages
+    # When disabled, message() returns a shared no-op object, so instrumented code costs (almost) nothing
+
+    def __init__(self, name, enabled=False):
+        # The name of the function is added to every log line
+        self.name = name
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def message(self):
+        # Starts measuring a message, call finish() on the result when the message is processed
+        if not self.enabled:
+            return NULL_MESSAGE_METRICS
+
+        return MessageMetrics(self)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            }
+
+
+class MessageMetrics(object):
+    # Stage durations and sizes of a single message
+
+    __slots__ = ("metrics", "start", "stages", "sizes", "finished")
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.sizes = {}
+        self.finished = False
+
+    def stage(self, name):
+        # Times a stage, as a context manager. The durations of a stage that is entered more than once are summed
+        return StageTimer(self, name)
+
+    def size(self, name, value):
+        self.sizes[name] = value
+
+    def finish(self, status):
+        # Records the measurements of the message and logs them as a single JSON line.
+        # Only the first call has effect, so a message can be finished early with a more specific status
+        if self.finished:
+            return
+        self.finished = True
+
+        total = (time.perf_counter() - self.start) * 1000
+
+        self.metrics.increment(f"messages_{status}")
+        self.metrics.observe("total_ms", total)
+        for name, duration in self.stages.items():
+            self.metrics.observe(f"{name}_ms", duration)
+        for name, value in self.sizes.items():
+            self.metrics.increment(name, value)
+
+        logging.info(json.dumps({
+            "metrics": self.metrics.name,
+            "status": status,
+            "total_ms": round(total, 3),
+            "stages_ms": {name: round(duration, 3) for name, duration in self.stages.items()},
+            "sizes": self.sizes,
+        }))
+
+
+class StageTimer(object):
+    __slots__ = ("message_metrics", "name", "start")
+
+    def __init__(self, message_metrics, name):
+        self.message_metrics = message_metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stages = self.message_metrics.stages
+        stages[self.name] = stages.get(self.name, 0.0) + (time.perf_counter() - self.start) * 1000
+        return False
+
+
+class NullMessageMetrics(object):
+    # Measurements of a message when metrics are disabled, doing nothing
+
+    __slots__ = ()
+
+    def stage(self, name):
+        return NULL_STAGE_TIMER
+
+    def size(self, name, value):
+        pass
+
+    def finish(self, status):
+        pass
+
+
+class NullStageTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_MESSAGE_METRICS = NullMessageMetrics()
+NULL_STAGE_TIMER = NullStageTimer()
@@ -0,0 +1,62 @@
+import json
+import threading
+
+from cachetools import LRUCache
+
+
+class RenderCache(object):
+    # Bounded LRU of rendered template bodies and subjects, keyed on the template key and the resolved arguments.
+    # Messages resolving to the same template with the same arguments (e.g. repeated status notifications of the same
+    # ticket) are only rendered once. A max_size of 0 disables the cache.
+
+    def __init__(self, max_size=256):
+        self.cache = LRUCache(maxsize=max_size) if max_size else None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(kind, template_key, kwargs):
+        # The arguments are serialised with sorted keys, values that are not JSON (e.g. datetimes) by their string.
+        # Returns None when the arguments can not be serialised, the value is then not cached.
+        try:
+            return kind, template_key, json.dumps(kwargs, sort_keys=True, default=str)
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, key, source=None):
+        # Returns the cached value, or None. An entry stored for another source (e.g. a template that was
+        # recompiled since, because its file changed) is stale, and counts as a miss.
+        if self.cache is None or key is None:
+            return None
+
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] is source:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def put(self, key, value, source=None):
+        if self.cache is None or key is None:
+            return
+
+        with self._lock:
+            self.cache[key] = (source, value)
+
+    def clear(self):
+        if self.cache is None:
+            return
+
+        with self._lock:
+            self.cache.clear()
+
+    def info(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.cache or ()),
+        }
@@ -0,0 +1,50 @@
+import logging
+import os
+import threading
+
+logging.basicConfig(level=logging.INFO)
+
+
+class TemplateEngine(object):
+    def __init__(self, template_paths, cache_size=50):
+        self.root = os.path.abspath(os.sep)
+        self.cache_size = cache_size
+        self.template_paths = template_paths
+        self._environment = None
+        self._environment_lock = threading.Lock()
+
+    @property
+    def environment(self):
+        # Templates are loaded by their absolute path, relative paths are resolved against the working directory
+        # like open() does. The environment keeps a bounded LRU of compiled templates, which are reloaded when the
+        # modification time of their file changes. Compiled bytecode is cached on disk for the next cold start.
+        # It is created on first use, Jinja2 is only imported then to keep it out of the cold start.
+        if self._environment is None:
+            with self._environment_lock:
+                if self._environment is None:
+                    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+                    self._environment = Environment(
+                        loader=FileSystemLoader(self.root),
+                        bytecode_cache=FileSystemBytecodeCache(),
+                        cache_size=self.cache_size,
+                        auto_reload=True,
+                    )
+        return self._environment
+
+    def warm_up(self):
+        # Compile all configured templates, so the first messages only have to render them
+        for template_field, template_info in (self.template_paths or {}).items():
+            template_path = template_info.get("template_path")
+            if not template_path:
+                continue
+            try:
+                self.get_template(template_path)
+            except Exception as e:
+                logging.error(
+                    f"Template {template_path} of field {template_field} could not be compiled: {e}"
+                )
+
+    def get_template(self, template_path):
+        template_name = os.path.relpath(os.path.abspath(template_path), self.root)
+        return self.environment.get_template(template_name.replace(os.sep, "/"))
@@ -0,0 +1,92 @@
+"""
+Pulls messages from a Pub/Sub subscription, and processes them concurrently with the AsyncMessageProcessor.
+
+Processes the same messages as the msg_to_html_body function. While one message waits for its Firestore lookup or
+publish, others are rendered. Messages that raised an exception are negatively acknowledged, so they are delivered
+again, like the function does by failing the request.
+
+Run from the msg-to-html-body directory (a config.py has to be present):
+    python pull_worker.py --subscription projects/{project}/subscriptions/{subscription} --max-messages 100
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+
+from google.api_core import exceptions
+from google.cloud import pubsub_v1
+
+from messageprocessor import AsyncMessageProcessor
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def process_messages(processor, received_messages):
+    # Returns the ack ids of the messages that can be acknowledged, and of the ones that can not
+    payloads = []
+    nack_ids = []
+    ack_ids = []
+    for received_message in received_messages:
+        try:
+            payloads.append((received_message.ack_id, json.loads(received_message.message.data)))
+        except ValueError as e:
+            logging.error(f"Message {received_message.ack_id} could not be decoded: {e}")
+            nack_ids.append(received_message.ack_id)
+
+    results = await processor.process_many([payload for _, payload in payloads])
+    for (ack_id, _), result in zip(payloads, results):
+        # A cancelled message raised CancelledError, which is not an Exception
+        if isinstance(result, BaseException):
+            logging.error(f"Message {ack_id} could not be processed: {result}")
+            nack_ids.append(ack_id)
+        else:
+            ack_ids.append(ack_id)
+
+    return ack_ids, nack_ids
+
+
+async def pull_batches(subscription, max_messages, timeout, concurrency):
+    # All batches are processed in the same event loop, which the asyncio Firestore client is bound to. The blocking
+    # subscriber calls run in a thread.
+    subscriber = pubsub_v1.SubscriberClient()
+    processor = AsyncMessageProcessor(concurrency=concurrency)
+    loop = asyncio.get_running_loop()
+
+    while True:
+        try:
+            response = await loop.run_in_executor(None, functools.partial(
+                subscriber.pull, request={"subscription": subscription, "max_messages": max_messages}, timeout=timeout
+            ))
+        except exceptions.DeadlineExceeded:
+            continue
+
+        if not response.received_messages:
+            continue
+
+        ack_ids, nack_ids = await process_messages(processor, response.received_messages)
+
+        if ack_ids:
+            await loop.run_in_executor(None, functools.partial(
+                subscriber.acknowledge, request={"subscription": subscription, "ack_ids": ack_ids}
+            ))
+        if nack_ids:
+            await loop.run_in_executor(None, functools.partial(
+                subscriber.modify_ack_deadline,
+                request={"subscription": subscription, "ack_ids": nack_ids, "ack_deadline_seconds": 0}
+            ))
+
+        logging.info(
+            f"Processed batch of {len(response.received_messages)} messages, {len(nack_ids)} not acknowledged"
+        )
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-s", "--subscription", required=True)
+    argparser.add_argument("-m", "--max-messages", type=int, default=100)
+    argparser.add_argument("-t", "--timeout", type=float, default=60)
+    argparser.add_argument("-c", "--concurrency", type=int, default=None,
+                           help="Messages processed at the same time (default ASYNC_CONCURRENCY or 10)")
+    args = argparser.parse_args()
+    asyncio.run(pull_batches(args.subscription, args.max_messages, args.timeout, args.concurrency))
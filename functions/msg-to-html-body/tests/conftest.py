@@ -0,0 +1,173 @@
+import asyncio
+import concurrent.futures
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+import pytest
+
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+FUNCTION_DIRECTORY = os.path.dirname(TESTS_DIRECTORY)
+
+sys.path.insert(0, FUNCTION_DIRECTORY)
+os.environ.setdefault("DATA_SELECTOR", "data")
+
+# The tests run with the example configuration, with a template and recipient mapping of their own.
+loader = importlib.machinery.SourceFileLoader("config", os.path.join(FUNCTION_DIRECTORY, "config.py.example"))
+config = importlib.util.module_from_spec(importlib.util.spec_from_loader("config", loader))
+loader.exec_module(config)
+config.TEMPLATE_PATH_FIELD = "template"
+config.HTML_TEMPLATE_PATHS = {
+    "notification": {
+        "template_path": os.path.join(TESTS_DIRECTORY, "templates", "notification.html"),
+        "template_args": {"ticket": {"ticket": "MESSAGE_FIELD"}},
+        "mail_subject": {"Update of ticket ": "HARDCODED", "ticket": "MESSAGE_FIELD"},
+    }
+}
+config.RECIPIENT_MAPPING_MESSAGE_FIELD = "team"
+config.RECIPIENT_MAPPING = {
+    team: {
+        "firestore_collection_name": "recipients",
+        "firestore_ids": [{"team": team}],
+        "firestore_value": "email",
+    }
+    for team in ("a", "b", "unknown")
+}
+config.FIRESTORE_LISTEN = False
+config.METRICS_ENABLED = False
+sys.modules["config"] = config
+
+
+def payload(team, ticket="1"):
+    return {"data": {"email": {"template": "notification", "team": team, "ticket": ticket}}}
+
+
+class FakeDocumentSnapshot(object):
+    def __init__(self, data):
+        self._data = data
+
+    def get(self, field):
+        # Like a Firestore document snapshot, a missing field raises a KeyError
+        return self._data[field]
+
+
+class FakeWatch(object):
+    is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+
+
+class FakeQuery(object):
+    def __init__(self, client, collection_name, filters=()):
+        self.client = client
+        self.collection_name = collection_name
+        self.filters = filters
+
+    def where(self, field, op, value):
+        assert op == "=="
+        return type(self)(self.client, self.collection_name, self.filters + ((field, value),))
+
+    def documents(self):
+        return [
+            FakeDocumentSnapshot(document)
+            for document in self.client.collections.get(self.collection_name, [])
+            if all(field in document and document[field] == value for field, value in self.filters)
+        ]
+
+    def stream(self):
+        self.client.queries += 1
+        return iter(self.documents())
+
+    def on_snapshot(self, callback):
+        watch = FakeWatch()
+        self.client.listeners.setdefault(self.collection_name, []).append((callback, watch))
+        callback(self.documents(), [], None)
+        return watch
+
+
+class FakeFirestoreClient(object):
+    """
+    In-memory Firestore client with collections of documents (dictionaries), counting the queries.
+    """
+
+    def __init__(self, collections=None):
+        self.collections = collections if collections is not None else {}
+        self.listeners = {}
+        self.queries = 0
+
+    def collection(self, collection_name):
+        return FakeQuery(self, collection_name)
+
+    def set_documents(self, collection_name, documents):
+        # Replaces the documents of a collection, and sends a snapshot of them to its active listeners
+        self.collections[collection_name] = documents
+        for callback, watch in self.listeners.get(collection_name, []):
+            if watch.is_active:
+                callback(FakeQuery(self, collection_name).documents(), [], None)
+
+
+class FakeAsyncQuery(FakeQuery):
+    async def stream(self):
+        self.client.queries += 1
+        # Other lookups run while the query waits for the Firestore
+        await asyncio.sleep(self.client.latency)
+        for document in self.documents():
+            yield document
+
+
+class FakeAsyncFirestoreClient(FakeFirestoreClient):
+    def __init__(self, collections=None, latency=0.01):
+        super().__init__(collections)
+        self.latency = latency
+
+    def collection(self, collection_name):
+        return FakeAsyncQuery(self, collection_name)
+
+
+class FakePublisherClient(object):
+    """
+    Pub/Sub publisher keeping the published messages. The future of a publish is completed with the next result.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.results = []
+
+    def publish(self, topic, data, **attributes):
+        self.messages.append(data)
+        future = concurrent.futures.Future()
+        result = self.results.pop(0) if self.results else str(len(self.messages))
+        if result == "cancel":
+            future.cancel()
+        elif isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+        return future
+
+
+RECIPIENTS = {"recipients": [{"team": "a", "email": "a@example.com"}, {"team": "b", "email": "b@example.com"}]}
+
+
+@pytest.fixture
+def db_client():
+    return FakeFirestoreClient({name: list(documents) for name, documents in RECIPIENTS.items()})
+
+
+@pytest.fixture
+def async_db_client():
+    return FakeAsyncFirestoreClient({name: list(documents) for name, documents in RECIPIENTS.items()})
+
+
+@pytest.fixture
+def publisher(monkeypatch):
+    """
+    The publisher every MessageProcessor creates, also after resetting it.
+    """
+    from messageprocessor import MessageProcessor
+
+    publisher = FakePublisherClient()
+    monkeypatch.setattr(MessageProcessor, "publisher", property(lambda self: publisher))
+    return publisher
@@ -0,0 +1,92 @@
+"""
+Tests of the AsyncMessageProcessor and the pull worker, with fake Pub/Sub and Firestore clients.
+"""
+import asyncio
+import json
+import types
+
+import pytest
+from conftest import payload
+
+from messageprocessor import AsyncMessageProcessor
+
+
+@pytest.fixture
+def processor(async_db_client, publisher):
+    processor = AsyncMessageProcessor(concurrency=3)
+    processor.gcp_firestore.async_db_client = async_db_client
+    return processor
+
+
+def published_emails(publisher):
+    return [json.loads(data)["email"] for data in publisher.messages]
+
+
+def test_process_many(processor, publisher):
+    results = asyncio.run(processor.process_many([payload("a", "1"), payload("b", "2"), payload("unknown", "3")]))
+
+    # The recipient of the last message is not in the Firestore
+    assert results == [True, True, False]
+    assert [(email["recipient"], email["subject"]) for email in published_emails(publisher)] == [
+        ("a@example.com", "Update of ticket 1"), ("b@example.com", "Update of ticket 2")
+    ]
+    assert published_emails(publisher)[0]["body"] == "<p>Ticket 1 has been updated.</p>"
+
+
+def test_failed_publish_resets_publisher(processor, publisher, monkeypatch):
+    resets = []
+    monkeypatch.setattr(processor, "reset_publisher", lambda: resets.append(True))
+    publisher.results = [RuntimeError("Publishing failed")]
+
+    assert asyncio.run(processor.process_many([payload("a"), payload("b")])) == [False, True]
+    assert resets == [True]
+
+
+def test_concurrent_lookups_of_the_same_recipient_are_coalesced(processor, async_db_client):
+    results = asyncio.run(processor.process_many([payload("a", str(ticket)) for ticket in range(3)]))
+
+    assert results == [True, True, True]
+    assert async_db_client.queries == 1
+    assert processor.gcp_firestore._pending_queries == {}
+
+    # Without caching, a later lookup queries the Firestore again
+    asyncio.run(processor.process_many([payload("a"), payload("b")]))
+    assert async_db_client.queries == 3
+
+
+def test_coalesced_lookup_is_not_cancelled_with_one_of_its_waiters(processor, async_db_client):
+    gcp_firestore = processor.gcp_firestore
+
+    async def lookups():
+        query = processor.get_recipient_query("a")
+        first = asyncio.ensure_future(gcp_firestore.get_value_async(*query))
+        second = asyncio.ensure_future(gcp_firestore.get_value_async(*query))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    first, second = asyncio.run(lookups())
+    assert isinstance(first, asyncio.CancelledError)
+    assert second == (True, "a@example.com")
+    assert async_db_client.queries == 1
+
+
+def test_pull_worker_does_not_acknowledge_cancelled_or_failed_messages(processor, publisher):
+    pull_worker = pytest.importorskip("pull_worker")
+
+    def received_message(ack_id, data):
+        return types.SimpleNamespace(ack_id=ack_id, message=types.SimpleNamespace(data=data))
+
+    publisher.results = ["1", "cancel"]
+    received_messages = [
+        received_message("published", json.dumps(payload("a"))),
+        received_message("cancelled", json.dumps(payload("b"))),
+        received_message("rejected", json.dumps(payload("unknown"))),
+        received_message("undecodable", "{"),
+        received_message("failed", json.dumps({"no data": {}})),
+    ]
+
+    ack_ids, nack_ids = asyncio.run(pull_worker.process_messages(processor, received_messages))
+
+    assert ack_ids == ["published", "rejected"]
+    assert sorted(nack_ids) == ["cancelled", "failed", "undecodable"]
@@ -0,0 +1,142 @@
+"""
+Tests of the FirestoreProcessor caches and snapshot listener indexes, with an in-memory Firestore client.
+"""
+import pytest
+from cachetools import TTLCache
+from conftest import RECIPIENTS
+
+from messageprocessor.firestoreprocessor import FirestoreProcessor
+
+RECIPIENT_MAPPING = {
+    "a": {"firestore_collection_name": "recipients", "firestore_ids": [{"team": "a"}], "firestore_value": "email"},
+    "b": {"firestore_collection_name": "recipients", "firestore_ids": [{"team": "b"}], "firestore_value": "email"},
+}
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def cached_processor(db_client, clock):
+    processor = FirestoreProcessor(cache_settings={"max_size": 2, "ttl": 60, "negative_ttl": 10}, db_client=db_client)
+    # The same caches, on a clock of the test
+    processor.cache = TTLCache(maxsize=2, ttl=60, timer=clock)
+    processor.negative_cache = TTLCache(maxsize=2, ttl=10, timer=clock)
+    return processor
+
+
+def lookup(processor, team):
+    return processor.get_value("recipients", [{"team": team}], "email")
+
+
+def test_not_cached_by_default(db_client):
+    processor = FirestoreProcessor(db_client=db_client)
+
+    assert processor.cache is None and processor.negative_cache is None
+    assert lookup(processor, "a") == (True, "a@example.com")
+    assert lookup(processor, "a") == (True, "a@example.com")
+    assert db_client.queries == 2
+
+
+def test_found_values_are_cached_for_ttl(cached_processor, db_client, clock):
+    assert lookup(cached_processor, "a") == (True, "a@example.com")
+    db_client.collections["recipients"][0] = {"team": "a", "email": "new-a@example.com"}
+
+    clock.now = 59
+    assert lookup(cached_processor, "a") == (True, "a@example.com")
+    assert db_client.queries == 1
+
+    clock.now = 61
+    assert lookup(cached_processor, "a") == (True, "new-a@example.com")
+    assert db_client.queries == 2
+    assert cached_processor.cache_info() == {
+        "hits": 1, "misses": 2, "hit_rate": 1 / 3, "size": 1, "negative_size": 0
+    }
+
+
+def test_missing_values_are_cached_for_negative_ttl(cached_processor, db_client, clock):
+    assert lookup(cached_processor, "c") == (False, "team == c")
+    db_client.collections["recipients"].append({"team": "c", "email": "c@example.com"})
+
+    clock.now = 9
+    assert lookup(cached_processor, "c") == (False, "team == c")
+    assert db_client.queries == 1
+
+    clock.now = 11
+    assert lookup(cached_processor, "c") == (True, "c@example.com")
+    assert cached_processor.cache_info()["negative_size"] == 0
+
+
+def test_least_recently_used_value_is_evicted(cached_processor, db_client):
+    db_client.collections["recipients"].append({"team": "c", "email": "c@example.com"})
+    for team in ["a", "b", "a", "c"]:
+        lookup(cached_processor, team)
+    assert db_client.queries == 3
+
+    # "b" was evicted for "c", "a" was used more recently
+    lookup(cached_processor, "a")
+    assert db_client.queries == 3
+    lookup(cached_processor, "b")
+    assert db_client.queries == 4
+
+
+def test_multiple_documents_are_not_a_recipient(db_client):
+    db_client.collections["recipients"].append({"team": "a", "email": "other-a@example.com"})
+    processor = FirestoreProcessor(db_client=db_client)
+
+    assert lookup(processor, "a") == (False, "team == a")
+
+
+def test_listened_collections_are_looked_up_in_memory(db_client):
+    processor = FirestoreProcessor(db_client=db_client)
+    processor.listen(RECIPIENT_MAPPING)
+
+    assert lookup(processor, "a") == (True, "a@example.com")
+    assert lookup(processor, "c") == (False, "team == c")
+    assert db_client.queries == 0
+
+    # Snapshots replace the indexes
+    db_client.set_documents("recipients", RECIPIENTS["recipients"] + [{"team": "c", "email": "c@example.com"}])
+    assert lookup(processor, "c") == (True, "c@example.com")
+    db_client.set_documents("recipients", [{"team": "a", "email": "new-a@example.com"}, {"email": "no team"}])
+    assert lookup(processor, "a") == (True, "new-a@example.com")
+    assert lookup(processor, "b") == (False, "team == b")
+    assert db_client.queries == 0
+
+
+def test_get_indexed_docs(db_client):
+    processor = FirestoreProcessor(db_client=db_client)
+
+    # Not listened to
+    assert processor.get_indexed_docs("recipients", [{"team": "a"}]) is None
+
+    processor.listen(RECIPIENT_MAPPING)
+    assert [doc.get("email") for doc in processor.get_indexed_docs("recipients", [{"team": "a"}])] == ["a@example.com"]
+    assert processor.get_indexed_docs("recipients", [{"team": "c"}]) == []
+    # Not indexed by these ids, or with an unhashable value
+    assert processor.get_indexed_docs("recipients", [{"email": "a@example.com"}]) is None
+    assert processor.get_indexed_docs("recipients", [{"team": ["a"]}]) is None
+    assert processor.get_indexed_docs("other", [{"team": "a"}]) is None
+
+
+def test_stopped_listener_is_restarted(db_client):
+    processor = FirestoreProcessor(db_client=db_client)
+    processor.listen(RECIPIENT_MAPPING)
+    processor.watches["recipients"].unsubscribe()
+
+    # The restarted listener gets a new snapshot, the lookup that found it stopped queries the Firestore
+    assert lookup(processor, "a") == (True, "a@example.com")
+    assert db_client.queries == 1
+    assert processor.watches["recipients"].is_active
+    assert lookup(processor, "a") == (True, "a@example.com")
+    assert db_client.queries == 1
@@ -0,0 +1,74 @@
+"""
+Tests of caching rendered bodies and subjects in the MessageProcessor.
+"""
+import json
+import os
+
+import pytest
+from conftest import payload
+
+from messageprocessor import MessageProcessor
+from messageprocessor.rendercache import RenderCache
+
+
+@pytest.fixture
+def processor(db_client, publisher):
+    processor = MessageProcessor()
+    processor.gcp_firestore.db_client = db_client
+    return processor
+
+
+def published_bodies(publisher):
+    return [json.loads(data)["email"]["body"] for data in publisher.messages]
+
+
+def test_identical_messages_are_rendered_once(processor, publisher):
+    for ticket in ["1", "1", "2", "1"]:
+        assert processor.process(payload("a", ticket))
+
+    assert processor.render_cache.info() == {"hits": 4, "misses": 4, "hit_rate": 0.5, "size": 4}
+    assert published_bodies(publisher) == [f"<p>Ticket {ticket} has been updated.</p>" for ticket in "1121"]
+
+
+def test_changed_template_is_rendered_again(processor, publisher, tmp_path):
+    template_path = tmp_path / "template.html"
+    template_path.write_text("<p>{{ ticket }}</p>")
+    template_info = dict(processor.html_template_paths["notification"], template_path=str(template_path))
+    processor.html_template_paths = {"notification": template_info}
+
+    processor.process(payload("a"))
+    template_path.write_text("<b>{{ ticket }}</b>")
+    modified = os.path.getmtime(template_path) + 10
+    os.utime(template_path, (modified, modified))
+    processor.process(payload("a"))
+
+    assert published_bodies(publisher) == ["<p>1</p>", "<b>1</b>"]
+
+
+def test_disabled_cache(processor, publisher):
+    processor.render_cache = RenderCache(max_size=0)
+    processor.process(payload("a"))
+    processor.process(payload("a"))
+
+    assert processor.render_cache.info() == {"hits": 0, "misses": 0, "hit_rate": 0.0, "size": 0}
+    assert len(publisher.messages) == 2
+
+
+def test_keys():
+    circular = {}
+    circular["self"] = circular
+
+    assert RenderCache.make_key("body", "t", {"b": 1, "a": 2}) == RenderCache.make_key("body", "t", {"a": 2, "b": 1})
+    assert RenderCache.make_key("body", "t", {"a": 1}) != RenderCache.make_key("subject", "t", {"a": 1})
+    assert RenderCache.make_key("body", "t", {"a": circular}) is None
+
+
+def test_entries_of_another_source_are_stale():
+    cache = RenderCache(max_size=1)
+    source = object()
+    cache.put(("body", "t", "{}"), "value", source)
+
+    assert cache.get(("body", "t", "{}"), source) == "value"
+    assert cache.get(("body", "t", "{}"), object()) is None
+    cache.put(("body", "u", "{}"), "other", source)
+    assert cache.get(("body", "t", "{}"), source) is None
@@ -0,0 +1,70 @@
+"""
+Tests of compiling templates once with the cached Jinja environment of the TemplateEngine.
+"""
+import logging
+import os
+
+import pytest
+
+from messageprocessor.templateengine import TemplateEngine
+
+
+@pytest.fixture
+def template_path(tmp_path):
+    path = tmp_path / "template.html"
+    path.write_text("<p>{{ value }}</p>")
+    return str(path)
+
+
+def test_templates_are_compiled_once(template_path):
+    engine = TemplateEngine({})
+
+    template = engine.get_template(template_path)
+    assert template.render(value=1) == "<p>1</p>"
+    assert engine.get_template(template_path) is template
+    # Relative paths are resolved against the working directory
+    assert engine.get_template(os.path.relpath(template_path)) is template
+
+
+def test_changed_templates_are_recompiled(template_path):
+    engine = TemplateEngine({})
+    template = engine.get_template(template_path)
+
+    with open(template_path, "w") as template_file:
+        template_file.write("<b>{{ value }}</b>")
+    modified = os.path.getmtime(template_path) + 10
+    os.utime(template_path, (modified, modified))
+
+    changed_template = engine.get_template(template_path)
+    assert changed_template is not template
+    assert changed_template.render(value=1) == "<b>1</b>"
+
+
+def test_least_recently_used_template_is_evicted(tmp_path):
+    engine = TemplateEngine({}, cache_size=1)
+    paths = []
+    for name in ["a", "b"]:
+        path = tmp_path / f"{name}.html"
+        path.write_text(name)
+        paths.append(str(path))
+
+    template = engine.get_template(paths[0])
+    engine.get_template(paths[1])
+    assert engine.get_template(paths[0]) is not template
+
+
+def test_warm_up_compiles_the_configured_templates(template_path, tmp_path, caplog):
+    broken_path = tmp_path / "broken.html"
+    broken_path.write_text("{% if %}")
+    engine = TemplateEngine({
+        "ok": {"template_path": template_path},
+        "broken": {"template_path": str(broken_path)},
+        "missing": {"template_path": str(tmp_path / "missing.html")},
+        "no path": {},
+    })
+
+    with caplog.at_level(logging.ERROR):
+        engine.warm_up()
+
+    assert len(caplog.records) == 2
+    assert engine.get_template(template_path) is engine.get_template(template_path)